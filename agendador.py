@@ -0,0 +1,100 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+
+import bancos
+
+# Pré-cálculo em segundo plano das análises de todas as seções assim que um
+# banco é carregado. As tarefas entram em uma fila de prioridade atendida por
+# um pool de threads: as da seção visível passam na frente das demais. O
+# resultado de cada tarefa vai para o cache compartilhado (bancos.cache), que é
+# de onde a página lê; se a página pedir uma análise que um trabalhador está
+# calculando, o cache faz a página esperar por ela em vez de recalcular, e se a
+# tarefa ainda nem começou, a própria página a calcula.
+# Threads e não processos: as tabelas já carregadas são compartilhadas somente
+# leitura sem cópia, e o trabalho pesado (pandas, numpy, SQLite) libera o GIL.
+
+TRABALHADORES = int(os.environ.get('AGENDADOR_TRABALHADORES', min(4, os.cpu_count() or 1)))
+
+PRIORIDADE_VISIVEL = 0
+PRIORIDADE_FUNDO = 1
+
+logger = logging.getLogger(__name__)
+
+
+class Agendador:
+    def __init__(self, trabalhadores=TRABALHADORES):
+        self.trabalhadores = trabalhadores
+        self._fila = queue.PriorityQueue()
+        self._ordem = itertools.count()
+        self._pendentes = {}
+        self._calculando = set()
+        self._grupos = {}
+        self._trava = threading.Lock()
+        self._threads = []
+
+    def _iniciar_trabalhadores(self):
+        while len(self._threads) < self.trabalhadores:
+            thread = threading.Thread(target=self._trabalhar, name=f'agendador-{len(self._threads)}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def agendar(self, grupo, tarefas):
+        # tarefas: [(chave, calcular, prioridade)]. Um grupo (ex.: a sessão) troca
+        # o seu plano a cada rerun: o que ele pedia antes e não pede mais sai da fila
+        with self._trava:
+            chaves = {chave for chave, _, _ in tarefas}
+            anteriores = self._grupos.get(grupo, set())
+            self._grupos[grupo] = chaves
+            em_uso = set().union(*(c for g, c in self._grupos.items() if g != grupo))
+            for chave in anteriores - chaves - em_uso:
+                self._pendentes.pop(chave, None)
+            for chave, calcular, prioridade in tarefas:
+                if bancos.cache.contem(chave):
+                    continue
+                # Uma chave já na fila com prioridade menor ganha uma nova entrada;
+                # a que sobrar é ignorada quando sair da fila
+                atual = self._pendentes.get(chave)
+                if atual is not None and atual[1] <= prioridade:
+                    continue
+                self._pendentes[chave] = (calcular, prioridade)
+                self._fila.put((prioridade, next(self._ordem), chave))
+            self._descartar_grupos_concluidos()
+            self._iniciar_trabalhadores()
+
+    def _descartar_grupos_concluidos(self):
+        # Um grupo sem tarefas na fila nem em cálculo sai do registro, então
+        # sessões encerradas não se acumulam (o próximo rerun o registra de novo)
+        for grupo in [g for g, chaves in self._grupos.items()
+                      if not any(c in self._pendentes or c in self._calculando for c in chaves)]:
+            del self._grupos[grupo]
+
+    def _trabalhar(self):
+        while True:
+            prioridade, _, chave = self._fila.get()
+            with self._trava:
+                pendente = self._pendentes.get(chave)
+                if pendente is None or pendente[1] != prioridade:
+                    continue
+                del self._pendentes[chave]
+                self._calculando.add(chave)
+            try:
+                bancos.cache.obter(chave, pendente[0])
+            except Exception:
+                # A página recalcula a análise ao exibi-la e mostra o erro por lá
+                logger.exception("Falha no pré-cálculo de %s", chave[1:])
+            finally:
+                with self._trava:
+                    self._calculando.discard(chave)
+                    self._descartar_grupos_concluidos()
+
+    def progresso(self, grupo):
+        # (análises prontas no cache, total planejado) para o grupo
+        with self._trava:
+            chaves = self._grupos.get(grupo, set())
+        return sum(bancos.cache.contem(c) for c in chaves), len(chaves)
+
+
+agendador = Agendador()
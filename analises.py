@@ -0,0 +1,189 @@
+import numpy as np
+import pandas as pd
+from datetime import timedelta
+
+import atribuicao
+import rfm
+
+# Motor de referência: cada análise recebe o dicionário de tabelas normalizado
+# por tabelas.carregar_tabelas (datas em datetime64, chaves de período prontas)
+# e devolve apenas o DataFrame de resultado. As tabelas de entrada são
+# compartilhadas entre sessões e nunca são alteradas.
+
+MESES = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun',
+         'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
+
+
+def rotulo_mes(indice):
+    # Índice de mês absoluto (ano * 12 + mês - 1) -> 'YYYY-MM'
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in indice]
+
+
+def contagens(tables):
+    return {nome: len(df) for nome, df in tables.items()}
+
+
+def amostra(tables, tabela, n=5):
+    return tables[tabela].head(n)
+
+
+def receita_total(tables):
+    return tables['vendas']['valor_total'].sum()
+
+
+def vendas_por_canal(tables, dias=90):
+    vendas = tables['vendas']
+    data_limite = vendas['data_venda'].max() - timedelta(days=dias)
+    vendas_periodo = vendas[vendas['data_venda'] >= data_limite]
+    return vendas_periodo.groupby('canal_aquisicao', observed=True)['valor_total'].sum().reset_index()
+
+
+def top_produtos(tables, n=5):
+    vendas = tables['vendas']
+    produtos = tables['produtos']
+    vendas_produtos = vendas.groupby('id_produto').agg({
+        'quantidade': 'sum',
+        'valor_total': 'sum'
+    }).reset_index()
+    vendas_produtos = vendas_produtos.merge(produtos, left_on='id_produto', right_on='id_produto')
+    vendas_produtos['margem_lucro'] = ((vendas_produtos['preco_unitario'] - vendas_produtos['custo_unitario']) / vendas_produtos['preco_unitario']) * 100
+    return vendas_produtos.nlargest(n, 'quantidade')[['nome_produto', 'quantidade', 'valor_total', 'margem_lucro']]
+
+
+def ticket_medio_segmento(tables):
+    vendas_clientes = tables['vendas'].merge(tables['clientes'], left_on='id_cliente', right_on='id_cliente')
+    return vendas_clientes.groupby('segmento', observed=True)['valor_total'].mean().reset_index()
+
+
+def vendas_mensais(tables):
+    resultado = tables['vendas'].groupby('mes')['valor_total'].sum().reset_index()
+    resultado['nome_mes'] = [MESES[i-1] for i in resultado['mes']]
+    return resultado
+
+
+def eficiencia_campanhas(tables):
+    campanhas = tables['campanhas']
+    interacoes = tables['interacoes']
+    conversoes = interacoes[interacoes['tipo_interacao'] == 'Conversão'].groupby('id_campanha').size().reset_index(name='conversoes')
+    total_interacoes = interacoes.groupby('id_campanha').size().reset_index(name='total_interacoes')
+    eficiencia = conversoes.merge(total_interacoes, on='id_campanha')
+    eficiencia['taxa_conversao'] = (eficiencia['conversoes'] / eficiencia['total_interacoes']) * 100
+    return eficiencia.merge(campanhas, left_on='id_campanha', right_on='id_campanha')
+
+
+def engajamento_canais(tables):
+    camp_interacoes = tables['interacoes'].merge(tables['campanhas'], left_on='id_campanha', right_on='id_campanha')
+    return camp_interacoes.groupby('canal_marketing', observed=True).size().reset_index(name='total_interacoes')
+
+
+def vendas_top_produtos_mensais(tables, n=3):
+    vendas = tables['vendas'][['id_produto', 'mes_indice', 'quantidade']]
+    vendas_produtos = vendas.merge(tables['produtos'][['id_produto', 'nome_produto']], on='id_produto')
+    mensais = vendas_produtos.groupby(['mes_indice', 'nome_produto']).agg({
+        'quantidade': 'sum'
+    }).reset_index()
+    top = vendas_produtos.groupby('nome_produto')['quantidade'].sum().nlargest(n).index
+    mensais = mensais[mensais['nome_produto'].isin(top)].copy()
+    mensais.insert(0, 'mes_ano', rotulo_mes(mensais.pop('mes_indice')))
+    return mensais
+
+
+def atribuicao_campanhas(tables, modelo='ultimo_toque', janela_dias=atribuicao.JANELA_DIAS,
+                         meia_vida_dias=atribuicao.MEIA_VIDA_DIAS):
+    # Receita das vendas atribuída às interações do cliente dentro da janela
+    return atribuicao.atribuicao_campanhas(tables['vendas'], tables['interacoes'], tables['campanhas'],
+                                           modelo, janela_dias, meia_vida_dias)
+
+
+def desempenho_regional(tables):
+    clientes = tables['clientes']
+    vendas_clientes = tables['vendas'].merge(clientes, left_on='id_cliente', right_on='id_cliente')
+    vendas_cidade = vendas_clientes.groupby('cidade', observed=True)['valor_total'].sum().reset_index()
+    int_clientes = tables['interacoes'].merge(clientes, left_on='id_cliente', right_on='id_cliente')
+    int_cidade = int_clientes.groupby('cidade', observed=True).size().reset_index(name='interacoes')
+    regional = vendas_cidade.merge(int_cidade, on='cidade')
+    regional['vendas_por_interacao'] = regional['valor_total'] / regional['interacoes']
+    return regional
+
+
+def _status_churn(ultima_compra, dias_inatividade):
+    # Sem data de compra (NaN) conta como inativo
+    ultima_compra['status'] = np.where(ultima_compra['dias_sem_comprar'] <= dias_inatividade, 'Ativo', 'Inativo')
+    total_clientes = len(ultima_compra)
+    clientes_inativos = len(ultima_compra[ultima_compra['status'] == 'Inativo'])
+    taxa_churn = (clientes_inativos / total_clientes) * 100
+    return ultima_compra, taxa_churn
+
+
+def churn_clientes(tables, dias_inatividade=90):
+    vendas = tables['vendas']
+    data_venda = vendas['data_venda']
+
+    # Última compra de cada cliente, medida contra a última data do dataset
+    ultima_compra = data_venda.groupby(vendas['id_cliente']).max().reset_index()
+    ultima_compra.columns = ['id_cliente', 'ultima_compra']
+    data_atual = data_venda.max()
+    ultima_compra['dias_sem_comprar'] = (data_atual - ultima_compra['ultima_compra']).dt.days
+    return _status_churn(ultima_compra, dias_inatividade)
+
+
+def _taxas_retencao(retencao):
+    # Base de comparação: clientes cuja primeira compra ocorreu em meses anteriores
+    base_anterior = retencao['novos_clientes'].cumsum().shift(fill_value=0)
+    taxa = (retencao['clientes_retidos'] / base_anterior.where(base_anterior > 0)) * 100
+    retencao.insert(1, 'taxa_retencao', taxa.fillna(0))
+    return retencao
+
+
+def coortes(tables):
+    # Formato longo: clientes distintos por (mês da primeira compra, meses desde ela)
+    vendas = tables['vendas']
+    ativos = vendas[['id_cliente', 'mes_indice']].drop_duplicates().rename(columns={'mes_indice': 'mes'})
+    ativos['coorte'] = ativos.groupby('id_cliente')['mes'].transform('min')
+    ativos['periodo'] = ativos['mes'] - ativos['coorte']
+    return ativos.groupby(['coorte', 'periodo']).size().reset_index(name='clientes')
+
+
+def matriz_coortes(longa):
+    contagens = longa.pivot(index='coorte', columns='periodo', values='clientes').fillna(0)
+    # Células além do último mês observado ficam vazias (triângulo de coortes)
+    ultimo_mes = (longa['coorte'] + longa['periodo']).max()
+    futuro = contagens.index.to_numpy()[:, None] + contagens.columns.to_numpy()[None, :] > ultimo_mes
+    contagens = contagens.mask(futuro)
+    contagens.index = rotulo_mes(contagens.index)
+    contagens.index.name = 'coorte'
+    taxas = contagens.div(contagens[0], axis=0) * 100
+    return contagens, taxas
+
+
+def retencao_de_coortes(longa):
+    # Cada célula (coorte, periodo) cai no mês calendário coorte + periodo:
+    # período 0 são os novos clientes do mês, os demais são os retidos
+    mes = longa['coorte'] + longa['periodo']
+    novo = longa['periodo'] == 0
+    retencao = pd.DataFrame({
+        'novos_clientes': longa['clientes'].where(novo, 0).groupby(mes).sum(),
+        'clientes_retidos': longa['clientes'].where(~novo, 0).groupby(mes).sum(),
+    }).sort_index()
+    retencao.insert(0, 'mes', rotulo_mes(retencao.index))
+    return _taxas_retencao(retencao.reset_index(drop=True))
+
+
+def retencao_mensal(tables):
+    return retencao_de_coortes(coortes(tables))
+
+
+def classificacao_clientes(tables, segmentacao='legado'):
+    vendas = tables['vendas']
+
+    # Calculando métricas por cliente
+    metricas_clientes = vendas.groupby('id_cliente').agg({
+        'valor_total': ['sum', 'mean', 'count'],
+        'data_venda': ['min', 'max']
+    }).reset_index()
+    metricas_clientes.columns = ['id_cliente', 'valor_total', 'ticket_medio', 'frequencia', 'primeira_compra', 'ultima_compra']
+
+    # Recência em dias contra a última venda do dataset
+    data_atual = vendas['data_venda'].max()
+    metricas_clientes['recencia'] = (data_atual - metricas_clientes['ultima_compra']).dt.days
+    return rfm.segmentar(metricas_clientes, segmentacao)
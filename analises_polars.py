@@ -0,0 +1,194 @@
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import analises
+import atribuicao
+import rfm
+
+try:
+    import polars as pl
+except ImportError:  # sem polars o modo fica indisponível
+    pl = None
+
+# Motor colunar preguiçoso: as mesmas análises de analises.py escritas como
+# LazyFrames do Polars. Cada análise é um plano que o otimizador reescreve
+# (projeção e filtros empurrados para a leitura, junções reordenadas) e que só
+# executa no .collect(), em paralelo em todos os núcleos (POLARS_MAX_THREADS
+# limita). As tabelas vêm das mesmas tabelas normalizadas do modo pandas,
+# convertidas uma vez por banco via Arrow, e os resultados voltam como
+# DataFrames do pandas com as mesmas colunas e a mesma ordem de linhas do motor
+# de referência; paridade.py confere isso para todas as análises.
+#
+# Chaves nulas ficam fora dos agrupamentos, como no groupby do pandas, e as
+# junções convertem as chaves para Int64, já que cada tabela reduz seus ids ao
+# menor inteiro que os comporta.
+
+
+@dataclass(frozen=True)
+class TabelasPolars:
+    tabelas: MappingProxyType
+
+    def __getitem__(self, nome):
+        return self.tabelas[nome].lazy()
+
+
+def disponivel():
+    return pl is not None
+
+
+def de_tabelas(tables):
+    # Tabelas normalizadas do pandas -> DataFrames do Polars (categorias viram Categorical)
+    return TabelasPolars(MappingProxyType({nome: pl.from_pandas(df) for nome, df in tables.items()}))
+
+
+def _juntar(esquerda, direita, chave, how='inner'):
+    def inteira(lf):
+        return lf.with_columns(pl.col(chave).cast(pl.Int64))
+    return inteira(esquerda).join(inteira(direita), on=chave, how=how)
+
+
+def _agrupar(lf, chaves, *agregacoes):
+    chaves = [chaves] if isinstance(chaves, str) else chaves
+    return lf.drop_nulls(chaves).group_by(chaves).agg(*agregacoes).sort(chaves)
+
+
+def _coletar(lf):
+    return lf.collect().to_pandas()
+
+
+def contagens(fonte):
+    return {nome: df.height for nome, df in fonte.tabelas.items()}
+
+
+def amostra(fonte, tabela, n=5):
+    return fonte.tabelas[tabela].head(n).to_pandas()
+
+
+def receita_total(fonte):
+    return fonte.tabelas['vendas']['valor_total'].sum()
+
+
+def vendas_por_canal(fonte, dias=90):
+    vendas = fonte['vendas']
+    data_limite = pl.col('data_venda').max() - pl.duration(days=dias)
+    return _coletar(_agrupar(vendas.filter(pl.col('data_venda') >= data_limite),
+                             'canal_aquisicao', pl.col('valor_total').sum()))
+
+
+def top_produtos(fonte, n=5):
+    vendas_produtos = _agrupar(fonte['vendas'], 'id_produto',
+                               pl.col('quantidade').sum(), pl.col('valor_total').sum())
+    vendas_produtos = _juntar(vendas_produtos, fonte['produtos'], 'id_produto').with_columns(
+        margem_lucro=(pl.col('preco_unitario') - pl.col('custo_unitario')) / pl.col('preco_unitario') * 100
+    )
+    # Empates ficam na ordem do id_produto, como no nlargest do pandas
+    top = vendas_produtos.sort(['quantidade', 'id_produto'], descending=[True, False]).head(n)
+    return _coletar(top.select('nome_produto', 'quantidade', 'valor_total', 'margem_lucro'))
+
+
+def ticket_medio_segmento(fonte):
+    vendas_clientes = _juntar(fonte['vendas'], fonte['clientes'], 'id_cliente')
+    return _coletar(_agrupar(vendas_clientes, 'segmento', pl.col('valor_total').mean()))
+
+
+def vendas_mensais(fonte):
+    resultado = _coletar(_agrupar(fonte['vendas'], 'mes', pl.col('valor_total').sum()))
+    resultado['nome_mes'] = [analises.MESES[i-1] for i in resultado['mes']]
+    return resultado
+
+
+def eficiencia_campanhas(fonte):
+    interacoes = fonte['interacoes']
+    conversoes = _agrupar(interacoes.filter(pl.col('tipo_interacao') == 'Conversão'), 'id_campanha',
+                          pl.len().alias('conversoes'))
+    total_interacoes = _agrupar(interacoes, 'id_campanha', pl.len().alias('total_interacoes'))
+    eficiencia = _juntar(conversoes, total_interacoes, 'id_campanha').with_columns(
+        taxa_conversao=pl.col('conversoes') / pl.col('total_interacoes') * 100
+    )
+    return _coletar(_juntar(eficiencia, fonte['campanhas'], 'id_campanha').sort('id_campanha'))
+
+
+def engajamento_canais(fonte):
+    camp_interacoes = _juntar(fonte['interacoes'], fonte['campanhas'], 'id_campanha')
+    return _coletar(_agrupar(camp_interacoes, 'canal_marketing', pl.len().alias('total_interacoes')))
+
+
+def vendas_top_produtos_mensais(fonte, n=3):
+    vendas_produtos = _juntar(fonte['vendas'].select('id_produto', 'mes_indice', 'quantidade'),
+                              fonte['produtos'].select('id_produto', 'nome_produto'), 'id_produto')
+    top = _agrupar(vendas_produtos, 'nome_produto', pl.col('quantidade').sum()).sort(
+        ['quantidade', 'nome_produto'], descending=[True, False]).head(n)
+    mensais = _agrupar(vendas_produtos.join(top.select('nome_produto'), on='nome_produto', how='semi'),
+                       ['mes_indice', 'nome_produto'], pl.col('quantidade').sum())
+    mensais = _coletar(mensais)
+    mensais.insert(0, 'mes_ano', analises.rotulo_mes(mensais.pop('mes_indice')))
+    return mensais
+
+
+def atribuicao_campanhas(fonte, modelo='ultimo_toque', janela_dias=atribuicao.JANELA_DIAS,
+                         meia_vida_dias=atribuicao.MEIA_VIDA_DIAS):
+    # O Polars só extrai as colunas (instantes já em segundos); o as-of join é o de atribuicao.py
+    vendas = fonte['vendas'].drop_nulls(['id_cliente', 'data_venda']).select(
+        'id_cliente', pl.col('data_venda').dt.epoch('s'), 'valor_total').collect()
+    interacoes = fonte['interacoes'].drop_nulls(['id_cliente', 'id_campanha', 'data_interacao']).select(
+        'id_cliente', pl.col('data_interacao').dt.epoch('s'), 'id_campanha').collect()
+    v_cliente, v_tempo, v_valor = (vendas[c].to_numpy() for c in vendas.columns)
+    t_cliente, t_tempo, t_campanha = (interacoes[c].to_numpy() for c in interacoes.columns)
+    base = min([int(t.min()) for t in (v_tempo, t_tempo) if len(t)], default=0)
+    toques = atribuicao.preparar(t_cliente, t_tempo, t_campanha, base)
+    receita, atribuidas = atribuicao.atribuir(toques, v_cliente, v_tempo, v_valor, modelo, janela_dias, meia_vida_dias)
+    return atribuicao.resumo(fonte.tabelas['campanhas'].to_pandas(), toques.ids_campanha, receita, atribuidas)
+
+
+def desempenho_regional(fonte):
+    clientes = fonte['clientes'].select('id_cliente', 'cidade')
+    vendas_cidade = _agrupar(_juntar(fonte['vendas'], clientes, 'id_cliente'), 'cidade', pl.col('valor_total').sum())
+    int_cidade = _agrupar(_juntar(fonte['interacoes'], clientes, 'id_cliente'), 'cidade', pl.len().alias('interacoes'))
+    regional = vendas_cidade.join(int_cidade, on='cidade').sort('cidade').with_columns(
+        vendas_por_interacao=pl.col('valor_total') / pl.col('interacoes')
+    )
+    return _coletar(regional)
+
+
+def _ate_ultima_venda(vendas):
+    # Última venda do dataset repetida em cada linha, antes de agrupar por cliente
+    return vendas.with_columns(data_atual=pl.col('data_venda').max())
+
+
+def _dias_desde(coluna):
+    return (pl.col('data_atual') - pl.col(coluna)).dt.total_days()
+
+
+def churn_clientes(fonte, dias_inatividade=90):
+    # Última compra de cada cliente, medida contra a última data do dataset
+    ultima_compra = _agrupar(_ate_ultima_venda(fonte['vendas']), 'id_cliente',
+                             pl.col('data_venda').max().alias('ultima_compra'), pl.col('data_atual').first())
+    ultima_compra = ultima_compra.select('id_cliente', 'ultima_compra', dias_sem_comprar=_dias_desde('ultima_compra'))
+    return analises._status_churn(_coletar(ultima_compra), dias_inatividade)
+
+
+def coortes(fonte):
+    # Formato longo: clientes distintos por (mês da primeira compra, meses desde ela)
+    ativos = fonte['vendas'].select('id_cliente', pl.col('mes_indice').alias('mes')).unique()
+    ativos = ativos.with_columns(coorte=pl.col('mes').min().over('id_cliente')).with_columns(
+        periodo=pl.col('mes') - pl.col('coorte'))
+    return _coletar(_agrupar(ativos, ['coorte', 'periodo'], pl.len().alias('clientes')))
+
+
+def retencao_mensal(fonte):
+    return analises.retencao_de_coortes(coortes(fonte))
+
+
+def classificacao_clientes(fonte, segmentacao='legado'):
+    # Métricas por cliente, com a recência em dias contra a última venda do dataset
+    metricas_clientes = _agrupar(
+        _ate_ultima_venda(fonte['vendas']), 'id_cliente',
+        pl.col('valor_total').sum().alias('valor_total'),
+        pl.col('valor_total').mean().alias('ticket_medio'),
+        pl.col('valor_total').count().alias('frequencia'),
+        pl.col('data_venda').min().alias('primeira_compra'),
+        pl.col('data_venda').max().alias('ultima_compra'),
+        pl.col('data_atual').first(),
+    )
+    metricas_clientes = metricas_clientes.with_columns(recencia=_dias_desde('ultima_compra')).drop('data_atual')
+    return rfm.segmentar(_coletar(metricas_clientes), segmentacao)
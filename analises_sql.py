@@ -0,0 +1,327 @@
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+
+import pandas as pd
+
+import analises
+import atribuicao
+import ingestao
+import rfm
+from tabelas import TABELAS, colunas_originais
+
+# Motor "push-down": cada análise roda como uma consulta agregada no próprio
+# SQLite (JOIN/GROUP BY no banco) e traz para o pandas apenas o resultado.
+# As funções têm os mesmos nomes e saídas de analises.py, mas recebem o
+# caminho do banco no lugar do dicionário de tabelas. As das seções A a C
+# aceitam também um Recorte (banco + filtros da barra lateral): Vendas e
+# Interacoes_Marketing viram subconsultas filtradas, que o SQLite achata na
+# consulta externa e resolve pelos índices.
+
+
+@dataclass(frozen=True)
+class Filtros:
+    # Período fechado (datas; None = aberto) e valores aceitos de canal de
+    # aquisição (só vendas), segmento e cidade (vazio = todos)
+    inicio: object = None
+    fim: object = None
+    canais: tuple = ()
+    segmentos: tuple = ()
+    cidades: tuple = ()
+
+    def __bool__(self):
+        return any((self.inicio, self.fim, self.canais, self.segmentos, self.cidades))
+
+
+@dataclass(frozen=True)
+class Recorte:
+    db_path: str
+    filtros: Filtros
+
+
+def _lista(nome, valores, params):
+    # Marcadores nomeados para um IN (...), com os valores acrescentados a params
+    marcadores = []
+    for i, valor in enumerate(valores):
+        params[f'{nome}{i}'] = valor
+        marcadores.append(f':{nome}{i}')
+    return ', '.join(marcadores)
+
+
+def tabelas_filtradas(filtros):
+    # (FROM de vendas, FROM de interações, parâmetros nomeados). Sem filtros são
+    # as próprias tabelas; o período compara o texto da data, então vale também
+    # para datas com hora
+    params, vendas, interacoes = {}, [], []
+    if filtros.inicio is not None:
+        params['inicio'] = str(pd.Timestamp(filtros.inicio).date())
+        vendas.append("data_venda >= :inicio")
+        interacoes.append("data_interacao >= :inicio")
+    if filtros.fim is not None:
+        params['fim'] = str(pd.Timestamp(filtros.fim).date())
+        vendas.append("data_venda < date(:fim, '+1 day')")
+        interacoes.append("data_interacao < date(:fim, '+1 day')")
+    if filtros.canais:
+        vendas.append(f"canal_aquisicao IN ({_lista('canal', filtros.canais, params)})")
+    clientes = []
+    if filtros.segmentos:
+        clientes.append(f"segmento IN ({_lista('segmento', filtros.segmentos, params)})")
+    if filtros.cidades:
+        clientes.append(f"cidade IN ({_lista('cidade', filtros.cidades, params)})")
+    if clientes:
+        condicao = f"id_cliente IN (SELECT id_cliente FROM Clientes WHERE {' AND '.join(clientes)})"
+        vendas.append(condicao)
+        interacoes.append(condicao)
+    return (f"(SELECT * FROM Vendas WHERE {' AND '.join(vendas)})" if vendas else 'Vendas',
+            f"(SELECT * FROM Interacoes_Marketing WHERE {' AND '.join(interacoes)})" if interacoes else 'Interacoes_Marketing',
+            params)
+
+
+def _recorte(fonte):
+    # (caminho, FROM de vendas, FROM de interações, parâmetros) de um caminho ou Recorte
+    if isinstance(fonte, Recorte):
+        return (fonte.db_path, *tabelas_filtradas(fonte.filtros))
+    return fonte, 'Vendas', 'Interacoes_Marketing', {}
+
+
+def conectar(db_path):
+    return ingestao.configurar_leitura(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True))
+
+
+def consultar(db_path, sql, params=()):
+    with closing(conectar(db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def contagens(db_path):
+    sql = " UNION ALL ".join(
+        f"SELECT '{nome}' AS tabela, COUNT(*) AS registros FROM {tabela}"
+        for nome, tabela in TABELAS.items()
+    )
+    resultado = consultar(db_path, sql)
+    return dict(zip(resultado['tabela'], resultado['registros']))
+
+
+def amostra(db_path, tabela, n=5):
+    # Sem as colunas de dia da ingestão, como as amostras dos motores em memória
+    with closing(conectar(db_path)) as conn:
+        sql = f"SELECT {colunas_originais(conn, TABELAS[tabela])} FROM {TABELAS[tabela]} LIMIT ?"
+        return pd.read_sql_query(sql, conn, params=(n,))
+
+
+def receita_total(db_path):
+    return consultar(db_path, "SELECT SUM(valor_total) AS total FROM Vendas")['total'].iloc[0]
+
+
+def dominio(db_path):
+    # Valores disponíveis para os filtros da barra lateral, como cubo.dominio
+    with closing(conectar(db_path)) as conn:
+        inicio, fim = conn.execute("""
+            SELECT MIN(inicio), MAX(fim) FROM (
+                SELECT MIN(data_venda) AS inicio, MAX(data_venda) AS fim FROM Vendas
+                UNION ALL
+                SELECT MIN(data_interacao), MAX(data_interacao) FROM Interacoes_Marketing)
+        """).fetchone()
+        distintos = {
+            coluna: [valor for (valor,) in conn.execute(
+                f"SELECT DISTINCT {coluna} FROM {tabela} WHERE {coluna} IS NOT NULL ORDER BY 1")]
+            for coluna, tabela in (('canal_aquisicao', 'Vendas'), ('segmento', 'Clientes'), ('cidade', 'Clientes'))
+        }
+    return {'inicio': pd.Timestamp(inicio).normalize(), 'fim': pd.Timestamp(fim).normalize(), **distintos}
+
+
+def sem_registros(db_path):
+    db_path, vendas, interacoes, params = _recorte(db_path)
+    return bool(consultar(db_path, f"""
+        SELECT NOT EXISTS (SELECT 1 FROM {vendas}) AND NOT EXISTS (SELECT 1 FROM {interacoes}) AS vazio
+    """, params)['vazio'].iloc[0])
+
+
+def vendas_por_canal(db_path, dias=90):
+    db_path, vendas, _, params = _recorte(db_path)
+    return consultar(db_path, f"""
+        SELECT canal_aquisicao, SUM(valor_total) AS valor_total
+        FROM {vendas}
+        WHERE data_venda >= date((SELECT MAX(data_venda) FROM {vendas}), '-' || :dias || ' days')
+        GROUP BY canal_aquisicao
+        ORDER BY canal_aquisicao
+    """, {**params, 'dias': dias})
+
+
+def top_produtos(db_path, n=5):
+    db_path, vendas, _, params = _recorte(db_path)
+    return consultar(db_path, f"""
+        SELECT p.nome_produto,
+               SUM(v.quantidade) AS quantidade,
+               SUM(v.valor_total) AS valor_total,
+               (p.preco_unitario - p.custo_unitario) / p.preco_unitario * 100 AS margem_lucro
+        FROM {vendas} v
+        JOIN Produtos p ON p.id_produto = v.id_produto
+        GROUP BY v.id_produto
+        ORDER BY quantidade DESC, v.id_produto
+        LIMIT :n
+    """, {**params, 'n': n})
+
+
+def ticket_medio_segmento(db_path):
+    db_path, vendas, _, params = _recorte(db_path)
+    return consultar(db_path, f"""
+        SELECT c.segmento, AVG(v.valor_total) AS valor_total
+        FROM {vendas} v
+        JOIN Clientes c ON c.id_cliente = v.id_cliente
+        GROUP BY c.segmento
+        ORDER BY c.segmento
+    """, params)
+
+
+def vendas_mensais(db_path):
+    db_path, vendas, _, params = _recorte(db_path)
+    resultado = consultar(db_path, f"""
+        SELECT CAST(strftime('%m', data_venda) AS INTEGER) AS mes,
+               SUM(valor_total) AS valor_total
+        FROM {vendas}
+        GROUP BY mes
+        ORDER BY mes
+    """, params)
+    resultado['nome_mes'] = [analises.MESES[i-1] for i in resultado['mes']]
+    return resultado
+
+
+def eficiencia_campanhas(db_path):
+    db_path, _, interacoes, params = _recorte(db_path)
+    eficiencia = consultar(db_path, f"""
+        SELECT i.id_campanha,
+               SUM(i.tipo_interacao = 'Conversão') AS conversoes,
+               COUNT(*) AS total_interacoes,
+               SUM(i.tipo_interacao = 'Conversão') * 100.0 / COUNT(*) AS taxa_conversao,
+               c.nome_campanha, c.canal_marketing, c.data_inicio, c.data_fim,
+               c.orcamento, c.custo
+        FROM {interacoes} i
+        JOIN Campanhas_Marketing c ON c.id_campanha = i.id_campanha
+        GROUP BY i.id_campanha
+        HAVING conversoes > 0
+        ORDER BY i.id_campanha
+    """, params)
+    eficiencia['data_inicio'] = pd.to_datetime(eficiencia['data_inicio'])
+    eficiencia['data_fim'] = pd.to_datetime(eficiencia['data_fim'])
+    return eficiencia
+
+
+def engajamento_canais(db_path):
+    db_path, _, interacoes, params = _recorte(db_path)
+    return consultar(db_path, f"""
+        SELECT c.canal_marketing, COUNT(*) AS total_interacoes
+        FROM {interacoes} i
+        JOIN Campanhas_Marketing c ON c.id_campanha = i.id_campanha
+        GROUP BY c.canal_marketing
+        ORDER BY c.canal_marketing
+    """, params)
+
+
+def vendas_top_produtos_mensais(db_path, n=3):
+    db_path, vendas, _, params = _recorte(db_path)
+    return consultar(db_path, f"""
+        WITH top AS (
+            SELECT p.nome_produto
+            FROM {vendas} v
+            JOIN Produtos p ON p.id_produto = v.id_produto
+            GROUP BY p.nome_produto
+            ORDER BY SUM(v.quantidade) DESC, p.nome_produto
+            LIMIT :n
+        )
+        SELECT strftime('%Y-%m', v.data_venda) AS mes_ano,
+               p.nome_produto,
+               SUM(v.quantidade) AS quantidade
+        FROM {vendas} v
+        JOIN Produtos p ON p.id_produto = v.id_produto
+        WHERE p.nome_produto IN (SELECT nome_produto FROM top)
+        GROUP BY mes_ano, p.nome_produto
+        ORDER BY mes_ano, p.nome_produto
+    """, {**params, 'n': n})
+
+
+def atribuicao_campanhas(db_path, modelo='ultimo_toque', janela_dias=atribuicao.JANELA_DIAS,
+                         meia_vida_dias=atribuicao.MEIA_VIDA_DIAS):
+    # O as-of join não tem equivalente eficiente em SQL: o banco entrega só as
+    # colunas usadas, com as datas já em segundos, e a junção roda no numpy
+    return atribuicao.atribuicao_do_banco(db_path, (modelo,), janela_dias, meia_vida_dias)[modelo]
+
+
+def desempenho_regional(db_path):
+    db_path, vendas, interacoes, params = _recorte(db_path)
+    return consultar(db_path, f"""
+        WITH vendas_cidade AS (
+            SELECT c.cidade, SUM(v.valor_total) AS valor_total
+            FROM {vendas} v
+            JOIN Clientes c ON c.id_cliente = v.id_cliente
+            GROUP BY c.cidade
+        ),
+        int_cidade AS (
+            SELECT c.cidade, COUNT(*) AS interacoes
+            FROM {interacoes} i
+            JOIN Clientes c ON c.id_cliente = i.id_cliente
+            GROUP BY c.cidade
+        )
+        SELECT vc.cidade, vc.valor_total, ic.interacoes,
+               vc.valor_total / ic.interacoes AS vendas_por_interacao
+        FROM vendas_cidade vc
+        JOIN int_cidade ic ON ic.cidade = vc.cidade
+        ORDER BY vc.cidade
+    """, params)
+
+
+def churn_clientes(db_path, dias_inatividade=90):
+    ultima_compra = consultar(db_path, """
+        SELECT id_cliente,
+               MAX(data_venda) AS ultima_compra,
+               CAST(julianday((SELECT MAX(data_venda) FROM Vendas)) - julianday(MAX(data_venda)) AS INTEGER) AS dias_sem_comprar
+        FROM Vendas
+        GROUP BY id_cliente
+        ORDER BY id_cliente
+    """)
+    ultima_compra['ultima_compra'] = pd.to_datetime(ultima_compra['ultima_compra'])
+    return analises._status_churn(ultima_compra, dias_inatividade)
+
+
+def coortes(db_path):
+    return consultar(db_path, """
+        WITH ativos AS (
+            SELECT DISTINCT id_cliente,
+                   CAST(strftime('%Y', data_venda) AS INTEGER) * 12
+                   + CAST(strftime('%m', data_venda) AS INTEGER) - 1 AS mes
+            FROM Vendas
+        ),
+        primeira_compra AS (
+            SELECT id_cliente, MIN(mes) AS coorte
+            FROM ativos
+            GROUP BY id_cliente
+        )
+        SELECT p.coorte, a.mes - p.coorte AS periodo, COUNT(*) AS clientes
+        FROM ativos a
+        JOIN primeira_compra p ON p.id_cliente = a.id_cliente
+        GROUP BY p.coorte, periodo
+        ORDER BY p.coorte, periodo
+    """)
+
+
+def retencao_mensal(db_path):
+    return analises.retencao_de_coortes(coortes(db_path))
+
+
+def classificacao_clientes(db_path, segmentacao='legado'):
+    # Os quantis da segmentação são calculados no pandas sobre o agregado por cliente
+    metricas_clientes = consultar(db_path, """
+        SELECT id_cliente,
+               SUM(valor_total) AS valor_total,
+               AVG(valor_total) AS ticket_medio,
+               COUNT(valor_total) AS frequencia,
+               MIN(data_venda) AS primeira_compra,
+               MAX(data_venda) AS ultima_compra,
+               CAST(julianday((SELECT MAX(data_venda) FROM Vendas)) - julianday(MAX(data_venda)) AS INTEGER) AS recencia
+        FROM Vendas
+        GROUP BY id_cliente
+        ORDER BY id_cliente
+    """)
+    metricas_clientes['primeira_compra'] = pd.to_datetime(metricas_clientes['primeira_compra'])
+    metricas_clientes['ultima_compra'] = pd.to_datetime(metricas_clientes['ultima_compra'])
+    return rfm.segmentar(metricas_clientes, segmentacao)
@@ -1,18 +1,27 @@
 import streamlit as st
-import sqlite3
 import pandas as pd
 import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
-import numpy as np
-from datetime import datetime, timedelta
-import io
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Table, TableStyle, PageBreak
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.units import inch
-from reportlab.lib import colors
-import base64
+import os
+import time
+import uuid
+from dataclasses import astuple, replace
+import analises
+import analises_sql
+import analises_polars
+import atribuicao
+import tabelas
+import cubo
+import esbocos
+import incremental
+import ingestao
+import streaming
+import bancos
+import graficos
+import agendador
+import console_sql
+import instrumentacao
+import paginacao
+import pontuacao_churn
 #Comandos para instalar as bibliotecas:
 # pip install streamlit pandas plotly reportlab
 
@@ -55,270 +64,464 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-@st.cache_data
+@instrumentacao.medir()
 def load_data(db_path):
+    # Tabelas normalizadas compartilhadas somente leitura entre reruns e sessões,
+    # no cache LRU por banco (sem a cópia profunda que o cache_data faz a cada acesso)
     try:
-        conn = sqlite3.connect(db_path)
-        tables = {}
-        tables['clientes'] = pd.read_sql_query("SELECT * FROM Clientes", conn)
-        tables['campanhas'] = pd.read_sql_query("SELECT * FROM Campanhas_Marketing", conn)
-        tables['interacoes'] = pd.read_sql_query("SELECT * FROM Interacoes_Marketing", conn)
-        tables['produtos'] = pd.read_sql_query("SELECT * FROM Produtos", conn)
-        tables['vendas'] = pd.read_sql_query("SELECT * FROM Vendas", conn)
-        conn.close()
-        return tables
+        return bancos.cache.obter(
+            (db_path, 'tabelas'),
+            lambda: tabelas.carregar_tabelas(db_path, chave=bancos.chave_do_banco(db_path))
+        )
+    except MemoryError:
+        st.error("O banco não coube na memória. Use o modo de execução Streaming, que lê as vendas e "
+                 "interações em lotes dentro de um orçamento de memória.")
+        return None
     except Exception as e:
         st.error(f"Erro ao carregar dados: {str(e)}")
         return None
 
+@instrumentacao.medir()
+def load_cubo(db_path):
+    # Só nos modos com as tabelas em memória; os demais filtram nas consultas
+    tables = load_data(db_path)
+    if tables is None:
+        return None
+    try:
+        return bancos.cache.obter((db_path, 'cubo'), lambda: cubo.construir(tables))
+    except Exception as e:
+        st.error(f"Erro ao montar o cubo de agregados: {str(e)}")
+        return None
+
+@instrumentacao.medir()
+def load_dominio(db_path):
+    # Período e valores dos filtros direto do banco, para os modos sem cubo
+    try:
+        return bancos.cache.obter((db_path, 'dominio'), lambda: analises_sql.dominio(db_path))
+    except Exception as e:
+        st.error(f"Erro ao ler os valores dos filtros: {str(e)}")
+        return None
+
+@instrumentacao.medir()
+def load_polars(db_path):
+    # As mesmas tabelas normalizadas do modo pandas, convertidas uma vez por banco
+    tables = load_data(db_path)
+    if tables is None:
+        return None
+    try:
+        return bancos.cache.obter((db_path, 'polars'), lambda: analises_polars.de_tabelas(tables))
+    except Exception as e:
+        st.error(f"Erro ao converter as tabelas para o Polars: {str(e)}")
+        return None
+
+@instrumentacao.medir()
+def load_esbocos(db_path):
+    # HyperLogLog por dia e KLL por métrica de cliente, montados numa passada por banco
+    try:
+        return bancos.cache.obter((db_path, 'esbocos'), lambda: esbocos.construir(db_path))
+    except Exception as e:
+        st.error(f"Erro ao montar os esboços do modo aproximado: {str(e)}")
+        return None
+
+def chave_analise(db_path, analise, fonte, args=(), filtros=()):
+    return (db_path, analise.__name__, type(fonte).__name__) + tuple(args) + tuple(filtros)
+
+def em_cache(db_path, analise, fonte, *args, filtros=()):
+    # Resultados das análises reaproveitados por todas as sessões do mesmo banco
+    # (e dos mesmos filtros, nas seções A a C); o agendador costuma já tê-los calculado
+    chave = chave_analise(db_path, analise, fonte, args, filtros)
+    return bancos.cache.obter(chave, lambda: analise(fonte, *args))
+
+def precalcular_secoes(db_path, tables, dados, filtros, sem_dados, selected_section):
+    # Agenda em segundo plano as análises de todas as seções, a visível primeiro
+    secoes = {
+        "🎯 D. Análises Adicionais": [
+            (analise_churn, tables, ()),
+            (analise_retencao, tables, ()),
+            (classificacao_clientes, tables, ('rfm',)),
+            (classificacao_clientes, tables, ('legado',)),
+            (analise_atribuicao, tables, ('ultimo_toque', atribuicao.JANELA_DIAS)),
+        ],
+    }
+    if not sem_dados:
+        secoes["💰 A. Análise de Vendas"] = [(f, dados, ()) for f in (
+            analise_vendas_por_canal, top_produtos_analise, segmentacao_clientes, analise_sazonalidade)]
+        secoes["📈 B. Análise de Marketing"] = [(f, dados, ()) for f in (eficiencia_campanhas, analise_canais_marketing)]
+        secoes["🔄 C. Análise Integrada"] = [(f, dados, ()) for f in (relacao_temporal, analise_regional)]
+    tarefas = []
+    for secao, analises_secao in secoes.items():
+        prioridade = agendador.PRIORIDADE_VISIVEL if secao == selected_section else agendador.PRIORIDADE_FUNDO
+        for analise, fonte, args in analises_secao:
+            chave = chave_analise(db_path, analise, fonte, args, filtros if fonte is dados else ())
+            tarefas.append((chave, lambda a=analise, f=fonte, x=args: a(f, *x), prioridade))
+    sessao = st.session_state.setdefault('sessao', uuid.uuid4().hex[:12])
+    agendador.agendador.agendar(sessao, tarefas)
+    prontas, total = agendador.agendador.progresso(sessao)
+    if prontas < total:
+        st.sidebar.caption(f"⏳ Pré-calculando análises: {prontas}/{total} prontas")
+
+def caminho_do_upload(uploaded_file):
+    # O hash do conteúdo é calculado uma vez por arquivo enviado na sessão
+    enviados = st.session_state.setdefault('uploads', {})
+    caminho = enviados.get(uploaded_file.file_id)
+    if caminho is None or not os.path.exists(caminho):
+        caminho, anterior = bancos.registrar_upload(uploaded_file.getbuffer(), uploaded_file.name)
+        incremental.herdar(caminho, anterior)
+        enviados[uploaded_file.file_id] = caminho
+    else:
+        bancos.tocar(caminho)
+    return caminho
+
+def preparar_banco(db_path):
+    # Validação, índices e estatísticas do banco enviado, em segundo plano e uma
+    # vez por arquivo; a página acompanha o progresso e segue quando termina
+    estado = ingestao.iniciar(db_path)
+    if not estado.concluida:
+        barra = st.progress(estado.fracao, text=f"Preparando o banco: {estado.etapa}")
+        while not estado.concluida:
+            time.sleep(0.2)
+            barra.progress(estado.fracao, text=f"Preparando o banco: {estado.etapa}")
+        barra.empty()
+    if isinstance(estado.erro, ingestao.EsquemaInvalido):
+        st.error("O banco enviado não segue o esquema esperado:\n\n" +
+                 "\n".join(f"- {problema}" for problema in estado.erro.problemas))
+        return False
+    if estado.erro is not None:
+        st.error(f"Erro ao preparar o banco: {str(estado.erro)}")
+        return False
+    return True
+
+def filtros_sidebar(dominio):
+    st.sidebar.markdown("### 🎛️ Filtros (seções A a C)")
+    inicio, fim = dominio['inicio'].date(), dominio['fim'].date()
+    periodo = st.sidebar.date_input("Período:", (inicio, fim), min_value=inicio, max_value=fim)
+    canais = st.sidebar.multiselect("Canal de aquisição:", dominio['canal_aquisicao'])
+    segmentos = st.sidebar.multiselect("Segmento:", dominio['segmento'])
+    cidades = st.sidebar.multiselect("Cidade:", dominio['cidade'])
+    # Enquanto só a data inicial foi escolhida, o período fica aberto no fim; as
+    # pontas iguais às do banco também ficam abertas (sem filtro nas consultas)
+    periodo = tuple(periodo) + (None,) * (2 - len(periodo))
+    return analises_sql.Filtros(None if periodo[0] == inicio else periodo[0], None if periodo[1] == fim else periodo[1],
+                                tuple(canais), tuple(segmentos), tuple(cidades))
+
+def dados_filtrados(db_path, modo, tables):
+    # Fonte das seções A a C já com os filtros: uma fatia do cubo nos modos em
+    # memória, leituras em lotes filtradas no streaming (dentro do orçamento do
+    # Fluxo) e um Recorte das consultas SQL nos demais
+    if modo.startswith(("Pandas", "Polars")):
+        cubo_completo = load_cubo(db_path)
+        if cubo_completo is None:
+            return None, None
+        filtros = filtros_sidebar(cubo.dominio(cubo_completo))
+        return cubo.filtrar(cubo_completo, filtros.inicio, filtros.fim, filtros.canais, filtros.segmentos,
+                            filtros.cidades), filtros
+    dominio = load_dominio(db_path)
+    if dominio is None:
+        return None, None
+    filtros = filtros_sidebar(dominio)
+    if isinstance(tables, streaming.Fluxo):
+        return (replace(tables, filtros=filtros) if filtros else tables), filtros
+    return (analises_sql.Recorte(db_path, filtros) if filtros else db_path), filtros
+
+def mostrar_tabela(df, **kwargs):
+    with instrumentacao.etapa('st.dataframe', linhas=len(df)):
+        st.dataframe(df, **kwargs)
+
+def controles_tabela(colunas, chave):
+    # Ordenação e filtro de uma tabela paginada, aplicados no servidor
+    col_ordem, col_direcao, col_filtro, col_valor = st.columns([3, 2, 3, 4])
+    ordenar = col_ordem.selectbox("Ordenar por:", [None] + list(colunas), key=f'{chave}_ordenar',
+                                  format_func=lambda c: "(ordem original)" if c is None else c)
+    decrescente = col_direcao.selectbox("Direção:", [False, True], key=f'{chave}_decrescente',
+                                        format_func=lambda d: "Decrescente" if d else "Crescente",
+                                        disabled=ordenar is None)
+    coluna_filtro = col_filtro.selectbox("Filtrar coluna:", [None] + list(colunas), key=f'{chave}_filtro',
+                                         format_func=lambda c: "(sem filtro)" if c is None else c)
+    texto = col_valor.text_input("Valor:", key=f'{chave}_valor', disabled=coluna_filtro is None,
+                                 help="Texto contido no valor, ou um intervalo mínimo:máximo "
+                                      "(ex.: 100:500, 2025-01-01:2025-06-30, 1000:)")
+    return ordenar, decrescente, coluna_filtro, texto.strip() if coluna_filtro else ''
+
+def pagina_atual(chave, selecao):
+    # Volta para a primeira página quando a ordenação ou o filtro mudam
+    if st.session_state.get(f'{chave}_selecao') != selecao:
+        st.session_state[f'{chave}_selecao'] = selecao
+        st.session_state[f'{chave}_pagina'] = 0
+    return st.session_state.get(f'{chave}_pagina', 0)
+
+def navegacao(chave, pagina, tem_proxima):
+    col_anterior, col_posterior, _ = st.columns([1, 1, 6])
+    if col_anterior.button("◀ Anterior", key=f'{chave}_anterior', disabled=pagina == 0):
+        st.session_state[f'{chave}_pagina'] = pagina - 1
+        st.rerun()
+    if col_posterior.button("Próxima ▶", key=f'{chave}_proxima', disabled=not tem_proxima):
+        st.session_state[f'{chave}_pagina'] = pagina + 1
+        st.rerun()
+
+def botoes_download(chave, gerar_lotes):
+    # O arquivo só é gerado quando o botão é clicado, em lotes, fora do rerun
+    col_csv, col_parquet, _ = st.columns([1, 1, 6])
+    col_csv.download_button("⬇️ CSV", data=lambda: paginacao.arquivo(gerar_lotes(), 'csv'),
+                            file_name=f'{chave}.csv', mime='text/csv', key=f'{chave}_csv', on_click='ignore')
+    if paginacao.parquet_disponivel():
+        col_parquet.download_button("⬇️ Parquet", data=lambda: paginacao.arquivo(gerar_lotes(), 'parquet'),
+                                    file_name=f'{chave}.parquet', mime='application/vnd.apache.parquet',
+                                    key=f'{chave}_parquet', on_click='ignore')
+
+def tabela_paginada(df, chave, colunas=None, tamanho_pagina=paginacao.TAMANHO_PAGINA):
+    # Só a página visível vai para o navegador; o DataFrame (o mesmo objeto do
+    # cache, para reaproveitar a ordenação entre reruns) fica no servidor
+    colunas = list(colunas if colunas is not None else df.columns)
+    visao = paginacao.visao(df)
+    selecao = controles_tabela(colunas, chave)
+    try:
+        total = visao.total(*selecao)
+    except (ValueError, TypeError):
+        st.warning("Filtro inválido para o tipo da coluna.")
+        return
+    pagina = min(pagina_atual(chave, selecao), max(0, (total - 1) // tamanho_pagina))
+    parte = visao.pagina(pagina, tamanho_pagina, *selecao)[colunas]
+    mostrar_tabela(parte, use_container_width=True)
+    inicio = pagina * tamanho_pagina
+    st.caption(f"Linhas {inicio + 1 if len(parte) else 0:,}–{inicio + len(parte):,} de {total:,}")
+    navegacao(chave, pagina, inicio + len(parte) < total)
+    botoes_download(chave, lambda: (lote[colunas] for lote in visao.lotes(*selecao)))
+
+def mostrar_grafico(fig, **kwargs):
+    with instrumentacao.etapa('st.plotly_chart'):
+        st.plotly_chart(fig, **kwargs)
+
+def painel_desempenho(etapas):
+    with st.sidebar.expander("⏱️ Performance", expanded=bool(etapas)):
+        st.checkbox("Medir as etapas da página", value=instrumentacao.PADRAO, key='medir_desempenho')
+        if etapas:
+            df = pd.DataFrame(etapas)
+            total = df.loc[df['nivel'] == 0, 'duracao_ms'].sum()
+            st.caption(f"{len(df)} etapas medidas · {total:,.0f} ms nas etapas de primeiro nível")
+            df['linhas'] = df['linhas'].astype('Int64')
+            df['etapa'] = ['\u2003' * n + e for n, e in zip(df['nivel'], df['etapa'])]
+            colunas = ['etapa', 'duracao_ms', 'linhas'] + (['memoria_mb'] if 'memoria_mb' in df else [])
+            st.dataframe(df[colunas], use_container_width=True, hide_index=True)
+
+@instrumentacao.medir()
 def execute_query(db_path, query):
+    # Devolve a consulta paginada (console_sql.Consulta) já com a primeira página lida
     try:
-        conn = sqlite3.connect(db_path)
-        result = pd.read_sql_query(query, conn)
-        conn.close()
-        return result
+        return console_sql.consultar(db_path, bancos.chave_do_banco(db_path), query)
+    except console_sql.TempoEsgotado as e:
+        st.error(str(e))
+        plano = console_sql.plano_de_execucao(db_path, query)
+        if plano is not None:
+            st.markdown("**Plano de execução:**")
+            mostrar_tabela(plano, use_container_width=True, hide_index=True)
+        return None
     except Exception as e:
         st.error(f"Erro na consulta: {str(e)}")
         return None
 
-def analise_vendas_por_canal(tables):
-    vendas = tables['vendas']
-    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
-    data_limite = vendas['data_venda'].max() - timedelta(days=90)
-    vendas_trimestre = vendas[vendas['data_venda'] >= data_limite]
-    vendas_canal = vendas_trimestre.groupby('canal_aquisicao')['valor_total'].sum().reset_index()
+def _motor(fonte):
+    # Caminho do banco ou Recorte -> consultas agregadas no SQLite; cubo -> agregados
+    # pré-calculados; Agregados -> agregados incrementais persistidos;
+    # Fluxo -> agregados parciais lidos em lotes; TabelasPolars -> planos
+    # preguiçosos do Polars; Esbocos -> coortes aproximadas (modo aproximado
+    # da seção D); dicionário de tabelas -> pandas
+    if isinstance(fonte, (str, analises_sql.Recorte)):
+        motor = analises_sql
+    elif isinstance(fonte, cubo.Cubo):
+        motor = cubo
+    elif isinstance(fonte, incremental.Agregados):
+        motor = incremental
+    elif isinstance(fonte, streaming.Fluxo):
+        motor = streaming
+    elif isinstance(fonte, analises_polars.TabelasPolars):
+        motor = analises_polars
+    elif isinstance(fonte, esbocos.Esbocos):
+        motor = esbocos
+    else:
+        motor = analises
+    return instrumentacao.modulo(motor)
+
+@instrumentacao.medir()
+def analise_vendas_por_canal(fonte):
+    vendas_canal = _motor(fonte).vendas_por_canal(fonte)
     fig = px.bar(vendas_canal, x='canal_aquisicao', y='valor_total',
                  title='Total de Vendas por Canal (Último Trimestre)',
                  color='canal_aquisicao',
                  color_discrete_sequence=['#3498db', '#e74c3c'])
     return fig, vendas_canal
 
-def top_produtos_analise(tables):
-    vendas = tables['vendas']
-    produtos = tables['produtos']
-    vendas_produtos = vendas.groupby('id_produto').agg({
-        'quantidade': 'sum',
-        'valor_total': 'sum'
-    }).reset_index()
-    vendas_produtos = vendas_produtos.merge(produtos, left_on='id_produto', right_on='id_produto')
-    vendas_produtos['margem_lucro'] = ((vendas_produtos['preco_unitario'] - vendas_produtos['custo_unitario']) / vendas_produtos['preco_unitario']) * 100
-    top_5 = vendas_produtos.nlargest(5, 'quantidade')[['nome_produto', 'quantidade', 'valor_total', 'margem_lucro']]
+@instrumentacao.medir()
+def top_produtos_analise(fonte):
+    top_5 = _motor(fonte).top_produtos(fonte)
     fig = px.bar(top_5, x='nome_produto', y='quantidade',
                  title='Top 5 Produtos por Volume de Vendas',
                  color='margem_lucro',
                  color_continuous_scale='viridis')
     return fig, top_5
 
-def segmentacao_clientes(tables):
-    vendas = tables['vendas']
-    clientes = tables['clientes']
-    vendas_clientes = vendas.merge(clientes, left_on='id_cliente', right_on='id_cliente')
-    ticket_medio = vendas_clientes.groupby('segmento')['valor_total'].mean().reset_index()
+@instrumentacao.medir()
+def segmentacao_clientes(fonte):
+    ticket_medio = _motor(fonte).ticket_medio_segmento(fonte)
     fig = px.bar(ticket_medio, x='segmento', y='valor_total',
                  title='Ticket Médio por Segmento de Cliente',
                  color='segmento',
                  color_discrete_sequence=['#9b59b6', '#f39c12'])
     return fig, ticket_medio
 
-def analise_sazonalidade(tables):
-    vendas = tables['vendas']
-    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
-    vendas['mes'] = vendas['data_venda'].dt.month
-    vendas['nome_mes'] = vendas['data_venda'].dt.strftime('%B')
-    vendas_mensais = vendas.groupby('mes')['valor_total'].sum().reset_index()
-    meses = ['Jan', 'Fev', 'Mar', 'Abr', 'Mai', 'Jun', 
-             'Jul', 'Ago', 'Set', 'Out', 'Nov', 'Dez']
-    vendas_mensais['nome_mes'] = [meses[i-1] for i in vendas_mensais['mes']]
+@instrumentacao.medir()
+def analise_sazonalidade(fonte):
+    vendas_mensais = _motor(fonte).vendas_mensais(fonte)
     fig = px.line(vendas_mensais, x='nome_mes', y='valor_total',
                   title='Padrão de Vendas ao Longo do Ano',
                   markers=True)
     return fig, vendas_mensais
 
-def eficiencia_campanhas(tables):
-    campanhas = tables['campanhas']
-    interacoes = tables['interacoes']
-    conversoes = interacoes[interacoes['tipo_interacao'] == 'Conversão'].groupby('id_campanha').size().reset_index(name='conversoes')
-    total_interacoes = interacoes.groupby('id_campanha').size().reset_index(name='total_interacoes')
-    eficiencia = conversoes.merge(total_interacoes, on='id_campanha')
-    eficiencia['taxa_conversao'] = (eficiencia['conversoes'] / eficiencia['total_interacoes']) * 100
-    eficiencia = eficiencia.merge(campanhas, left_on='id_campanha', right_on='id_campanha')
-    fig = px.scatter(eficiencia, x='orcamento', y='taxa_conversao',
-                     size='conversoes', color='canal_marketing',
-                     title='Eficiência das Campanhas (Taxa de Conversão vs Orçamento)',
-                     hover_data=['nome_campanha'])
+@instrumentacao.medir()
+def eficiencia_campanhas(fonte):
+    eficiencia = _motor(fonte).eficiencia_campanhas(fonte)
+    fig = graficos.dispersao(eficiencia, x='orcamento', y='taxa_conversao',
+                             size='conversoes', color='canal_marketing',
+                             title='Eficiência das Campanhas (Taxa de Conversão vs Orçamento)',
+                             hover_data=['nome_campanha'])
     return fig, eficiencia
 
-def analise_canais_marketing(tables):
-    campanhas = tables['campanhas']
-    interacoes = tables['interacoes']
-    camp_interacoes = interacoes.merge(campanhas, left_on='id_campanha', right_on='id_campanha')
-    engajamento = camp_interacoes.groupby('canal_marketing').size().reset_index(name='total_interacoes')
+@instrumentacao.medir()
+def analise_canais_marketing(fonte):
+    engajamento = _motor(fonte).engajamento_canais(fonte)
     fig = px.pie(engajamento, values='total_interacoes', names='canal_marketing',
                  title='Engajamento por Canal de Marketing')
     return fig, engajamento
 
-def relacao_temporal(tables):
-    vendas = tables['vendas']
-    campanhas = tables['campanhas']
-    produtos = tables['produtos']
-    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
-    campanhas['data_inicio'] = pd.to_datetime(campanhas['data_inicio'])
-    vendas_produtos = vendas.merge(produtos, left_on='id_produto', right_on='id_produto')
-    
-    # Convertendo para string no formato YYYY-MM
-    vendas_produtos['mes_ano'] = vendas_produtos['data_venda'].dt.strftime('%Y-%m')
-    
-    vendas_mensais = vendas_produtos.groupby(['mes_ano', 'nome_produto']).agg({
-        'quantidade': 'sum'
-    }).reset_index()
-    
-    top_produtos = vendas_produtos.groupby('nome_produto')['quantidade'].sum().nlargest(3).index
-    vendas_top = vendas_mensais[vendas_mensais['nome_produto'].isin(top_produtos)]
-    
-    fig = px.line(vendas_top, x='mes_ano', y='quantidade', color='nome_produto',
-                  title='Vendas de Top Produtos ao Longo do Tempo')
+@instrumentacao.medir()
+def relacao_temporal(fonte):
+    vendas_top = _motor(fonte).vendas_top_produtos_mensais(fonte)
+    fig = graficos.linhas(vendas_top, x='mes_ano', y='quantidade', color='nome_produto',
+                          title='Vendas de Top Produtos ao Longo do Tempo')
     return fig, vendas_top
 
-def analise_regional(tables):
-    vendas = tables['vendas']
-    clientes = tables['clientes']
-    interacoes = tables['interacoes']
-    vendas_clientes = vendas.merge(clientes, left_on='id_cliente', right_on='id_cliente')
-    vendas_cidade = vendas_clientes.groupby('cidade')['valor_total'].sum().reset_index()
-    int_clientes = interacoes.merge(clientes, left_on='id_cliente', right_on='id_cliente')
-    int_cidade = int_clientes.groupby('cidade').size().reset_index(name='interacoes')
-    regional = vendas_cidade.merge(int_cidade, on='cidade')
-    regional['vendas_por_interacao'] = regional['valor_total'] / regional['interacoes']
-    fig = px.scatter(regional, x='interacoes', y='valor_total',
-                     size='vendas_por_interacao', hover_data=['cidade'],
-                     title='Análise Regional: Vendas vs Interações de Marketing')
+@instrumentacao.medir()
+def analise_regional(fonte):
+    regional = _motor(fonte).desempenho_regional(fonte)
+    fig = graficos.dispersao(regional, x='interacoes', y='valor_total',
+                             size='vendas_por_interacao', hover_data=['cidade'],
+                             title='Análise Regional: Vendas vs Interações de Marketing')
     return fig, regional
 
-def analise_churn(tables):
-    vendas = tables['vendas']
-    clientes = tables['clientes']
-    
-    # Convertendo datas
-    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
-    
-    # Encontrando última compra de cada cliente
-    ultima_compra = vendas.groupby('id_cliente')['data_venda'].max().reset_index()
-    ultima_compra.columns = ['id_cliente', 'ultima_compra']
+@instrumentacao.medir()
+def analise_churn(fonte):
+    ultima_compra, taxa_churn = _motor(fonte).churn_clientes(fonte)
     
-    # Data atual (última data de venda no dataset)
-    data_atual = vendas['data_venda'].max()
-    
-    # Calculando dias desde última compra
-    ultima_compra['dias_sem_comprar'] = (data_atual - ultima_compra['ultima_compra']).dt.days
-    
-    # Definindo clientes inativos (sem compras nos últimos 90 dias)
-    ultima_compra['status'] = ultima_compra['dias_sem_comprar'].apply(
-        lambda x: 'Ativo' if x <= 90 else 'Inativo'
-    )
-    
-    # Calculando métricas de churn
-    total_clientes = len(ultima_compra)
-    clientes_inativos = len(ultima_compra[ultima_compra['status'] == 'Inativo'])
-    taxa_churn = (clientes_inativos / total_clientes) * 100
-    
-    # Criando gráfico de distribuição de dias sem comprar
-    fig = px.histogram(ultima_compra, x='dias_sem_comprar',
-                      title='Distribuição de Dias sem Comprar',
-                      labels={'dias_sem_comprar': 'Dias desde última compra'},
-                      color='status',
-                      color_discrete_map={'Ativo': '#2ecc71', 'Inativo': '#e74c3c'})
+    # Criando gráfico de distribuição de dias sem comprar (faixas contadas no servidor)
+    fig = graficos.histograma(ultima_compra, x='dias_sem_comprar',
+                              title='Distribuição de Dias sem Comprar',
+                              labels={'dias_sem_comprar': 'Dias desde última compra'},
+                              color='status',
+                              color_discrete_map={'Ativo': '#2ecc71', 'Inativo': '#e74c3c'})
     
     return fig, ultima_compra, taxa_churn
 
-def analise_retencao(tables):
-    vendas = tables['vendas']
-    clientes = tables['clientes']
-    
-    # Convertendo datas
-    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
-    vendas['mes_ano'] = vendas['data_venda'].dt.strftime('%Y-%m')
-    
-    # Encontrando primeiro mês de compra de cada cliente
-    primeira_compra = vendas.groupby('id_cliente')['mes_ano'].min().reset_index()
-    primeira_compra.columns = ['id_cliente', 'primeiro_mes']
-    
-    # Calculando retenção mensal
-    meses_unicos = sorted(vendas['mes_ano'].unique())
-    retencao = []
-    
-    for mes in meses_unicos:
-        clientes_mes = vendas[vendas['mes_ano'] == mes]['id_cliente'].unique()
-        novos_clientes = primeira_compra[primeira_compra['primeiro_mes'] == mes]['id_cliente'].unique()
-        clientes_retidos = len(set(clientes_mes) - set(novos_clientes))
-        total_clientes_anterior = len(primeira_compra[primeira_compra['primeiro_mes'] < mes])
-        
-        if total_clientes_anterior > 0:
-            taxa_retencao = (clientes_retidos / total_clientes_anterior) * 100
-        else:
-            taxa_retencao = 0
-            
-        retencao.append({
-            'mes': mes,
-            'taxa_retencao': taxa_retencao,
-            'novos_clientes': len(novos_clientes),
-            'clientes_retidos': clientes_retidos
-        })
-    
-    df_retencao = pd.DataFrame(retencao)
+@instrumentacao.medir()
+def analise_retencao(fonte):
+    # Matriz de coortes calculada uma vez; a série mensal sai dela
+    longa = _motor(fonte).coortes(fonte)
+    df_retencao = analises.retencao_de_coortes(longa)
+    contagens, taxas = analises.matriz_coortes(longa)
     
     # Criando gráfico de retenção
-    fig = px.line(df_retencao, x='mes', y='taxa_retencao',
-                  title='Taxa de Retenção Mensal',
-                  labels={'taxa_retencao': 'Taxa de Retenção (%)', 'mes': 'Mês'})
+    fig = graficos.linhas(df_retencao, x='mes', y='taxa_retencao',
+                          title='Taxa de Retenção Mensal',
+                          labels={'taxa_retencao': 'Taxa de Retenção (%)', 'mes': 'Mês'})
     
-    return fig, df_retencao
-
-def classificacao_clientes(tables):
-    vendas = tables['vendas']
-    clientes = tables['clientes']
-    
-    # Calculando métricas por cliente
-    metricas_clientes = vendas.groupby('id_cliente').agg({
-        'valor_total': ['sum', 'mean', 'count'],
-        'data_venda': ['min', 'max']
-    }).reset_index()
-    
-    metricas_clientes.columns = ['id_cliente', 'valor_total', 'ticket_medio', 'frequencia', 'primeira_compra', 'ultima_compra']
+    # Criando mapa de calor das coortes
+    fig_coortes = px.imshow(taxas, text_auto='.0f', aspect='auto',
+                            color_continuous_scale='Blues',
+                            title='Retenção por Coorte (%)',
+                            labels={'x': 'Meses desde a primeira compra', 'y': 'Coorte', 'color': 'Retenção (%)'})
     
-    # Calculando RFM
-    data_atual = vendas['data_venda'].max()
-    metricas_clientes['recencia'] = (data_atual - metricas_clientes['ultima_compra']).dt.days
+    return fig, df_retencao, fig_coortes, contagens
+
+CORES_SEGMENTOS = {
+    'Alto Valor': '#2ecc71',
+    'Valor Médio': '#3498db',
+    'Em Risco': '#e74c3c',
+    'Baixo Valor': '#95a5a6',
+    'Campeões': '#27ae60',
+    'Clientes Fiéis': '#2ecc71',
+    'Novos Clientes': '#1abc9c',
+    'Potenciais Fiéis': '#3498db',
+    'Precisam de Atenção': '#f39c12',
+    'Hibernando': '#95a5a6'
+}
+
+@instrumentacao.medir()
+def classificacao_clientes(fonte, segmentacao='legado'):
+    metricas_clientes = _motor(fonte).classificacao_clientes(fonte, segmentacao)
     
-    # Classificando clientes
-    def classificar_cliente(row):
-        if row['valor_total'] > metricas_clientes['valor_total'].quantile(0.75) and \
-           row['frequencia'] > metricas_clientes['frequencia'].quantile(0.75) and \
-           row['recencia'] < metricas_clientes['recencia'].quantile(0.25):
-            return 'Alto Valor'
-        elif row['valor_total'] > metricas_clientes['valor_total'].quantile(0.5) and \
-             row['frequencia'] > metricas_clientes['frequencia'].quantile(0.5):
-            return 'Valor Médio'
-        elif row['recencia'] > metricas_clientes['recencia'].quantile(0.75):
-            return 'Em Risco'
-        else:
-            return 'Baixo Valor'
+    # Criando gráfico de distribuição de segmentos (clientes contados por segmento no servidor)
+    fig = graficos.pizza(metricas_clientes, names='segmento',
+                         title='Distribuição de Clientes por Segmento',
+                         color='segmento',
+                         color_discrete_map=CORES_SEGMENTOS)
     
-    metricas_clientes['segmento'] = metricas_clientes.apply(classificar_cliente, axis=1)
+    return fig, metricas_clientes
+
+@instrumentacao.medir()
+def analise_churn_aproximada(esb):
+    # Histograma já agregado em faixas pelos esboços, com o intervalo de cada faixa
+    faixas, resumo = esbocos.churn_clientes(esb)
+    fig = px.bar(faixas, x='dias_sem_comprar', y='clientes', color='status', error_y='erro',
+                 hover_data=['faixa'],
+                 title='Distribuição de Dias sem Comprar (aproximada)',
+                 labels={'dias_sem_comprar': 'Dias desde última compra', 'clientes': 'Clientes'},
+                 color_discrete_map={'Ativo': '#2ecc71', 'Inativo': '#e74c3c'})
+    fig.update_layout(bargap=0)
+    return fig, resumo
+
+@instrumentacao.medir()
+def classificacao_aproximada(esb, segmentacao='legado'):
+    contagem, limites = esbocos.classificacao_clientes(esb, segmentacao)
+    fig = px.pie(contagem, names='segmento', values='clientes',
+                 title='Distribuição de Clientes por Segmento (aproximada)',
+                 color='segmento', color_discrete_map=CORES_SEGMENTOS)
+    return fig, contagem, limites
+
+@instrumentacao.medir()
+def analise_probabilidade_churn(db_path, calculado_em=None):
+    # Pontuações BG/NBD já gravadas no banco; calculado_em só diferencia a chave do cache
+    pontuacoes = pontuacao_churn.pontuacoes(db_path)
+    compraram = pontuacoes.dropna(subset=['prob_churn'])
+    fig = graficos.histograma(compraram, x='prob_churn', formato='.0%',
+                              title='Distribuição da Probabilidade de Churn (BG/NBD)',
+                              labels={'prob_churn': 'Probabilidade de churn'})
+    return fig, pontuacoes, pontuacao_churn.resumo(db_path)
+
+def calcular_pontuacao_churn(db_path):
+    # Roda na sessão, sem pool de processos (fork dentro do servidor não é seguro);
+    # bancos grandes devem ser pontuados por python pontuacao_churn.py
+    barra = st.progress(0.0, text="Calculando probabilidades de churn")
+    try:
+        pontuacao_churn.pontuar_banco(db_path, processos=1,
+                                      progresso=lambda fracao, etapa: barra.progress(fracao, text=etapa))
+    except Exception as e:
+        st.error(f"Erro ao calcular as probabilidades de churn: {str(e)}")
+    finally:
+        barra.empty()
+
+@instrumentacao.medir()
+def analise_atribuicao(fonte, modelo='ultimo_toque', janela_dias=atribuicao.JANELA_DIAS):
+    atribuida = _motor(fonte).atribuicao_campanhas(fonte, modelo, janela_dias)
     
-    # Criando gráfico de distribuição de segmentos
-    fig = px.pie(metricas_clientes, names='segmento',
-                 title='Distribuição de Clientes por Segmento',
-                 color='segmento',
-                 color_discrete_map={
-                     'Alto Valor': '#2ecc71',
-                     'Valor Médio': '#3498db',
-                     'Em Risco': '#e74c3c',
-                     'Baixo Valor': '#95a5a6'
-                 })
+    # Receita atribuída contra o custo, para as campanhas de maior receita
+    principais = atribuida.head(20).melt(id_vars=['nome_campanha'], value_vars=['receita_atribuida', 'custo'],
+                                         var_name='medida', value_name='valor')
+    fig = px.bar(principais, x='nome_campanha', y='valor', color='medida', barmode='group',
+                 title=f'Receita Atribuída vs Custo ({atribuicao.MODELOS[modelo]}, janela de {janela_dias} dias)',
+                 labels={'nome_campanha': 'Campanha', 'valor': 'R$', 'medida': ''},
+                 color_discrete_map={'receita_atribuida': '#2ecc71', 'custo': '#e74c3c'})
     
-    return fig, metricas_clientes
+    return fig, atribuida
 
-def main():
+def pagina():
     st.markdown('<h1 class="main-header">📊 Análise de Vendas e Marketing</h1>', unsafe_allow_html=True)
     st.sidebar.header("📁 Carregar Banco de Dados")
     uploaded_file = st.sidebar.file_uploader(
@@ -327,15 +530,49 @@ def main():
         help="Faça upload do arquivo SQLite com os dados de vendas e marketing"
     )
     if uploaded_file is not None:
-        with open("temp_database.db", "wb") as f:
-            f.write(uploaded_file.getbuffer())
-        with st.spinner("Carregando dados..."):
-            tables = load_data("temp_database.db")
+        db_path = caminho_do_upload(uploaded_file)
+        if not preparar_banco(db_path):
+            return
+        modos = ["Pandas (em memória)", "SQL (agregação no banco)", "Incremental (agregados persistidos)",
+                 "Streaming (lotes, memória limitada)"]
+        if analises_polars.disponivel():
+            modos.insert(1, "Polars (colunar, todos os núcleos)")
+        modo = st.sidebar.radio(
+            "Modo de execução:",
+            modos,
+            help="No modo Polars as análises são planos preguiçosos otimizados e executados em paralelo sobre as tabelas em memória. "
+                 "No modo SQL cada análise roda como consulta agregada no SQLite e só o resultado é carregado. "
+                 "No modo incremental os agregados de clientes, coortes e campanhas ficam salvos e só as linhas novas são processadas. "
+                 "No modo streaming vendas e interações são lidas em lotes e resumidas, para bancos maiores que a memória"
+        )
+        if modo.startswith("SQL"):
+            tables = db_path
+        elif modo.startswith("Incremental"):
+            with st.spinner("Atualizando agregados..."):
+                processadas = incremental.atualizar(db_path)
+            st.sidebar.caption(
+                f"Linhas novas incorporadas: {processadas['Vendas']} vendas, "
+                f"{processadas['Interacoes_Marketing']} interações"
+            )
+            tables = incremental.Agregados(db_path)
+        elif modo.startswith("Streaming"):
+            tables = streaming.Fluxo(db_path)
+            st.sidebar.caption(
+                f"Orçamento de memória: {tables.orcamento_mb:g} MB "
+                f"(lotes de {tables.linhas_por_lote:,} linhas)"
+            )
+        elif modo.startswith("Polars"):
+            with st.spinner("Carregando dados..."):
+                tables = load_polars(db_path)
+        else:
+            with st.spinner("Carregando dados..."):
+                tables = load_data(db_path)
         if tables is not None:
+            motor = _motor(tables)
             st.sidebar.success("✅ Banco de dados carregado com sucesso!")
             st.sidebar.markdown("### 📊 Informações do Banco")
-            for table_name, df in tables.items():
-                st.sidebar.write(f"**{table_name.title()}**: {len(df)} registros")
+            for table_name, registros in motor.contagens(tables).items():
+                st.sidebar.write(f"**{table_name.title()}**: {registros} registros")
             st.sidebar.markdown("### 🔍 Análises Disponíveis")
             menu_options = [
                 "📋 Visão Geral",
@@ -345,31 +582,41 @@ def main():
                 "🎯 D. Análises Adicionais"
             ]
             selected_section = st.sidebar.selectbox("Selecione uma seção:", menu_options)
+            dados, filtros = dados_filtrados(db_path, modo, tables)
+            if dados is None:
+                return
+            filtros = astuple(filtros)
+            sem_dados = _motor(dados).sem_registros(dados)
+            precalcular_secoes(db_path, tables, dados, filtros, sem_dados, selected_section)
             
             if selected_section == "📋 Visão Geral":
                 st.markdown('<h2 class="section-header">Visão Geral dos Dados</h2>', unsafe_allow_html=True)
+                contagens = motor.contagens(tables)
                 col1, col2, col3, col4 = st.columns(4)
                 with col1:
-                    st.metric("Total de Clientes", len(tables['clientes']))
+                    st.metric("Total de Clientes", contagens['clientes'])
                 with col2:
-                    st.metric("Total de Produtos", len(tables['produtos']))
+                    st.metric("Total de Produtos", contagens['produtos'])
                 with col3:
-                    st.metric("Total de Campanhas", len(tables['campanhas']))
+                    st.metric("Total de Campanhas", contagens['campanhas'])
                 with col4:
-                    total_vendas = tables['vendas']['valor_total'].sum()
+                    total_vendas = motor.receita_total(tables)
                     st.metric("Receita Total", f"R$ {total_vendas:,.2f}")
                 st.markdown("### 📊 Preview das Tabelas")
                 tab1, tab2, tab3, tab4, tab5 = st.tabs(["Clientes", "Produtos", "Campanhas", "Vendas", "Interações"])
                 with tab1:
-                    st.dataframe(tables['clientes'].head(), use_container_width=True)
+                    mostrar_tabela(motor.amostra(tables, 'clientes'), use_container_width=True)
                 with tab2:
-                    st.dataframe(tables['produtos'].head(), use_container_width=True)
+                    mostrar_tabela(motor.amostra(tables, 'produtos'), use_container_width=True)
                 with tab3:
-                    st.dataframe(tables['campanhas'].head(), use_container_width=True)
+                    mostrar_tabela(motor.amostra(tables, 'campanhas'), use_container_width=True)
                 with tab4:
-                    st.dataframe(tables['vendas'].head(), use_container_width=True)
+                    mostrar_tabela(motor.amostra(tables, 'vendas'), use_container_width=True)
                 with tab5:
-                    st.dataframe(tables['interacoes'].head(), use_container_width=True)
+                    mostrar_tabela(motor.amostra(tables, 'interacoes'), use_container_width=True)
+            
+            elif selected_section == "💰 A. Análise de Vendas" and sem_dados:
+                st.warning("Nenhum registro encontrado para os filtros selecionados.")
             
             elif selected_section == "💰 A. Análise de Vendas":
                 st.markdown('<h2 class="section-header">A. Análise de Vendas</h2>', unsafe_allow_html=True)
@@ -389,31 +636,34 @@ def main():
                 """)
                 
                 st.markdown("### 1. Total de Vendas por Canal")
-                fig1, data1 = analise_vendas_por_canal(tables)
-                st.plotly_chart(fig1, use_container_width=True)
+                fig1, data1 = em_cache(db_path, analise_vendas_por_canal, dados, filtros=filtros)
+                mostrar_grafico(fig1, use_container_width=True)
                 col1, col2 = st.columns(2)
                 with col1:
-                    st.dataframe(data1, use_container_width=True)
+                    mostrar_tabela(data1, use_container_width=True)
                 with col2:
                     st.markdown('<div class="insight-box"><h4>💡 Insights</h4><p>Análise do desempenho dos canais de aquisição no último trimestre.</p></div>', unsafe_allow_html=True)
                 st.divider()
                 
                 st.markdown("### 2. Top 5 Produtos")
-                fig2, data2 = top_produtos_analise(tables)
-                st.plotly_chart(fig2, use_container_width=True)
-                st.dataframe(data2, use_container_width=True)
+                fig2, data2 = em_cache(db_path, top_produtos_analise, dados, filtros=filtros)
+                mostrar_grafico(fig2, use_container_width=True)
+                mostrar_tabela(data2, use_container_width=True)
                 st.divider()
                 
                 st.markdown("### 3. Segmentação de Clientes")
-                fig3, data3 = segmentacao_clientes(tables)
-                st.plotly_chart(fig3, use_container_width=True)
-                st.dataframe(data3, use_container_width=True)
+                fig3, data3 = em_cache(db_path, segmentacao_clientes, dados, filtros=filtros)
+                mostrar_grafico(fig3, use_container_width=True)
+                mostrar_tabela(data3, use_container_width=True)
                 st.divider()
                 
                 st.markdown("### 4. Análise de Sazonalidade")
-                fig4, data4 = analise_sazonalidade(tables)
-                st.plotly_chart(fig4, use_container_width=True)
-                st.dataframe(data4, use_container_width=True)
+                fig4, data4 = em_cache(db_path, analise_sazonalidade, dados, filtros=filtros)
+                mostrar_grafico(fig4, use_container_width=True)
+                mostrar_tabela(data4, use_container_width=True)
+            
+            elif selected_section == "📈 B. Análise de Marketing" and sem_dados:
+                st.warning("Nenhum registro encontrado para os filtros selecionados.")
             
             elif selected_section == "📈 B. Análise de Marketing":
                 st.markdown('<h2 class="section-header">B. Análise de Marketing</h2>', unsafe_allow_html=True)
@@ -433,15 +683,19 @@ def main():
                 """)
                 
                 st.markdown("### 5. Eficiência das Campanhas")
-                fig5, data5 = eficiencia_campanhas(tables)
-                st.plotly_chart(fig5, use_container_width=True)
-                st.dataframe(data5[['nome_campanha', 'canal_marketing', 'orcamento', 'taxa_conversao', 'conversoes']], use_container_width=True)
+                fig5, data5 = em_cache(db_path, eficiencia_campanhas, dados, filtros=filtros)
+                mostrar_grafico(fig5, use_container_width=True)
+                tabela_paginada(data5, 'eficiencia_campanhas',
+                                ['nome_campanha', 'canal_marketing', 'orcamento', 'taxa_conversao', 'conversoes'])
                 st.divider()
                 
                 st.markdown("### 6. Análise de Canais de Marketing")
-                fig6, data6 = analise_canais_marketing(tables)
-                st.plotly_chart(fig6, use_container_width=True)
-                st.dataframe(data6, use_container_width=True)
+                fig6, data6 = em_cache(db_path, analise_canais_marketing, dados, filtros=filtros)
+                mostrar_grafico(fig6, use_container_width=True)
+                mostrar_tabela(data6, use_container_width=True)
+            
+            elif selected_section == "🔄 C. Análise Integrada" and sem_dados:
+                st.warning("Nenhum registro encontrado para os filtros selecionados.")
             
             elif selected_section == "🔄 C. Análise Integrada":
                 st.markdown('<h2 class="section-header">C. Análise Integrada</h2>', unsafe_allow_html=True)
@@ -461,14 +715,14 @@ def main():
                 """)
                 
                 st.markdown("### 7. Relação Temporal")
-                fig7, data7 = relacao_temporal(tables)
-                st.plotly_chart(fig7, use_container_width=True)
+                fig7, data7 = em_cache(db_path, relacao_temporal, dados, filtros=filtros)
+                mostrar_grafico(fig7, use_container_width=True)
                 st.divider()
                 
                 st.markdown("### 8. Análise Regional")
-                fig8, data8 = analise_regional(tables)
-                st.plotly_chart(fig8, use_container_width=True)
-                st.dataframe(data8, use_container_width=True)
+                fig8, data8 = em_cache(db_path, analise_regional, dados, filtros=filtros)
+                mostrar_grafico(fig8, use_container_width=True)
+                tabela_paginada(data8, 'desempenho_regional')
             
             elif selected_section == "🎯 D. Análises Adicionais":
                 st.markdown('<h2 class="section-header">D. Análises Adicionais</h2>', unsafe_allow_html=True)
@@ -487,29 +741,77 @@ def main():
                 - Estratégias de fidelização
                 """)
                 
+                aproximado = st.toggle(
+                    "Modo aproximado (esboços HyperLogLog/KLL)",
+                    help="Churn, retenção e classificação estimados por esboços de tamanho fixo, montados numa "
+                         "passada pelo banco: respondem em milissegundos a qualquer período, com o intervalo de "
+                         "erro ao lado de cada número. Útil em bancos grandes, onde as análises exatas demoram"
+                )
+                esb = load_esbocos(db_path) if aproximado else None
+                aproximado = esb is not None
+                erro_hll = esbocos.Z * esbocos.erro_relativo() * 100
+                
                 # Adicionando abas para diferentes análises
-                tab1, tab2, tab3, tab4 = st.tabs([
+                tab1, tab2, tab3, tab_atribuicao, tab4 = st.tabs([
                     "📊 Análise de Churn",
                     "📈 Retenção de Clientes",
                     "👥 Classificação de Clientes",
+                    "💸 Atribuição de Receita",
                     "🔍 Consulta SQL Personalizada"
                 ])
                 
                 with tab1:
                     st.markdown("### 📊 Análise de Churn")
-                    fig_churn, df_churn, taxa_churn = analise_churn(tables)
-                    st.plotly_chart(fig_churn, use_container_width=True)
+                    if aproximado:
+                        fig_churn, resumo_churn = em_cache(db_path, analise_churn_aproximada, esb)
+                        mostrar_grafico(fig_churn, use_container_width=True)
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.metric("Taxa de Churn", f"{resumo_churn['taxa_churn']:.1f}% ± {resumo_churn['erro_taxa']:.1f}")
+                        with col2:
+                            st.metric("Clientes Ativos", f"{resumo_churn['ativos']:,.0f} ± {resumo_churn['erro_ativos']:,.0f}")
+                        st.caption(f"Contagens HyperLogLog: ±{erro_hll:.1f}% com ~95% de confiança; "
+                                   "as barras de erro mostram o intervalo de cada faixa")
+                    else:
+                        fig_churn, df_churn, taxa_churn = em_cache(db_path, analise_churn, tables)
+                        mostrar_grafico(fig_churn, use_container_width=True)
+                        
+                        col1, col2 = st.columns(2)
+                        with col1:
+                            st.metric("Taxa de Churn", f"{taxa_churn:.1f}%")
+                        with col2:
+                            st.metric("Clientes Ativos", 
+                                    len(df_churn[df_churn['status'] == 'Ativo']))
                     
-                    col1, col2 = st.columns(2)
-                    with col1:
-                        st.metric("Taxa de Churn", f"{taxa_churn:.1f}%")
-                    with col2:
-                        st.metric("Clientes Ativos", 
-                                len(df_churn[df_churn['status'] == 'Ativo']))
+                    st.markdown("#### 🔮 Probabilidade de Churn (BG/NBD)")
+                    modelo_churn = pontuacao_churn.modelo(db_path)
+                    if modelo_churn is None:
+                        st.info("As probabilidades de churn ainda não foram calculadas para as vendas atuais deste banco.")
+                        if st.button("Calcular probabilidades de churn"):
+                            calcular_pontuacao_churn(db_path)
+                            st.rerun()
+                    else:
+                        fig_prob, df_prob, resumo_prob = em_cache(db_path, analise_probabilidade_churn, db_path,
+                                                                  modelo_churn['calculado_em'])
+                        mostrar_grafico(fig_prob, use_container_width=True)
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("Clientes Ativos Esperados", f"{resumo_prob['ativos_esperados']:,.0f}")
+                        with col2:
+                            st.metric("Probabilidade Média de Churn", f"{resumo_prob['churn_medio']:.1f}%")
+                        with col3:
+                            st.metric("Clientes sem Compras", f"{resumo_prob['sem_compra']:,}")
+                        tabela_paginada(df_prob, 'prob_churn',
+                                        ['id_cliente', 'compras', 'ultima_compra', 'dias_sem_comprar', 'prob_ativo', 'prob_churn'])
+                        st.caption(f"Modelo ajustado em {modelo_churn['calculado_em']} com {modelo_churn['clientes']:,} "
+                                   f"clientes até {modelo_churn['data_referencia']} "
+                                   f"(r = {modelo_churn['r']:.3g}, α = {modelo_churn['alfa']:.3g}, "
+                                   f"a = {modelo_churn['a']:.3g}, b = {modelo_churn['b']:.3g})")
                     
                     st.markdown("""
                     #### 💡 Insights sobre Churn
                     - **Definição**: Clientes considerados inativos após 90 dias sem compras
+                    - **Probabilidade (BG/NBD)**: chance de o cliente já ter abandonado, pelo ritmo de compras dele e da base; clientes que compram com frequência e pararam há pouco têm churn alto antes dos 90 dias
                     - **Ações Recomendadas**:
                         - Implementar programa de fidelidade
                         - Criar campanhas de reativação
@@ -518,8 +820,27 @@ def main():
                 
                 with tab2:
                     st.markdown("### 📈 Análise de Retenção")
-                    fig_retencao, df_retencao = analise_retencao(tables)
-                    st.plotly_chart(fig_retencao, use_container_width=True)
+                    fig_retencao, df_retencao, fig_coortes, df_coortes = em_cache(
+                        db_path, analise_retencao, esb if aproximado else tables)
+                    col1, col2 = st.columns(2)
+                    with col1:
+                        mostrar_grafico(fig_retencao, use_container_width=True)
+                    with col2:
+                        mostrar_grafico(fig_coortes, use_container_width=True)
+                    with st.expander("Clientes ativos por coorte"):
+                        mostrar_tabela(df_coortes, use_container_width=True)
+                    if aproximado:
+                        with st.expander("Novos e retidos com intervalo de erro"):
+                            mostrar_tabela(em_cache(db_path, esbocos.retencao_mensal, esb), use_container_width=True)
+                        inicio_esb = pd.Timestamp(esb.dia_inicial, unit='D').date()
+                        fim_esb = pd.Timestamp(esb.dia_final, unit='D').date()
+                        periodo_ativos = st.date_input("Clientes ativos no período:", (inicio_esb, fim_esb),
+                                                       min_value=inicio_esb, max_value=fim_esb)
+                        if len(periodo_ativos) == 2:
+                            ativos, erro_ativos = esbocos.clientes_ativos(esb, *periodo_ativos)
+                            st.metric("Clientes distintos com compras no período", f"{ativos:,.0f} ± {erro_ativos:,.0f}")
+                        st.caption(f"Contagens HyperLogLog: ±{erro_hll:.1f}% com ~95% de confiança; novos e retidos "
+                                   "são diferenças entre contagens, com os intervalos da tabela acima")
                     
                     st.markdown("""
                     #### 💡 Insights sobre Retenção
@@ -532,22 +853,84 @@ def main():
                 
                 with tab3:
                     st.markdown("### 👥 Classificação de Clientes")
-                    fig_class, df_class = classificacao_clientes(tables)
-                    st.plotly_chart(fig_class, use_container_width=True)
+                    tipo_segmentacao = st.radio(
+                        "Segmentação:",
+                        ["RFM (quintis)", "Legado (4 segmentos)"],
+                        horizontal=True
+                    )
+                    segmentacao = 'rfm' if tipo_segmentacao.startswith("RFM") else 'legado'
+                    if aproximado:
+                        fig_class, df_class, limites_class = em_cache(db_path, classificacao_aproximada, esb, segmentacao)
+                        mostrar_grafico(fig_class, use_container_width=True)
+                        with st.expander("Limites de quantil usados (KLL)"):
+                            mostrar_tabela(limites_class, use_container_width=True)
+                        st.caption(f"Cada limite está a no máximo {esbocos.KLL().erro_posto * 100:.2f}% dos clientes "
+                                   "do quantil exato (99% de confiança); só os clientes perto dos limites podem mudar de segmento")
+                    else:
+                        fig_class, df_class = em_cache(db_path, classificacao_clientes, tables, segmentacao)
+                        mostrar_grafico(fig_class, use_container_width=True)
                     
-                    st.markdown("""
+                    if segmentacao == 'rfm':
+                        st.markdown("""
+                    #### 💡 Insights sobre Classificação
+                    - **Scores R, F e M** de 1 a 5 por quintis de recência, frequência e valor
+                    - **Segmentos**:
+                        - **Campeões**: Compraram recentemente, com frequência e alto valor
+                        - **Clientes Fiéis**: Compram com frequência
+                        - **Novos Clientes**: Primeira compra recente
+                        - **Potenciais Fiéis**: Recentes e com bom valor de compras
+                        - **Em Risco**: Eram frequentes, mas estão sem comprar
+                        - **Hibernando**: Baixa atividade recente
+                        - **Precisam de Atenção**: Demais clientes
+                    """)
+                    else:
+                        st.markdown("""
                     #### 💡 Insights sobre Classificação
                     - **Segmentos**:
                         - **Alto Valor**: Maior frequência e valor de compras
                         - **Valor Médio**: Bom histórico de compras
                         - **Em Risco**: Baixa atividade recente
                         - **Baixo Valor**: Menor engajamento
+                    """)
+                    st.markdown("""
                     - **Ações Recomendadas**:
                         - Personalizar comunicação por segmento
                         - Desenvolver programas específicos
                         - Identificar oportunidades de upsell
                     """)
                 
+                with tab_atribuicao:
+                    st.markdown("### 💸 Atribuição de Receita às Campanhas")
+                    col_modelo, col_janela = st.columns(2)
+                    modelo_atribuicao = col_modelo.selectbox(
+                        "Modelo de atribuição:", list(atribuicao.MODELOS), format_func=atribuicao.MODELOS.get,
+                        help="Último/primeiro toque: a venda inteira vai para a interação mais recente/mais antiga da janela. "
+                             f"Linear: partes iguais. Decaimento: peso que cai pela metade a cada {atribuicao.MEIA_VIDA_DIAS} dias antes da venda"
+                    )
+                    janela_atribuicao = col_janela.slider("Janela (dias antes da venda):", 1, 90, atribuicao.JANELA_DIAS)
+                    fig_atribuicao, df_atribuicao = em_cache(db_path, analise_atribuicao, tables,
+                                                             modelo_atribuicao, janela_atribuicao)
+                    receita_total = motor.receita_total(tables)
+                    col1, col2, col3 = st.columns(3)
+                    with col1:
+                        st.metric("Receita Atribuída", f"R$ {df_atribuicao['receita_atribuida'].sum():,.2f}")
+                    with col2:
+                        st.metric("Receita sem Interação na Janela",
+                                  f"{(1 - df_atribuicao['receita_atribuida'].sum() / receita_total) * 100:.1f}%" if receita_total else "–")
+                    with col3:
+                        custo_total = df_atribuicao['custo'].sum()
+                        st.metric("ROI Geral",
+                                  f"{(df_atribuicao['receita_atribuida'].sum() - custo_total) / custo_total * 100:.1f}%" if custo_total else "–")
+                    mostrar_grafico(fig_atribuicao, use_container_width=True)
+                    tabela_paginada(df_atribuicao, 'atribuicao',
+                                    ['nome_campanha', 'canal_marketing', 'custo', 'vendas_atribuidas', 'receita_atribuida', 'roi'])
+                    st.markdown("""
+                    #### 💡 Como ler a atribuição
+                    - Cada venda é ligada às interações do mesmo cliente ocorridas até a data da venda, dentro da janela
+                    - **ROI** = (receita atribuída − custo) / custo da campanha
+                    - Compare os modelos: campanhas que só se destacam no primeiro toque abrem relacionamentos, as do último toque fecham vendas
+                    """)
+                
                 with tab4:
                     st.markdown("### 🔍 Consulta SQL Personalizada")
                     query = st.text_area(
@@ -557,22 +940,55 @@ def main():
                     )
                     if st.button("Executar Consulta"):
                         if query.strip():
-                            result = execute_query("temp_database.db", query)
-                            if result is not None:
-                                st.dataframe(result, use_container_width=True)
-                                if len(result.columns) >= 2:
-                                    st.markdown("### 📊 Visualização dos Resultados")
-                                    col_x = st.selectbox("Eixo X:", result.columns)
-                                    col_y = st.selectbox("Eixo Y:", [col for col in result.columns if col != col_x])
-                                    chart_type = st.selectbox("Tipo de Gráfico:", ["Bar", "Line", "Scatter"])
-                                    if st.button("Gerar Gráfico"):
-                                        if chart_type == "Bar":
-                                            fig = px.bar(result, x=col_x, y=col_y)
-                                        elif chart_type == "Line":
-                                            fig = px.line(result, x=col_x, y=col_y)
-                                        else:
-                                            fig = px.scatter(result, x=col_x, y=col_y)
-                                        st.plotly_chart(fig, use_container_width=True)
+                            st.session_state['consulta_sql'] = execute_query(db_path, query)
+                    base = st.session_state.get('consulta_sql')
+                    consulta = None
+                    if base is not None and base.db_path == db_path:
+                        # Ordenação e filtro viram uma consulta sobre a do usuário, no SQLite
+                        selecao = controles_tabela(base.colunas, 'sql')
+                        consulta = execute_query(db_path, console_sql.ordenar_filtrar(base.sql, *selecao))
+                    if consulta is not None:
+                        pagina = pagina_atual('sql', (base.sql,) + selecao)
+                        try:
+                            result = consulta.pagina(pagina)
+                        except console_sql.TempoEsgotado as e:
+                            st.error(str(e))
+                            result = None
+                        if result is not None:
+                            inicio = pagina * consulta.tamanho_pagina
+                            total = f"{len(consulta.linhas):,}" if consulta.esgotada else f"{len(consulta.linhas):,}+"
+                            if consulta.truncada:
+                                st.warning(f"Resultado limitado às primeiras {console_sql.LIMITE_LINHAS:,} linhas. "
+                                           "Use filtros, agregações ou LIMIT para reduzir a consulta; "
+                                           "o download traz o resultado completo.")
+                            if consulta.plano is not None:
+                                col_resultado, col_plano = st.columns([3, 2])
+                                with col_plano:
+                                    st.markdown("**Consulta lenta — plano de execução:**")
+                                    mostrar_tabela(consulta.plano, use_container_width=True, hide_index=True)
+                            else:
+                                col_resultado = st.container()
+                            with col_resultado:
+                                mostrar_tabela(result, use_container_width=True)
+                            st.caption(f"Linhas {inicio + 1 if len(result) else 0:,}–{inicio + len(result):,} de {total} · "
+                                       f"{consulta.duracao:.2f} s")
+                            navegacao('sql', pagina, not (consulta.esgotada and pagina + 1 >= consulta.total_paginas_conhecidas))
+                            botoes_download('consulta', lambda sql=consulta.sql: console_sql.lotes(db_path, sql))
+                            carregadas = consulta.carregadas()
+                            if len(carregadas.columns) >= 2:
+                                st.markdown("### 📊 Visualização dos Resultados")
+                                st.caption(f"Gráfico com as {len(carregadas):,} linhas já carregadas.")
+                                col_x = st.selectbox("Eixo X:", carregadas.columns)
+                                col_y = st.selectbox("Eixo Y:", [col for col in carregadas.columns if col != col_x])
+                                chart_type = st.selectbox("Tipo de Gráfico:", ["Bar", "Line", "Scatter"])
+                                if st.button("Gerar Gráfico"):
+                                    if chart_type == "Bar":
+                                        fig = graficos.barras(carregadas, x=col_x, y=col_y)
+                                    elif chart_type == "Line":
+                                        fig = graficos.linhas(carregadas, x=col_x, y=col_y)
+                                    else:
+                                        fig = graficos.dispersao(carregadas, x=col_x, y=col_y)
+                                    mostrar_grafico(fig, use_container_width=True)
     else:
         st.info("👆 Faça upload do arquivo vendas_marketing.db na barra lateral para começar a análise.")
         st.markdown("""
@@ -586,5 +1002,14 @@ def main():
         - **Vendas**: id_venda, id_cliente, id_produto, id_campanha, data_venda, quantidade, valor_total, canal_aquisicao
         """)
 
+def main():
+    if st.session_state.get('medir_desempenho', instrumentacao.PADRAO):
+        instrumentacao.iniciar(st.session_state.setdefault('sessao', uuid.uuid4().hex[:12]))
+    try:
+        pagina()
+    finally:
+        etapas = instrumentacao.encerrar()
+    painel_desempenho(etapas)
+
 if __name__ == "__main__":
     main() 
@@ -0,0 +1,227 @@
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import ingestao
+
+# Atribuição de receita às campanhas: cada venda é ligada às interações do
+# mesmo cliente ocorridas até ela, dentro de uma janela de dias, e o valor da
+# venda é dividido entre as campanhas dessas interações conforme o modelo:
+#   ultimo_toque   - tudo para a interação mais recente
+#   primeiro_toque - tudo para a mais antiga da janela
+#   linear         - partes iguais entre as interações da janela
+#   decaimento     - peso 2^(-dias até a venda / meia-vida), normalizado por venda
+#
+# A junção é um as-of join vetorizado, sem produto cartesiano: as interações
+# são ordenadas uma vez por (cliente, instante) em uma chave int64 e, para cada
+# venda, duas buscas binárias (np.searchsorted) dão o intervalo de interações
+# do cliente dentro da janela. Só os modelos que repartem a venda expandem esse
+# intervalo em pares (venda, interação), e as vendas são processadas em lotes
+# para que a memória dos pares não dependa do tamanho da base. A preparação
+# (ordenação) é compartilhada entre modelos e janelas.
+#
+# Uso noturno (lê o banco em lotes, sem passar pelo pandas):
+#   python atribuicao.py vendas_marketing.db --janela 30 --saida atribuicao.csv
+
+MODELOS = {
+    'ultimo_toque': 'Último toque',
+    'primeiro_toque': 'Primeiro toque',
+    'linear': 'Linear',
+    'decaimento': 'Decaimento no tempo',
+}
+
+JANELA_DIAS = 30
+MEIA_VIDA_DIAS = 7
+LOTE_VENDAS = int(os.environ.get('ATRIBUICAO_LOTE_VENDAS', 1_000_000))
+LOTE_LEITURA = 1_000_000
+
+_DIA = 86_400
+_BITS_TEMPO = 32
+_MASCARA_TEMPO = (1 << _BITS_TEMPO) - 1
+
+
+@dataclass(frozen=True)
+class Toques:
+    # Interações ordenadas por (cliente, instante): chave = cliente << 32 | segundos desde `base`
+    chaves: np.ndarray
+    campanhas: np.ndarray
+    ids_campanha: np.ndarray
+    base: int
+
+
+def segundos(datas):
+    # Datas (Series/array datetime64) -> segundos desde 1970 em int64
+    return np.asarray(datas).astype('datetime64[s]').astype(np.int64)
+
+
+def _chave(clientes, tempos, base):
+    return (np.asarray(clientes, dtype=np.int64) << _BITS_TEMPO) | (tempos - base)
+
+
+def preparar(clientes, tempos, campanhas, base=None):
+    # base: menor instante considerado (o de vendas ou interações, o que vier antes)
+    tempos = np.asarray(tempos, dtype=np.int64)
+    if base is None:
+        base = int(tempos.min()) if len(tempos) else 0
+    codigos, ids_campanha = pd.factorize(np.asarray(campanhas))
+    chaves = _chave(clientes, tempos, base)
+    ordem = np.argsort(chaves, kind='stable')
+    return Toques(chaves[ordem], codigos[ordem].astype(np.int32), ids_campanha, base)
+
+
+def atribuir(toques, clientes, tempos, valores, modelo='ultimo_toque', janela_dias=JANELA_DIAS,
+             meia_vida_dias=MEIA_VIDA_DIAS, lote=LOTE_VENDAS):
+    # Devolve (receita, vendas) atribuídas a cada campanha de toques.ids_campanha
+    if modelo not in MODELOS:
+        raise ValueError(f"Modelo de atribuição desconhecido: {modelo}")
+    receita = np.zeros(len(toques.ids_campanha))
+    vendas = np.zeros(len(toques.ids_campanha))
+    if len(toques.chaves) == 0:
+        return receita, vendas
+    janela = int(janela_dias * _DIA)
+    for inicio in range(0, len(clientes), lote):
+        cliente = np.asarray(clientes[inicio:inicio + lote], dtype=np.int64) << _BITS_TEMPO
+        tempo = np.asarray(tempos[inicio:inicio + lote], dtype=np.int64) - toques.base
+        valor = np.nan_to_num(np.asarray(valores[inicio:inicio + lote], dtype=np.float64))
+        # Vendas anteriores à primeira interação não têm toques a atribuir. As
+        # demais são ordenadas pela chave: buscas em ordem aproveitam o cache
+        valida = np.flatnonzero(tempo >= 0)
+        ordem = valida[np.argsort(cliente[valida] | tempo[valida])]
+        cliente, tempo, valor = cliente[ordem], tempo[ordem], valor[ordem]
+        fim = np.searchsorted(toques.chaves, cliente | tempo, side='right')
+        ini = np.searchsorted(toques.chaves, cliente | np.maximum(tempo - janela, 0), side='left')
+        quantos = fim - ini
+        if modelo in ('ultimo_toque', 'primeiro_toque'):
+            venda = np.flatnonzero(quantos > 0)
+            toque = fim[venda] - 1 if modelo == 'ultimo_toque' else ini[venda]
+            peso = np.ones(len(venda))
+        else:
+            venda = np.repeat(np.arange(len(quantos)), quantos)
+            deslocamento = np.arange(len(venda)) - np.repeat(np.cumsum(quantos) - quantos, quantos)
+            toque = np.repeat(ini, quantos) + deslocamento
+            if modelo == 'linear':
+                peso = 1.0 / quantos[venda]
+            else:
+                dias = (tempo[venda] - (toques.chaves[toque] & _MASCARA_TEMPO)) / _DIA
+                peso = np.exp2(-dias / meia_vida_dias)
+                peso /= np.bincount(venda, weights=peso, minlength=len(quantos))[venda]
+        campanha = toques.campanhas[toque]
+        receita += np.bincount(campanha, weights=peso * valor[venda], minlength=len(receita))
+        vendas += np.bincount(campanha, weights=peso, minlength=len(vendas))
+    return receita, vendas
+
+
+def resumo(campanhas, ids_campanha, receita, vendas):
+    # Receita e vendas atribuídas por campanha, com ROI sobre o custo (%)
+    atribuida = pd.DataFrame({
+        'id_campanha': ids_campanha,
+        'vendas_atribuidas': vendas,
+        'receita_atribuida': receita,
+    })
+    resultado = campanhas[['id_campanha', 'nome_campanha', 'canal_marketing', 'custo']].merge(
+        atribuida, on='id_campanha', how='left')
+    resultado[['vendas_atribuidas', 'receita_atribuida']] = resultado[['vendas_atribuidas', 'receita_atribuida']].fillna(0)
+    custo = resultado['custo'].where(resultado['custo'] > 0)
+    resultado['roi'] = (resultado['receita_atribuida'] - custo) / custo * 100
+    return resultado.sort_values('receita_atribuida', ascending=False, ignore_index=True)
+
+
+def atribuicao_campanhas(vendas, interacoes, campanhas, modelo='ultimo_toque', janela_dias=JANELA_DIAS,
+                         meia_vida_dias=MEIA_VIDA_DIAS, tipos=None):
+    # vendas/interações como DataFrames (datas em datetime64). Como em ler_banco,
+    # linhas sem cliente, campanha ou data ficam de fora: NaT viraria o menor
+    # int64 em segundos() e os ids nulos não cabem na chave int64
+    if tipos:
+        interacoes = interacoes[interacoes['tipo_interacao'].isin(tipos)]
+    validas = vendas['id_cliente'].notna() & vendas['data_venda'].notna()
+    if not validas.all():
+        vendas = vendas[validas]
+    validas = (interacoes['id_cliente'].notna() & interacoes['id_campanha'].notna()
+               & interacoes['data_interacao'].notna())
+    if not validas.all():
+        interacoes = interacoes[validas]
+    tempos_vendas = segundos(vendas['data_venda'])
+    tempos_toques = segundos(interacoes['data_interacao'])
+    base = min([int(t.min()) for t in (tempos_vendas, tempos_toques) if len(t)], default=0)
+    toques = preparar(interacoes['id_cliente'].to_numpy(dtype=np.int64), tempos_toques,
+                      interacoes['id_campanha'].to_numpy(dtype=np.int64), base)
+    receita, atribuidas = atribuir(toques, vendas['id_cliente'].to_numpy(dtype=np.int64), tempos_vendas,
+                                   vendas['valor_total'].to_numpy(), modelo, janela_dias, meia_vida_dias)
+    return resumo(campanhas, toques.ids_campanha, receita, atribuidas)
+
+
+def _ler_colunas(conn, sql, params, tipos, lote=LOTE_LEITURA):
+    # Colunas numéricas de uma consulta em arrays compactos, lidas em lotes
+    cursor = conn.execute(sql, params)
+    partes = []
+    while linhas := cursor.fetchmany(lote):
+        partes.append(np.array(linhas, dtype=np.float64 if np.float64 in tipos else np.int64))
+    colunas = np.concatenate(partes) if partes else np.empty((0, len(tipos)))
+    return [colunas[:, i].astype(tipo) for i, tipo in enumerate(tipos)]
+
+
+def ler_banco(db_path, tipos_interacao=None):
+    # (vendas, interações, campanhas) direto do SQLite, com os instantes já em
+    # segundos calculados pelo próprio banco. As interações vêm na ordem do
+    # id_interacao, que desempata as do mesmo cliente no mesmo instante (os
+    # índices da ingestão fariam o banco devolvê-las em outra ordem)
+    with closing(ingestao.configurar_leitura(sqlite3.connect(f"file:{db_path}?mode=ro", uri=True))) as conn:
+        vendas = _ler_colunas(conn, """
+            SELECT id_cliente, CAST(strftime('%s', data_venda) AS INTEGER), valor_total
+            FROM Vendas WHERE id_cliente IS NOT NULL AND data_venda IS NOT NULL
+        """, (), (np.int64, np.int64, np.float64))
+        filtro, params = '', ()
+        if tipos_interacao:
+            filtro = f" AND tipo_interacao IN ({', '.join('?' * len(tipos_interacao))})"
+            params = tuple(tipos_interacao)
+        interacoes = _ler_colunas(conn, f"""
+            SELECT id_cliente, CAST(strftime('%s', data_interacao) AS INTEGER), id_campanha
+            FROM Interacoes_Marketing
+            WHERE id_cliente IS NOT NULL AND id_campanha IS NOT NULL AND data_interacao IS NOT NULL{filtro}
+            ORDER BY id_interacao
+        """, params, (np.int64, np.int64, np.int64))
+        campanhas = pd.read_sql_query(
+            "SELECT id_campanha, nome_campanha, canal_marketing, custo FROM Campanhas_Marketing", conn)
+    return vendas, interacoes, campanhas
+
+
+def atribuicao_do_banco(db_path, modelos=tuple(MODELOS), janela_dias=JANELA_DIAS,
+                        meia_vida_dias=MEIA_VIDA_DIAS, tipos_interacao=None):
+    # Um resumo por modelo, todos sobre a mesma ordenação das interações
+    (v_cliente, v_tempo, v_valor), (t_cliente, t_tempo, t_campanha), campanhas = ler_banco(db_path, tipos_interacao)
+    base = min([int(t.min()) for t in (v_tempo, t_tempo) if len(t)], default=0)
+    toques = preparar(t_cliente, t_tempo, t_campanha, base)
+    del t_cliente, t_tempo, t_campanha
+    resultados = {}
+    for modelo in modelos:
+        receita, vendas = atribuir(toques, v_cliente, v_tempo, v_valor, modelo, janela_dias, meia_vida_dias)
+        resultados[modelo] = resumo(campanhas, toques.ids_campanha, receita, vendas)
+    return resultados
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Atribuição de receita às campanhas por janela de interações")
+    parser.add_argument('banco')
+    parser.add_argument('--modelos', nargs='+', choices=list(MODELOS), default=list(MODELOS))
+    parser.add_argument('--janela', type=float, default=JANELA_DIAS, help="dias antes da venda considerados")
+    parser.add_argument('--meia-vida', type=float, default=MEIA_VIDA_DIAS, help="meia-vida em dias (modelo decaimento)")
+    parser.add_argument('--tipos', nargs='+', help="tipos de interação considerados (padrão: todos)")
+    parser.add_argument('--saida', help="CSV com uma linha por modelo e campanha")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    resultados = atribuicao_do_banco(args.banco, args.modelos, args.janela, args.meia_vida, args.tipos)
+    tabela = pd.concat([df.assign(modelo=modelo) for modelo, df in resultados.items()], ignore_index=True)
+    if args.saida:
+        tabela.to_csv(args.saida, index=False)
+    else:
+        pd.set_option('display.width', 200)
+        print(tabela.to_string(index=False))
+    print(f"Atribuição concluída em {time.perf_counter() - inicio:.1f} s", file=sys.stderr)
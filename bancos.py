@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from dataclasses import fields, is_dataclass
+
+import numpy as np
+import pandas as pd
+
+import incremental
+import snapshot
+
+# Bancos enviados pelo dashboard, guardados uma única vez pelo hash do conteúdo
+# (.uploads/<hash>.db), e cache LRU em memória das tabelas carregadas e dos
+# resultados derivados de cada banco. Os dois lados respeitam um orçamento
+# configurável: ao passar do limite, os itens usados há mais tempo saem primeiro.
+# Como o processo do Streamlit é compartilhado, vários analistas enviando o
+# mesmo arquivo reaproveitam o mesmo banco e os mesmos resultados.
+
+DIRETORIO = os.environ.get('UPLOADS_DIR', '.uploads')
+LIMITE_DISCO = int(os.environ.get('UPLOADS_LIMITE_MB', 10240)) * 1024 * 1024
+LIMITE_MEMORIA = int(os.environ.get('CACHE_LIMITE_MB', 2048)) * 1024 * 1024
+
+_trava_indice = threading.Lock()
+
+
+def registrar_upload(conteudo, nome=None):
+    # Grava o conteúdo uma vez só; envios repetidos do mesmo arquivo não custam nada.
+    # Devolve o caminho do banco e o do envio anterior com o mesmo nome de arquivo
+    conteudo = memoryview(conteudo)
+    chave = hashlib.blake2b(conteudo, digest_size=16).hexdigest()
+    os.makedirs(DIRETORIO, exist_ok=True)
+    caminho = os.path.join(DIRETORIO, f'{chave}.db')
+    if not os.path.exists(caminho):
+        descritor, temporario = tempfile.mkstemp(dir=DIRETORIO, suffix='.parcial')
+        with os.fdopen(descritor, 'wb') as f:
+            f.write(conteudo)
+        os.replace(temporario, caminho)
+        limpar_disco(manter=caminho)
+    tocar(caminho)
+    return caminho, _trocar_ultimo_envio(nome, caminho) if nome else None
+
+
+def _trocar_ultimo_envio(nome, caminho):
+    indice = os.path.join(DIRETORIO, 'ultimos.json')
+    with _trava_indice:
+        ultimos = {}
+        if os.path.exists(indice):
+            with open(indice) as f:
+                ultimos = json.load(f)
+        anterior = ultimos.get(nome)
+        ultimos[nome] = caminho
+        with open(indice, 'w') as f:
+            json.dump(ultimos, f)
+    if anterior != caminho and anterior and os.path.exists(anterior):
+        return anterior
+    return None
+
+
+def chave_do_banco(caminho):
+    return os.path.splitext(os.path.basename(caminho))[0]
+
+
+def tocar(caminho):
+    os.utime(caminho)
+
+
+def _arquivos_do_banco(caminho):
+    # O banco (com os arquivos do modo WAL), os agregados incrementais e o
+    # snapshot colunar do mesmo conteúdo
+    arquivos = [caminho, f'{caminho}-wal', f'{caminho}-shm', incremental.caminho_agregados(caminho)]
+    return arquivos, snapshot.pasta(caminho, chave_do_banco(caminho))
+
+
+def _tamanho_em_disco(caminho):
+    arquivos, pasta = _arquivos_do_banco(caminho)
+    total = sum(os.path.getsize(a) for a in arquivos if os.path.exists(a))
+    for raiz, _, nomes in os.walk(pasta):
+        total += sum(os.path.getsize(os.path.join(raiz, n)) for n in nomes)
+    return total
+
+
+def limpar_disco(manter=None, limite=None):
+    limite = LIMITE_DISCO if limite is None else limite
+    bancos = [os.path.join(DIRETORIO, n) for n in os.listdir(DIRETORIO) if n.endswith('.db')]
+    bancos.sort(key=os.path.getmtime, reverse=True)
+    usado = 0
+    for caminho in bancos:
+        espaco = _tamanho_em_disco(caminho)
+        usado += espaco
+        if usado > limite and caminho != manter and remover(caminho):
+            usado -= espaco
+
+
+def remover(caminho):
+    # Um banco cujo snapshot ainda está mapeado por alguma sessão (trava .uso do
+    # snapshot.py, neste ou em outro processo) fica para a próxima limpeza
+    arquivos, pasta = _arquivos_do_banco(caminho)
+    if snapshot.em_uso(pasta) or not snapshot.remover(pasta):
+        return False
+    for arquivo in arquivos:
+        if os.path.exists(arquivo):
+            os.remove(arquivo)
+    cache.descartar(caminho)
+    return True
+
+
+def tamanho(valor):
+    # Estimativa barata (sem deep) do espaço ocupado por um resultado em cache
+    if isinstance(valor, pd.DataFrame):
+        return int(valor.memory_usage(index=True, deep=False).sum())
+    if isinstance(valor, pd.Series):
+        return int(valor.memory_usage(index=True, deep=False))
+    if isinstance(valor, np.ndarray):
+        return valor.nbytes
+    if isinstance(valor, (bytes, bytearray, str)):
+        return len(valor)
+    if isinstance(valor, (int, float)):
+        return 8
+    if hasattr(valor, 'to_plotly_json'):
+        # Figuras do plotly: os dados de cada traço (x, y, customdata, ...)
+        return sum(tamanho(traco.to_plotly_json()) for traco in valor.data)
+    if isinstance(valor, Mapping):
+        return sum(tamanho(v) for v in valor.values())
+    if isinstance(valor, (tuple, list)):
+        return sum(tamanho(v) for v in valor)
+    if is_dataclass(valor):
+        return sum(tamanho(getattr(valor, c.name)) for c in fields(valor))
+    return 0
+
+
+class CacheLRU:
+    def __init__(self, limite):
+        self.limite = limite
+        self.usado = 0
+        self._itens = OrderedDict()
+        self._trava = threading.Lock()
+        self._calculando = {}
+
+    def obter(self, chave, calcular):
+        with self._trava:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                return self._itens[chave][0]
+            trava_chave = self._calculando.setdefault(chave, threading.Lock())
+        # Uma sessão calcula; as demais que pedirem a mesma chave esperam o resultado
+        with trava_chave:
+            with self._trava:
+                if chave in self._itens:
+                    self._itens.move_to_end(chave)
+                    return self._itens[chave][0]
+            valor = None
+            try:
+                valor = calcular()
+            finally:
+                # Guardado antes de soltar a chave: quem chegar depois já encontra o resultado
+                with self._trava:
+                    if valor is not None:
+                        self._guardar(chave, valor)
+                    self._calculando.pop(chave, None)
+            return valor
+
+    def contem(self, chave):
+        with self._trava:
+            return chave in self._itens
+
+    def _guardar(self, chave, valor):
+        espaco = tamanho(valor)
+        if chave in self._itens:
+            self.usado -= self._itens.pop(chave)[1]
+        self._itens[chave] = (valor, espaco)
+        self.usado += espaco
+        while self.usado > self.limite and len(self._itens) > 1:
+            _, (_, liberado) = self._itens.popitem(last=False)
+            self.usado -= liberado
+
+    def descartar(self, banco):
+        # Remove todos os resultados de um banco (a chave começa pelo caminho dele)
+        with self._trava:
+            for chave in [c for c in self._itens if c[0] == banco]:
+                _, liberado = self._itens.pop(chave)
+                self.usado -= liberado
+
+
+cache = CacheLRU(LIMITE_MEMORIA)
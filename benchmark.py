@@ -0,0 +1,247 @@
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+import streamlit
+
+import analises_polars
+import bancos
+import cubo
+import gerador
+import incremental
+import streaming
+import tabelas
+
+# O app chama st.set_page_config/st.markdown ao ser importado; fora do
+# `streamlit run` essas chamadas não fazem nada, só registram avisos
+logging.getLogger('streamlit').setLevel(logging.ERROR)
+import app  # noqa: E402
+
+# Benchmark das análises do dashboard em bancos sintéticos (gerador.py) de
+# várias escalas. Cada análise é medida pela função do app que monta o gráfico,
+# em cada modo de execução: tempo (melhor de N repetições) e pico de memória
+# alocada (tracemalloc, em uma execução separada para não distorcer o tempo).
+# Os resultados podem ser gravados como baseline e comparados nas execuções
+# seguintes, que apontam as regressões e terminam com código de saída 1.
+#
+# Uso:
+#   python benchmark.py --escalas 10000 1000000 --salvar      # grava a baseline
+#   python benchmark.py --escalas 10000 1000000               # compara com ela
+
+DIRETORIO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmarks')
+DADOS = os.environ.get('BENCHMARK_DADOS', os.path.join(DIRETORIO, 'dados'))
+BASELINE = os.path.join(DIRETORIO, 'baseline.json')
+
+# Nome no relatório -> (função do app, função do motor que ela usa, argumentos)
+ANALISES = {
+    'analise_vendas_por_canal': (app.analise_vendas_por_canal, 'vendas_por_canal', ()),
+    'top_produtos_analise': (app.top_produtos_analise, 'top_produtos', ()),
+    'segmentacao_clientes': (app.segmentacao_clientes, 'ticket_medio_segmento', ()),
+    'analise_sazonalidade': (app.analise_sazonalidade, 'vendas_mensais', ()),
+    'eficiencia_campanhas': (app.eficiencia_campanhas, 'eficiencia_campanhas', ()),
+    'analise_canais_marketing': (app.analise_canais_marketing, 'engajamento_canais', ()),
+    'relacao_temporal': (app.relacao_temporal, 'vendas_top_produtos_mensais', ()),
+    'analise_regional': (app.analise_regional, 'desempenho_regional', ()),
+    'analise_churn': (app.analise_churn, 'churn_clientes', ()),
+    'analise_retencao': (app.analise_retencao, 'coortes', ()),
+    'classificacao_clientes': (app.classificacao_clientes, 'classificacao_clientes', ('legado',)),
+    'classificacao_clientes_rfm': (app.classificacao_clientes, 'classificacao_clientes', ('rfm',)),
+    'analise_atribuicao': (app.analise_atribuicao, 'atribuicao_campanhas', ('ultimo_toque', 30)),
+    'analise_atribuicao_decaimento': (app.analise_atribuicao, 'atribuicao_campanhas', ('decaimento', 30)),
+}
+
+
+def _preparar_pandas(db_path):
+    return tabelas.carregar_tabelas(db_path, usar_snapshot=False)
+
+
+def _preparar_cubo(db_path):
+    return cubo.construir(tabelas.carregar_tabelas(db_path, usar_snapshot=False))
+
+
+def _preparar_polars(db_path):
+    return analises_polars.de_tabelas(tabelas.carregar_tabelas(db_path, usar_snapshot=False))
+
+
+def _preparar_incremental(db_path):
+    # Reconstrói os agregados do zero: mede a carga completa, não a de um delta
+    if os.path.exists(incremental.caminho_agregados(db_path)):
+        os.remove(incremental.caminho_agregados(db_path))
+    incremental.atualizar(db_path)
+    return incremental.Agregados(db_path)
+
+
+def _preparar_streaming(db_path):
+    # Refaz as passadas em lotes: mede a leitura completa, não o resumo em memória
+    bancos.cache.descartar(db_path)
+    fluxo = streaming.Fluxo(db_path)
+    streaming.resumo_vendas(fluxo)
+    streaming.resumo_interacoes(fluxo)
+    return fluxo
+
+
+# Modo -> (etapa de preparação medida, como obtê-la)
+MODOS = {
+    'pandas': ('carregar_tabelas', _preparar_pandas),
+    'sql': (None, lambda db_path: db_path),
+    'cubo': ('construir_cubo', _preparar_cubo),
+    'incremental': ('atualizar_agregados', _preparar_incremental),
+    'streaming': ('resumos_em_lotes', _preparar_streaming),
+}
+if analises_polars.disponivel():
+    MODOS['polars'] = ('carregar_tabelas_polars', _preparar_polars)
+
+
+def banco_sintetico(vendas, semente=42):
+    os.makedirs(DADOS, exist_ok=True)
+    caminho = os.path.join(DADOS, f'vendas_{vendas}_s{semente}.db')
+    if not os.path.exists(caminho):
+        print(f"Gerando {caminho}...", file=sys.stderr)
+        gerador.gerar(caminho, vendas=vendas, semente=semente)
+    return caminho
+
+
+def medir(funcao, repeticoes=3, memoria=True):
+    tempos = []
+    for _ in range(repeticoes):
+        gc.collect()
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+        del resultado
+    pico = None
+    if memoria:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            funcao()
+            pico = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+    return {'tempo_s': round(min(tempos), 4), 'pico_mb': None if pico is None else round(pico, 2)}
+
+
+def executar(escalas, modos, analises, repeticoes=3, memoria=True, semente=42):
+    resultados = {}
+    for vendas in escalas:
+        db_path = banco_sintetico(vendas, semente)
+        for modo in modos:
+            etapa, preparar = MODOS[modo]
+            medidas = resultados.setdefault(str(vendas), {}).setdefault(modo, {})
+            if etapa:
+                medidas[etapa] = medir(lambda: preparar(db_path), repeticoes=1, memoria=memoria)
+                print(f"{vendas:>12,} {modo:<12} {etapa:<28} {_formatar(medidas[etapa])}", file=sys.stderr)
+            fonte = preparar(db_path)
+            motor = app._motor(fonte)
+            for nome in analises:
+                funcao, nome_motor, args = ANALISES[nome]
+                if not hasattr(motor, nome_motor):
+                    continue
+                medidas[nome] = medir(lambda: funcao(fonte, *args), repeticoes, memoria)
+                print(f"{vendas:>12,} {modo:<12} {nome:<28} {_formatar(medidas[nome])}", file=sys.stderr)
+            del fonte
+    return resultados
+
+
+def _formatar(medida):
+    memoria = '' if medida['pico_mb'] is None else f"{medida['pico_mb']:>10.1f} MB"
+    return f"{medida['tempo_s']:>9.3f} s{memoria}"
+
+
+def ambiente():
+    return {
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'streamlit': streamlit.__version__,
+        'maquina': platform.machine(),
+        'processador': platform.processor() or platform.machine(),
+        'cpus': os.cpu_count(),
+    }
+
+
+def ler_baseline(caminho=BASELINE):
+    if not os.path.exists(caminho):
+        return None
+    with open(caminho) as f:
+        return json.load(f)
+
+
+def salvar_baseline(resultados, caminho=BASELINE):
+    # Mescla com a baseline existente: só as escalas e modos medidos agora são substituídos
+    baseline = ler_baseline(caminho) or {'resultados': {}}
+    baseline['ambiente'] = ambiente()
+    baseline['gerado_em'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    for vendas, por_modo in resultados.items():
+        baseline['resultados'].setdefault(vendas, {}).update(por_modo)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'w') as f:
+        json.dump(baseline, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def comparar(resultados, baseline, tolerancia=0.25, folga_tempo=0.05, folga_memoria=5.0):
+    # Regressão: acima da tolerância relativa e também da folga absoluta, para
+    # que medições de poucos milissegundos não disparem alarmes por ruído
+    linhas = []
+    for vendas, por_modo in resultados.items():
+        for modo, medidas in por_modo.items():
+            for nome, atual in medidas.items():
+                anterior = baseline['resultados'].get(vendas, {}).get(modo, {}).get(nome)
+                if anterior is None:
+                    continue
+                for metrica, folga in (('tempo_s', folga_tempo), ('pico_mb', folga_memoria)):
+                    if atual[metrica] is None or anterior.get(metrica) is None:
+                        continue
+                    regressao = (atual[metrica] > anterior[metrica] * (1 + tolerancia)
+                                 and atual[metrica] - anterior[metrica] > folga)
+                    linhas.append({
+                        'vendas': int(vendas), 'modo': modo, 'medida': nome, 'metrica': metrica,
+                        'baseline': anterior[metrica], 'atual': atual[metrica],
+                        'variacao_%': round((atual[metrica] / anterior[metrica] - 1) * 100, 1) if anterior[metrica] else None,
+                        'regressao': regressao,
+                    })
+    return pd.DataFrame(linhas)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das análises em bancos sintéticos")
+    parser.add_argument('--escalas', type=int, nargs='+', default=[10_000, 100_000, 1_000_000],
+                        help="números de vendas dos bancos gerados")
+    parser.add_argument('--modos', nargs='+', choices=list(MODOS), default=list(MODOS))
+    parser.add_argument('--analises', nargs='+', choices=list(ANALISES), default=list(ANALISES))
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--sem-memoria', action='store_true', help="não mede o pico de memória")
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--salvar', action='store_true', help="grava os resultados como baseline")
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--tolerancia', type=float, default=0.25, help="piora relativa aceita (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    resultados = executar(args.escalas, args.modos, args.analises, args.repeticoes, not args.sem_memoria, args.semente)
+    if args.salvar:
+        salvar_baseline(resultados, args.baseline)
+        print(f"Baseline gravada em {args.baseline}")
+        sys.exit(0)
+    baseline = ler_baseline(args.baseline)
+    if baseline is None:
+        print(f"Sem baseline em {args.baseline}; rode com --salvar para criar uma.")
+        sys.exit(0)
+    comparacao = comparar(resultados, baseline, args.tolerancia)
+    if comparacao.empty:
+        print("Nenhuma medida em comum com a baseline.")
+        sys.exit(0)
+    pd.set_option('display.width', 200)
+    print(comparacao.to_string(index=False))
+    regressoes = comparacao[comparacao['regressao']]
+    if not regressoes.empty:
+        print(f"\n{len(regressoes)} regressão(ões) acima de {args.tolerancia:.0%}:")
+        print(regressoes[['vendas', 'modo', 'medida', 'metrica', 'baseline', 'atual', 'variacao_%']].to_string(index=False))
+        sys.exit(1)
+    print("\nSem regressões.")
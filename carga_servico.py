@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+import numpy as np
+
+# Teste de carga do serviço HTTP (servico.py): N conexões HTTP/1.1 persistentes
+# pedem as URLs em rodízio durante alguns segundos, e o relatório traz a vazão,
+# os percentis de latência, os códigos de resposta e a fração servida do cache
+# (cabeçalho X-Cache). Cliente em asyncio puro, sem dependências extras.
+#
+# Uso (com o serviço no ar):
+#   python carga_servico.py --url 'http://localhost:8000/analises/vendas_mensais' \
+#       --url 'http://localhost:8000/analises/top_produtos?n=10' --conexoes 50 --duracao 10
+
+
+async def _ler_resposta(leitor):
+    # (status, cabeçalhos) de uma resposta, consumindo o corpo pelo Content-Length
+    status = int((await leitor.readline()).split()[1])
+    cabecalhos = {}
+    while (linha := await leitor.readline()) not in (b'\r\n', b''):
+        nome, _, valor = linha.decode('latin-1').partition(':')
+        cabecalhos[nome.strip().lower()] = valor.strip()
+    if 'content-length' not in cabecalhos and status not in (204, 304):
+        raise ValueError("Resposta sem Content-Length")
+    await leitor.readexactly(int(cabecalhos.get('content-length', 0)))
+    return status, cabecalhos
+
+
+async def _conexao(host, porta, pedidos, deslocamento, fim, latencias, status, cache):
+    leitor, escritor = await asyncio.open_connection(host, porta)
+    i = deslocamento
+    try:
+        while time.perf_counter() < fim:
+            inicio = time.perf_counter()
+            escritor.write(pedidos[i % len(pedidos)])
+            codigo, cabecalhos = await _ler_resposta(leitor)
+            latencias.append(time.perf_counter() - inicio)
+            status[codigo] += 1
+            cache[cabecalhos.get('x-cache', '-')] += 1
+            i += 1
+    finally:
+        escritor.close()
+
+
+async def carga(urls, conexoes=50, duracao=10.0, aquecer=True):
+    partes = [urlsplit(url) for url in urls]
+    host, porta = partes[0].hostname, partes[0].port or 80
+    pedidos = [f"GET {p.path}{'?' + p.query if p.query else ''} HTTP/1.1\r\nHost: {p.netloc}\r\n\r\n".encode()
+               for p in partes]
+    latencias, status, cache = [], Counter(), Counter()
+    if aquecer:
+        # Um pedido por URL antes de medir, para que a carga meça o cache
+        for pedido in pedidos:
+            leitor, escritor = await asyncio.open_connection(host, porta)
+            escritor.write(pedido)
+            await _ler_resposta(leitor)
+            escritor.close()
+    inicio = time.perf_counter()
+    await asyncio.gather(*(_conexao(host, porta, pedidos, c, inicio + duracao, latencias, status, cache)
+                           for c in range(conexoes)))
+    decorrido = time.perf_counter() - inicio
+    latencias = np.array(latencias) * 1000
+    return {
+        'pedidos': len(latencias),
+        'pedidos_por_segundo': len(latencias) / decorrido,
+        'p50_ms': np.percentile(latencias, 50) if len(latencias) else float('nan'),
+        'p95_ms': np.percentile(latencias, 95) if len(latencias) else float('nan'),
+        'p99_ms': np.percentile(latencias, 99) if len(latencias) else float('nan'),
+        'status': dict(status),
+        'taxa_cache': cache['hit'] / max(len(latencias), 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Teste de carga do serviço HTTP das análises")
+    parser.add_argument('--url', action='append', required=True, help="URL pedida (repita para várias)")
+    parser.add_argument('--conexoes', type=int, default=50)
+    parser.add_argument('--duracao', type=float, default=10.0, help="segundos de carga")
+    parser.add_argument('--sem-aquecer', action='store_true', help="não pede cada URL uma vez antes de medir")
+    args = parser.parse_args()
+
+    resultado = asyncio.run(carga(args.url, args.conexoes, args.duracao, not args.sem_aquecer))
+    print(f"{resultado['pedidos']} pedidos em {args.duracao:.0f} s com {args.conexoes} conexões: "
+          f"{resultado['pedidos_por_segundo']:.0f} pedidos/s")
+    print(f"Latência: p50 {resultado['p50_ms']:.1f} ms, p95 {resultado['p95_ms']:.1f} ms, "
+          f"p99 {resultado['p99_ms']:.1f} ms")
+    print(f"Status: {resultado['status']}; servidos do cache: {resultado['taxa_cache']:.1%}")
@@ -0,0 +1,357 @@
+import math
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import pandas as pd
+
+import ingestao
+from tabelas import colunas_originais
+
+# Console SQL seguro: conexões somente leitura reaproveitadas em um pool por
+# banco, tempo máximo por consulta aplicado pelo progress handler do SQLite,
+# resultado lido em páginas a partir de um cursor aberto (nunca a tabela
+# inteira de uma vez) e cache dos resultados por banco + SQL normalizado.
+# Consultas lentas vêm acompanhadas do EXPLAIN QUERY PLAN. Ordenação e filtro
+# da tabela de resultado viram uma consulta externa sobre a do usuário, que o
+# SQLite achata quando pode (usando os índices das tabelas de origem), e o
+# download percorre o resultado completo em lotes, sem o limite de linhas.
+
+LIMITE_SEGUNDOS = float(os.environ.get('SQL_LIMITE_SEGUNDOS', 5))
+TAMANHO_PAGINA = int(os.environ.get('SQL_TAMANHO_PAGINA', 500))
+LIMITE_LINHAS = int(os.environ.get('SQL_LIMITE_LINHAS', 100_000))
+CONEXOES_POR_BANCO = int(os.environ.get('SQL_CONEXOES', 4))
+CONSULTA_LENTA = float(os.environ.get('SQL_CONSULTA_LENTA', 1))
+CONSULTAS_EM_CACHE = int(os.environ.get('SQL_CONSULTAS_EM_CACHE', 64))
+LIMITE_EXPORTACAO = float(os.environ.get('SQL_LIMITE_EXPORTACAO', 60))
+TAMANHO_LOTE_EXPORTACAO = int(os.environ.get('TABELA_TAMANHO_LOTE', 50_000))
+
+# Operações de instrução vm entre cada verificação do tempo limite
+PASSOS_VERIFICACAO = 10_000
+
+
+# PRAGMAs de consulta ao esquema cujo argumento é o nome de uma tabela ou
+# índice, e não um valor atribuído (também como pragma_table_info('Vendas'))
+PRAGMAS_ESQUEMA = frozenset({
+    'table_info', 'table_xinfo', 'table_list', 'index_list', 'index_info', 'index_xinfo',
+    'foreign_key_list', 'foreign_key_check', 'integrity_check', 'quick_check',
+})
+
+# PRAGMAs sem argumento que executam uma ação em vez de ler um valor
+PRAGMAS_ACAO = frozenset({'optimize', 'wal_checkpoint', 'incremental_vacuum', 'shrink_memory'})
+
+
+class TempoEsgotado(Exception):
+    pass
+
+
+def _autorizador(acao, arg1, arg2, banco, origem):
+    # Impede anexar outros arquivos e alterar PRAGMAs (ex.: desligar o query_only);
+    # ler o valor de um PRAGMA e consultar o esquema continuam permitidos
+    if acao in (sqlite3.SQLITE_ATTACH, sqlite3.SQLITE_DETACH):
+        return sqlite3.SQLITE_DENY
+    if acao == sqlite3.SQLITE_PRAGMA:
+        pragma = arg1.lower()
+        if arg2 is None:
+            return sqlite3.SQLITE_DENY if pragma in PRAGMAS_ACAO else sqlite3.SQLITE_OK
+        return sqlite3.SQLITE_OK if pragma in PRAGMAS_ESQUEMA else sqlite3.SQLITE_DENY
+    return sqlite3.SQLITE_OK
+
+
+class _Conexao:
+    def __init__(self, db_path):
+        self.conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True, check_same_thread=False)
+        ingestao.configurar_leitura(self.conn)
+        if ingestao.preparado(self.conn):
+            # Esconde as colunas de dia da ingestão: views temporárias com o nome
+            # das tabelas, que o SQLite resolve antes das do arquivo (main). Vêm
+            # depois do PRAGMA temp_store, que descarta o esquema temporário
+            for tabela in ingestao.DIAS:
+                self.conn.execute(f'CREATE TEMP VIEW "{tabela}" AS '
+                                  f'SELECT {colunas_originais(self.conn, tabela)} FROM main."{tabela}"')
+        self.conn.execute("PRAGMA query_only = ON")
+        self.conn.set_authorizer(_autorizador)
+        self.prazo = None
+        self.conn.set_progress_handler(self._verificar_prazo, PASSOS_VERIFICACAO)
+
+    def _verificar_prazo(self):
+        # Valor verdadeiro interrompe a instrução em andamento
+        return self.prazo is not None and time.monotonic() > self.prazo
+
+    def com_prazo(self, segundos):
+        self.prazo = time.monotonic() + segundos
+
+
+class Pool:
+    def __init__(self, db_path, tamanho=CONEXOES_POR_BANCO):
+        self.db_path = db_path
+        self._livres = queue.LifoQueue()
+        self._criadas = 0
+        self._tamanho = tamanho
+        self._trava = threading.Lock()
+
+    def obter(self, espera=LIMITE_SEGUNDOS):
+        try:
+            return self._livres.get_nowait()
+        except queue.Empty:
+            pass
+        with self._trava:
+            if self._criadas < self._tamanho:
+                self._criadas += 1
+                return _Conexao(self.db_path)
+        _liberar_cursor_ocioso(self.db_path)
+        try:
+            return self._livres.get(timeout=espera)
+        except queue.Empty:
+            raise TempoEsgotado("Todas as conexões estão ocupadas; tente novamente em instantes.")
+
+    def devolver(self, conexao):
+        conexao.prazo = None
+        self._livres.put(conexao)
+
+
+_pools = {}
+_trava_pools = threading.Lock()
+
+
+def pool(db_path):
+    with _trava_pools:
+        if db_path not in _pools:
+            _pools[db_path] = Pool(db_path)
+        return _pools[db_path]
+
+
+def normalizar_sql(sql):
+    # Comentários removidos e espaços colapsados fora de literais e
+    # identificadores entre aspas, sem ';' final: a mesma consulta digitada com
+    # outra formatação usa a mesma entrada do cache. Um comentário conta como
+    # espaço, então "x -- nota\n, y" e "x -- nota , y" continuam diferentes
+    partes, espaco, i = [], False, 0
+    while i < len(sql):
+        caractere = sql[i]
+        if caractere in ("'", '"', '`', '['):
+            # Aspas dobradas ('') fecham e reabrem o literal logo em seguida
+            fim = sql.find(']' if caractere == '[' else caractere, i + 1)
+            fim = len(sql) if fim < 0 else fim + 1
+            if espaco and partes:
+                partes.append(' ')
+            partes.append(sql[i:fim])
+            espaco, i = False, fim
+        elif sql.startswith('--', i):
+            fim = sql.find('\n', i)
+            espaco, i = True, len(sql) if fim < 0 else fim
+        elif sql.startswith('/*', i):
+            fim = sql.find('*/', i + 2)
+            espaco, i = True, len(sql) if fim < 0 else fim + 2
+        elif caractere.isspace():
+            espaco, i = True, i + 1
+        else:
+            if espaco and partes:
+                partes.append(' ')
+            partes.append(caractere)
+            espaco, i = False, i + 1
+    return ''.join(partes).rstrip(';').rstrip()
+
+
+def _identificador(nome):
+    return '"' + nome.replace('"', '""') + '"'
+
+
+def _texto(valor):
+    return "'" + valor.replace("'", "''") + "'"
+
+
+def _literal(valor):
+    # Números são comparados como números; datas e o resto, como texto
+    try:
+        numero = float(valor)
+    except ValueError:
+        return _texto(valor)
+    return repr(numero) if math.isfinite(numero) else _texto(valor)
+
+
+def ordenar_filtrar(sql, ordenar=None, decrescente=False, coluna_filtro=None, texto=''):
+    # Mesma regra do filtro das tabelas paginadas: "min:max" é um intervalo
+    # fechado, outro texto é "contém" sem diferenciar maiúsculas
+    if ordenar is None and not (coluna_filtro and texto):
+        return sql
+    consulta = f"SELECT * FROM (\n{sql.strip().rstrip(';')}\n)"
+    if coluna_filtro and texto:
+        coluna = _identificador(coluna_filtro)
+        if ':' in texto:
+            minimo, maximo = (parte.strip() for parte in texto.split(':', 1))
+            condicoes = ([f"{coluna} >= {_literal(minimo)}"] if minimo else []) + \
+                        ([f"{coluna} <= {_literal(maximo)}"] if maximo else [])
+            consulta += f" WHERE {' AND '.join(condicoes) or f'{coluna} IS NOT NULL'}"
+        else:
+            padrao = texto.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            consulta += f" WHERE CAST({coluna} AS TEXT) LIKE {_texto('%' + padrao + '%')} ESCAPE '\\'"
+    if ordenar is not None:
+        # Nulos no fim nas duas direções, como nas tabelas paginadas
+        consulta += f" ORDER BY {_identificador(ordenar)} {'DESC NULLS LAST' if decrescente else 'ASC NULLS LAST'}"
+    return consulta
+
+
+class Consulta:
+    def __init__(self, db_path, sql, tamanho_pagina=TAMANHO_PAGINA):
+        self.db_path = db_path
+        self.sql = sql
+        self.tamanho_pagina = tamanho_pagina
+        self.linhas = []
+        self.colunas = None
+        self.esgotada = False
+        self.truncada = False
+        self.duracao = 0.0
+        self.plano = None
+        self._conexao = None
+        self._cursor = None
+        self._trava = threading.Lock()
+
+    def _abrir(self):
+        self._conexao = pool(self.db_path).obter()
+        self._conexao.com_prazo(LIMITE_SEGUNDOS)
+        self._cursor = self._conexao.conn.cursor()
+        self._executar(self._cursor.execute, self.sql)
+        self.colunas = [d[0] for d in self._cursor.description or []]
+        # Retomada depois de o cursor ter sido liberado: pula o que já foi lido
+        pular = len(self.linhas)
+        while pular > 0:
+            lote = self._executar(self._cursor.fetchmany, min(pular, self.tamanho_pagina))
+            if not lote:
+                break
+            pular -= len(lote)
+
+    def _executar(self, funcao, *args):
+        try:
+            return funcao(*args)
+        except sqlite3.OperationalError as e:
+            if 'interrupted' in str(e):
+                self.fechar_cursor()
+                raise TempoEsgotado(f"A consulta passou do limite de {LIMITE_SEGUNDOS:g} s e foi interrompida.")
+            self.fechar_cursor()
+            raise
+
+    def fechar_cursor(self):
+        if self._conexao is not None:
+            if self._cursor is not None:
+                self._cursor.close()
+            pool(self.db_path).devolver(self._conexao)
+        self._conexao = self._cursor = None
+
+    def _ler_ate(self, total):
+        inicio = time.perf_counter()
+        if self._cursor is None:
+            self._abrir()
+        self._conexao.com_prazo(LIMITE_SEGUNDOS)
+        while len(self.linhas) < total and not self.esgotada:
+            lote = self._executar(self._cursor.fetchmany, self.tamanho_pagina)
+            self.linhas.extend(lote)
+            if len(lote) < self.tamanho_pagina:
+                self.esgotada = True
+            elif len(self.linhas) >= LIMITE_LINHAS:
+                self.esgotada = self.truncada = True
+        if self.esgotada:
+            self.fechar_cursor()
+        else:
+            self._conexao.prazo = None
+        self.duracao += time.perf_counter() - inicio
+
+    def pagina(self, numero):
+        with self._trava:
+            fim = (numero + 1) * self.tamanho_pagina
+            if len(self.linhas) < fim and not self.esgotada:
+                self._ler_ate(fim)
+                if self.plano is None and self.duracao > CONSULTA_LENTA:
+                    self.plano = plano_de_execucao(self.db_path, self.sql)
+            inicio = numero * self.tamanho_pagina
+            return pd.DataFrame(self.linhas[inicio:fim], columns=self.colunas)
+
+    def carregadas(self):
+        # Linhas já lidas (usadas no gráfico), sem avançar o cursor
+        with self._trava:
+            return pd.DataFrame(self.linhas, columns=self.colunas)
+
+    @property
+    def total_paginas_conhecidas(self):
+        return max(1, -(-len(self.linhas) // self.tamanho_pagina))
+
+
+def plano_de_execucao(db_path, sql):
+    try:
+        conexao = pool(db_path).obter()
+    except TempoEsgotado:
+        return None
+    try:
+        conexao.com_prazo(LIMITE_SEGUNDOS)
+        plano = pd.read_sql_query(f"EXPLAIN QUERY PLAN {sql}", conexao.conn)
+        return plano[['id', 'parent', 'detail']]
+    except sqlite3.Error:
+        return None
+    finally:
+        pool(db_path).devolver(conexao)
+
+
+def _liberar_cursor_ocioso(db_path):
+    # Pool cheio: o cursor aberto há mais tempo sem uso devolve a conexão. A
+    # consulta guarda as linhas já lidas e reabre o cursor se pedirem mais páginas
+    with _trava_resultados:
+        candidatas = [c for c in _resultados.values() if c.db_path == db_path and c._cursor is not None]
+    for consulta in candidatas:
+        if consulta._trava.acquire(blocking=False):
+            try:
+                consulta.fechar_cursor()
+                return
+            finally:
+                consulta._trava.release()
+
+
+_resultados = OrderedDict()
+_trava_resultados = threading.Lock()
+
+
+def consultar(db_path, chave_banco, sql):
+    # Consultas iguais no mesmo banco compartilham o resultado (e o cursor aberto)
+    chave = (chave_banco, normalizar_sql(sql))
+    with _trava_resultados:
+        consulta = _resultados.get(chave)
+        if consulta is None:
+            consulta = _resultados[chave] = Consulta(db_path, sql)
+        _resultados.move_to_end(chave)
+        while len(_resultados) > CONSULTAS_EM_CACHE:
+            _, antiga = _resultados.popitem(last=False)
+            antiga.fechar_cursor()
+    try:
+        consulta.pagina(0)
+    except Exception:
+        with _trava_resultados:
+            _resultados.pop(chave, None)
+        raise
+    return consulta
+
+
+def lotes(db_path, sql, tamanho=TAMANHO_LOTE_EXPORTACAO):
+    # Resultado completo em DataFrames de até `tamanho` linhas, para o download.
+    # Sempre produz ao menos um lote (vazio, com as colunas). O prazo vale para
+    # o SQLite produzir cada lote, não para a gravação do arquivo entre eles
+    conexao = pool(db_path).obter()
+    cursor = conexao.conn.cursor()
+    try:
+        conexao.com_prazo(LIMITE_EXPORTACAO)
+        cursor.execute(sql)
+        colunas = [d[0] for d in cursor.description or []]
+        primeiro = True
+        while (linhas := cursor.fetchmany(tamanho)) or primeiro:
+            primeiro = False
+            conexao.prazo = None
+            yield pd.DataFrame(linhas, columns=colunas)
+            conexao.com_prazo(LIMITE_EXPORTACAO)
+    except sqlite3.OperationalError as e:
+        if 'interrupted' in str(e):
+            raise TempoEsgotado(f"A exportação passou do limite de {LIMITE_EXPORTACAO:g} s em um lote e foi interrompida.")
+        raise
+    finally:
+        cursor.close()
+        pool(db_path).devolver(conexao)
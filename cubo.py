@@ -0,0 +1,177 @@
+from dataclasses import dataclass
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+import analises
+import instrumentacao
+import tabelas
+
+# Cubo de agregados pré-calculados no grão diário. Os fatos de vendas ficam
+# agregados por dia x canal_aquisicao x segmento x cidade x id_produto x
+# id_campanha e os de interações por dia x segmento x cidade x id_campanha.
+# Os filtros da barra lateral são respondidos fatiando o cubo e as análises
+# das seções A a C leem dele, com os mesmos nomes e saídas de analises.py.
+# O cubo é montado a partir das tabelas em memória; nos modos que leem do
+# banco, os filtros vão para as próprias consultas (analises_sql.Recorte) ou
+# para as leituras em lotes (streaming.Fluxo).
+
+DIMENSOES_VENDAS = ['data', 'canal_aquisicao', 'segmento', 'cidade', 'id_produto', 'id_campanha']
+DIMENSOES_INTERACOES = ['data', 'segmento', 'cidade', 'id_campanha']
+
+
+@dataclass(frozen=True)
+class Cubo:
+    vendas: pd.DataFrame
+    interacoes: pd.DataFrame
+    produtos: pd.DataFrame
+    campanhas: pd.DataFrame
+
+
+def _finalizar(vendas, interacoes, produtos, campanhas):
+    # Ordenado por data para que o filtro de período seja uma busca binária
+    for fatos in (vendas, interacoes):
+        fatos['data'] = pd.to_datetime(fatos['data'])
+        fatos.sort_values('data', inplace=True, kind='stable')
+        fatos.reset_index(drop=True, inplace=True)
+        fatos['mes_indice'] = tabelas.indice_mes(fatos['data'])
+        fatos['mes'] = fatos['data'].dt.month.astype('int8')
+        for coluna in ('canal_aquisicao', 'segmento', 'cidade'):
+            if coluna in fatos:
+                fatos[coluna] = fatos[coluna].astype('category')
+    return Cubo(vendas, interacoes, produtos, campanhas)
+
+
+@instrumentacao.medir()
+def construir(tables):
+    clientes = tables['clientes'][['id_cliente', 'segmento', 'cidade']]
+
+    vendas = tables['vendas'].rename(columns={'data_venda': 'data'}).merge(clientes, on='id_cliente', how='left')
+    vendas = vendas.groupby(DIMENSOES_VENDAS, observed=True, dropna=False).agg(
+        receita=('valor_total', 'sum'),
+        quantidade=('quantidade', 'sum'),
+        vendas=('valor_total', 'size'),
+    ).reset_index()
+
+    interacoes = tables['interacoes'].rename(columns={'data_interacao': 'data'}).merge(clientes, on='id_cliente', how='left')
+    interacoes['conversao'] = interacoes['tipo_interacao'] == 'Conversão'
+    interacoes = interacoes.groupby(DIMENSOES_INTERACOES, observed=True, dropna=False).agg(
+        interacoes=('conversao', 'size'),
+        conversoes=('conversao', 'sum'),
+    ).reset_index()
+
+    return _finalizar(vendas, interacoes, tables['produtos'], tables['campanhas'])
+
+
+def dominio(cubo):
+    # Valores disponíveis para os filtros da barra lateral
+    return {
+        'inicio': min(cubo.vendas['data'].min(), cubo.interacoes['data'].min()),
+        'fim': max(cubo.vendas['data'].max(), cubo.interacoes['data'].max()),
+        'canal_aquisicao': list(cubo.vendas['canal_aquisicao'].cat.categories),
+        'segmento': sorted(set(cubo.vendas['segmento'].cat.categories) | set(cubo.interacoes['segmento'].cat.categories)),
+        'cidade': sorted(set(cubo.vendas['cidade'].cat.categories) | set(cubo.interacoes['cidade'].cat.categories)),
+    }
+
+
+def _fatiar(fatos, inicio, fim, filtros):
+    datas = fatos['data'].to_numpy()
+    i = 0 if inicio is None else np.searchsorted(datas, np.datetime64(pd.Timestamp(inicio)), side='left')
+    j = len(datas) if fim is None else np.searchsorted(datas, np.datetime64(pd.Timestamp(fim)), side='right')
+    fatos = fatos.iloc[i:j]
+    mascara = np.ones(len(fatos), dtype=bool)
+    for coluna, valores in filtros.items():
+        if valores and coluna in fatos:
+            mascara &= fatos[coluna].isin(valores).to_numpy()
+    return fatos if mascara.all() else fatos[mascara]
+
+
+@instrumentacao.medir()
+def filtrar(cubo, inicio=None, fim=None, canais=None, segmentos=None, cidades=None):
+    # O filtro de canal de aquisição só se aplica às vendas
+    filtros = {'canal_aquisicao': canais, 'segmento': segmentos, 'cidade': cidades}
+    return Cubo(
+        _fatiar(cubo.vendas, inicio, fim, filtros),
+        _fatiar(cubo.interacoes, inicio, fim, filtros),
+        cubo.produtos,
+        cubo.campanhas,
+    )
+
+
+def sem_registros(cubo):
+    return cubo.vendas.empty and cubo.interacoes.empty
+
+
+def contagens(cubo):
+    return {
+        'vendas': int(cubo.vendas['vendas'].sum()),
+        'interacoes': int(cubo.interacoes['interacoes'].sum()),
+    }
+
+
+def receita_total(cubo):
+    return cubo.vendas['receita'].sum()
+
+
+def vendas_por_canal(cubo, dias=90):
+    vendas = cubo.vendas
+    data_limite = vendas['data'].max() - timedelta(days=dias)
+    vendas_periodo = vendas[vendas['data'] >= data_limite]
+    return (vendas_periodo.groupby('canal_aquisicao', observed=True)['receita'].sum()
+            .reset_index(name='valor_total'))
+
+
+def top_produtos(cubo, n=5):
+    vendas_produtos = cubo.vendas.groupby('id_produto').agg(
+        quantidade=('quantidade', 'sum'),
+        valor_total=('receita', 'sum'),
+    ).reset_index()
+    vendas_produtos = vendas_produtos.merge(cubo.produtos, on='id_produto')
+    vendas_produtos['margem_lucro'] = ((vendas_produtos['preco_unitario'] - vendas_produtos['custo_unitario']) / vendas_produtos['preco_unitario']) * 100
+    return vendas_produtos.nlargest(n, 'quantidade')[['nome_produto', 'quantidade', 'valor_total', 'margem_lucro']]
+
+
+def ticket_medio_segmento(cubo):
+    por_segmento = cubo.vendas.groupby('segmento', observed=True)[['receita', 'vendas']].sum()
+    return (por_segmento['receita'] / por_segmento['vendas']).reset_index(name='valor_total')
+
+
+def vendas_mensais(cubo):
+    resultado = cubo.vendas.groupby('mes')['receita'].sum().reset_index(name='valor_total')
+    resultado['nome_mes'] = [analises.MESES[i-1] for i in resultado['mes']]
+    return resultado
+
+
+def eficiencia_campanhas(cubo):
+    eficiencia = cubo.interacoes.groupby('id_campanha')[['conversoes', 'interacoes']].sum()
+    eficiencia = eficiencia[eficiencia['conversoes'] > 0].reset_index()
+    eficiencia.columns = ['id_campanha', 'conversoes', 'total_interacoes']
+    eficiencia['taxa_conversao'] = (eficiencia['conversoes'] / eficiencia['total_interacoes']) * 100
+    return eficiencia.merge(cubo.campanhas, on='id_campanha')
+
+
+def engajamento_canais(cubo):
+    por_campanha = cubo.interacoes.groupby('id_campanha')['interacoes'].sum().reset_index()
+    camp_interacoes = por_campanha.merge(cubo.campanhas, on='id_campanha')
+    return (camp_interacoes.groupby('canal_marketing', observed=True)['interacoes'].sum()
+            .reset_index(name='total_interacoes'))
+
+
+def vendas_top_produtos_mensais(cubo, n=3):
+    vendas_produtos = cubo.vendas[['id_produto', 'mes_indice', 'quantidade']].merge(
+        cubo.produtos[['id_produto', 'nome_produto']], on='id_produto')
+    mensais = vendas_produtos.groupby(['mes_indice', 'nome_produto'])['quantidade'].sum().reset_index()
+    top = vendas_produtos.groupby('nome_produto')['quantidade'].sum().nlargest(n).index
+    mensais = mensais[mensais['nome_produto'].isin(top)].copy()
+    mensais.insert(0, 'mes_ano', analises.rotulo_mes(mensais.pop('mes_indice')))
+    return mensais
+
+
+def desempenho_regional(cubo):
+    vendas_cidade = (cubo.vendas.groupby('cidade', observed=True)['receita'].sum()
+                     .reset_index(name='valor_total'))
+    int_cidade = cubo.interacoes.groupby('cidade', observed=True)['interacoes'].sum().reset_index()
+    regional = vendas_cidade.merge(int_cidade, on='cidade')
+    regional['vendas_por_interacao'] = regional['valor_total'] / regional['interacoes']
+    return regional
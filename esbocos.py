@@ -0,0 +1,373 @@
+import argparse
+import os
+import sys
+import time
+from contextlib import closing
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+import analises
+import analises_sql
+import ingestao
+import rfm
+import streaming
+
+# Modo aproximado: esboços (sketches) de tamanho fixo montados numa passada
+# sobre Vendas, que respondem às análises de clientes sem guardar um valor por
+# cliente.
+#
+# Clientes distintos usam HyperLogLog: 2^PRECISAO registros de um byte por dia
+# (o maior posto do hash dos clientes que compraram no dia). Registros se unem
+# pelo máximo, então qualquer período é o máximo das linhas dos seus dias
+# (milissegundos mesmo para anos de vendas), os meses são o máximo dos seus
+# dias e a união de meses anteriores é um máximo acumulado. O erro padrão
+# relativo de cada contagem é 1.04/sqrt(2^PRECISAO) (0,81% com 14 bits); os
+# intervalos mostrados são de 2 erros padrão (~95%). Daí saem:
+#   - ativos no período, churn e o histograma de dias sem comprar (uniões dos
+#     dias a partir de cada data: clientes cuja última compra é posterior);
+#   - coortes e retenção por inclusão-exclusão entre o mês e a união dos meses
+#     anteriores (novos = |U<=m| - |U<m|, retidos = |A_m| - novos).
+#
+# Quantis de valor, frequência e recência por cliente usam KLL (K_KLL itens no
+# nível mais alto): cada lote de clientes vira um esboço que é mesclado aos
+# anteriores. O erro de posto de cada limite, com 99% de confiança, segue a
+# fórmula de referência do KLL (2,296 / k^0,9723, 1,33% com k = 200). Esses
+# quantis são por cliente, não por mês, então se mesclam entre lotes de
+# clientes mas não se recortam por período. A classificação conta os clientes
+# de cada segmento numa segunda passada, com os limites dos esboços.
+#
+# Comparação com as análises exatas (erro observado x erro declarado):
+#   python esbocos.py vendas_marketing.db --comparar
+
+PRECISAO = int(os.environ.get('ESBOCOS_PRECISAO', 14))
+K_KLL = int(os.environ.get('ESBOCOS_KLL_K', 200))
+# Erros padrão nos intervalos mostrados (~95%)
+Z = 2
+# Linhas de registros convertidas para float por vez ao estimar
+LINHAS_POR_ESTIMATIVA = 256
+
+_SPLITMIX = (np.uint64(0x9E3779B97F4A7C15), np.uint64(0xBF58476D1CE4E5B9), np.uint64(0x94D049BB133111EB))
+_POTENCIAS = 2.0 ** -np.arange(66)
+
+
+def _hash(ids):
+    # splitmix64: ids próximos viram hashes independentes
+    z = np.asarray(ids).astype(np.uint64) + _SPLITMIX[0]
+    z = (z ^ (z >> np.uint64(30))) * _SPLITMIX[1]
+    z = (z ^ (z >> np.uint64(27))) * _SPLITMIX[2]
+    return z ^ (z >> np.uint64(31))
+
+
+def _bits(x):
+    # Número de bits significativos de cada uint64
+    for deslocamento in (1, 2, 4, 8, 16, 32):
+        x = x | (x >> np.uint64(deslocamento))
+    return np.bitwise_count(x)
+
+
+def posicoes(ids, precisao=PRECISAO):
+    # (registro, posto) de cada id: os bits altos do hash escolhem o registro e o
+    # posto é 1 + os zeros à esquerda dos bits restantes
+    h = _hash(ids)
+    restantes = 64 - precisao
+    registro = (h >> np.uint64(restantes)).astype(np.int64)
+    posto = restantes + 1 - _bits(h & np.uint64((1 << restantes) - 1))
+    return registro, posto.astype(np.uint8)
+
+
+def estimar(registros):
+    # Cardinalidade de cada linha de registros, com a correção de contagem linear
+    # para conjuntos pequenos
+    registros = np.atleast_2d(registros)
+    m = registros.shape[1]
+    alfa = 0.7213 / (1 + 1.079 / m)
+    estimativas = np.empty(len(registros))
+    for inicio in range(0, len(registros), LINHAS_POR_ESTIMATIVA):
+        bloco = registros[inicio:inicio + LINHAS_POR_ESTIMATIVA]
+        bruta = alfa * m * m / _POTENCIAS[bloco].sum(axis=1)
+        zeros = (bloco == 0).sum(axis=1)
+        linear = m * np.log(m / np.maximum(zeros, 1))
+        estimativas[inicio:inicio + len(bloco)] = np.where((bruta <= 2.5 * m) & (zeros > 0), linear, bruta)
+    return estimativas
+
+
+def erro_relativo(precisao=PRECISAO):
+    return 1.04 / np.sqrt(1 << precisao)
+
+
+class KLL:
+    # Esboço de quantis: níveis de itens, cada item do nível h vale 2^h itens
+    # originais. Um nível acima da capacidade é ordenado e metade dos itens (os
+    # de posição par ou ímpar, ao acaso) sobe para o nível seguinte.
+    def __init__(self, k=K_KLL, semente=0):
+        self.k = k
+        self.n = 0
+        self.niveis = [np.empty(0)]
+        self._aleatorio = np.random.default_rng(semente)
+
+    def _capacidade(self, nivel):
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.niveis) - 1 - nivel))))
+
+    def _compactar(self):
+        compactou = True
+        while compactou:
+            compactou = False
+            for nivel, itens in enumerate(self.niveis):
+                if len(itens) <= self._capacidade(nivel):
+                    continue
+                if nivel + 1 == len(self.niveis):
+                    self.niveis.append(np.empty(0))
+                itens = np.sort(itens)
+                sobra, itens = itens[len(itens) - len(itens) % 2:], itens[:len(itens) - len(itens) % 2]
+                self.niveis[nivel + 1] = np.concatenate([self.niveis[nivel + 1], itens[self._aleatorio.integers(2)::2]])
+                self.niveis[nivel] = sobra
+                compactou = True
+
+    def adicionar(self, valores):
+        valores = np.asarray(valores, dtype='float64')
+        valores = valores[~np.isnan(valores)]
+        self.n += len(valores)
+        self.niveis[0] = np.concatenate([self.niveis[0], valores])
+        self._compactar()
+        return self
+
+    def mesclar(self, outro):
+        self.n += outro.n
+        for nivel, itens in enumerate(outro.niveis):
+            if nivel == len(self.niveis):
+                self.niveis.append(np.empty(0))
+            self.niveis[nivel] = np.concatenate([self.niveis[nivel], itens])
+        self._compactar()
+        return self
+
+    def quantis(self, niveis):
+        itens = np.concatenate(self.niveis)
+        if itens.size == 0:
+            return np.full(len(niveis), np.nan)
+        pesos = np.concatenate([np.full(len(itens), 2.0 ** nivel) for nivel, itens in enumerate(self.niveis)])
+        ordem = np.argsort(itens, kind='stable')
+        acumulado = np.cumsum(pesos[ordem])
+        posicao = np.searchsorted(acumulado, np.asarray(niveis) * acumulado[-1], side='left')
+        return itens[ordem][np.minimum(posicao, len(itens) - 1)]
+
+    @property
+    def erro_posto(self):
+        # Erro normalizado de posto de um quantil, com 99% de confiança
+        return 2.296 / self.k ** 0.9723
+
+
+@dataclass(frozen=True)
+class Esbocos:
+    db_path: str
+    dia_inicial: int
+    # [dia, registro]: HyperLogLog dos clientes que compraram em cada dia
+    diarios: np.ndarray
+    # Mês absoluto (ano * 12 + mês - 1) de cada linha de diarios
+    meses: np.ndarray
+    # Métrica por cliente -> KLL
+    metricas: dict
+
+    @property
+    def precisao(self):
+        return int(np.log2(self.diarios.shape[1]))
+
+    @property
+    def dia_final(self):
+        return self.dia_inicial + len(self.diarios) - 1
+
+
+def _metricas_clientes(fluxo, dia_final):
+    # Valor, frequência e recência (dias até a última venda do banco) por cliente, em lotes
+    ultima = ingestao.DIA_SQL.format('MAX(data_venda)')
+    return streaming.lotes(fluxo, f"""
+        SELECT TOTAL(valor_total) AS valor_total, COUNT(valor_total) AS frequencia,
+               {dia_final} - {ultima} AS recencia
+        FROM Vendas WHERE id_cliente IS NOT NULL GROUP BY id_cliente
+    """)
+
+
+def construir(db_path, orcamento_mb=streaming.ORCAMENTO_MB, precisao=PRECISAO, k=K_KLL):
+    fluxo = streaming.Fluxo(db_path, orcamento_mb)
+    with closing(analises_sql.conectar(db_path)) as conn:
+        primeiro, ultimo = conn.execute(
+            f"SELECT {ingestao.DIA_SQL.format('MIN(data_venda)')}, {ingestao.DIA_SQL.format('MAX(data_venda)')} FROM Vendas"
+        ).fetchone()
+        dia = ingestao.dia(conn, 'Vendas')
+    m = 1 << precisao
+    if primeiro is None:
+        primeiro = ultimo = 0
+    diarios = np.zeros((ultimo - primeiro + 1, m), dtype=np.uint8)
+    for lote in streaming.lotes(fluxo, f"""
+        SELECT id_cliente, {dia} AS dia FROM Vendas WHERE id_cliente IS NOT NULL AND data_venda IS NOT NULL
+    """):
+        registro, posto = posicoes(lote['id_cliente'].to_numpy(np.int64), precisao)
+        np.maximum.at(diarios.reshape(-1), (lote['dia'].to_numpy(np.int64) - primeiro) * m + registro, posto)
+    metricas = {coluna: KLL(k, semente) for semente, coluna in enumerate(('valor_total', 'frequencia', 'recencia'))}
+    for lote in _metricas_clientes(fluxo, ultimo):
+        for coluna, esboco in metricas.items():
+            esboco.mesclar(KLL(k, esboco.n).adicionar(lote[coluna]))
+    dias = np.arange(primeiro, ultimo + 1).astype('datetime64[D]')
+    meses = dias.astype('datetime64[M]').astype(np.int64) + 1970 * 12
+    return Esbocos(db_path, primeiro, diarios, meses, metricas)
+
+
+def _linha(esb, data):
+    return int(np.clip((pd.Timestamp(data) - pd.Timestamp(0)).days - esb.dia_inicial, 0, len(esb.diarios)))
+
+
+def clientes_ativos(esb, inicio=None, fim=None):
+    # (estimativa, erro) dos clientes distintos com compras entre as datas (inclusive)
+    de = 0 if inicio is None else _linha(esb, inicio)
+    ate = len(esb.diarios) if fim is None else _linha(esb, fim) + 1
+    if ate <= de:
+        return 0.0, 0.0
+    estimativa = estimar(np.maximum.reduce(esb.diarios[de:ate]))[0]
+    return estimativa, Z * erro_relativo(esb.precisao) * estimativa
+
+
+def churn_clientes(esb, dias_inatividade=90, faixas=60):
+    # Histograma de dias sem comprar por status e o resumo (clientes, ativos e taxa, com erros).
+    # a_partir[d]: clientes com alguma compra no dia d ou depois, ou seja, com até
+    # (último dia - d) dias sem comprar
+    a_partir = estimar(np.maximum.accumulate(esb.diarios[::-1], axis=0))[::-1]
+    ultimo = len(a_partir) - 1
+
+    def ate(dias):
+        # Clientes com no máximo `dias` dias sem comprar
+        return np.where(dias < 0, 0.0, a_partir[np.clip(ultimo - dias, 0, ultimo)])
+    largura = max(1, -(-len(a_partir) // faixas))
+    bordas = np.union1d(np.arange(0, len(a_partir) + largura, largura), [dias_inatividade + 1])
+    inicio, fim = bordas[:-1], bordas[1:] - 1
+    clientes = np.maximum(ate(fim) - ate(inicio - 1), 0)
+    histograma = pd.DataFrame({
+        'dias_sem_comprar': (inicio + fim) / 2,
+        'faixa': [f"{a}–{b}" for a, b in zip(inicio, fim)],
+        'clientes': clientes.round().astype('int64'),
+        'erro': (Z * erro_relativo(esb.precisao) * (ate(fim) + ate(inicio - 1))).round().astype('int64'),
+        'status': np.where(inicio > dias_inatividade, 'Inativo', 'Ativo'),
+    })
+    histograma = histograma[histograma['clientes'] > 0].reset_index(drop=True)
+    total, ativos = a_partir[0], float(ate(dias_inatividade))
+    erro = Z * erro_relativo(esb.precisao)
+    resumo = {
+        'clientes': total,
+        'erro_clientes': erro * total,
+        'ativos': ativos,
+        'erro_ativos': erro * ativos,
+        'taxa_churn': (total - ativos) / total * 100 if total else 0.0,
+        # inativos = total - ativos: os dois erros se somam no pior caso
+        'erro_taxa': erro * (total + ativos) / total * 100 if total else 0.0,
+    }
+    return histograma, resumo
+
+
+def _mensais(esb):
+    # (mês absoluto, registros do mês) de cada mês entre a primeira e a última venda
+    inicio = np.flatnonzero(np.r_[True, np.diff(esb.meses) != 0])
+    return esb.meses[inicio], np.maximum.reduceat(esb.diarios, inicio, axis=0)
+
+
+def coortes(esb):
+    # Formato longo de analises.coortes. Clientes da coorte c ativos no mês m:
+    # |U<=c| - |U<c| - |U<=c ∪ A_m| + |U<c ∪ A_m|, onde U<=c é a união dos meses
+    # até c e A_m os ativos em m
+    meses, mensais = _mensais(esb)
+    ate_mes = np.maximum.accumulate(mensais, axis=0)
+    uniao = estimar(ate_mes)
+    partes = []
+    for c in range(len(meses)):
+        depois = mensais[c:]
+        com_coorte = estimar(np.maximum(ate_mes[c], depois))
+        sem_coorte = estimar(np.maximum(ate_mes[c - 1], depois)) if c else estimar(depois)
+        anteriores = uniao[c - 1] if c else 0.0
+        partes.append(pd.DataFrame({
+            'coorte': meses[c],
+            'periodo': np.arange(len(depois)),
+            'clientes': (uniao[c] - anteriores - com_coorte + sem_coorte).round(),
+        }))
+    longa = pd.concat(partes, ignore_index=True)
+    longa = longa[longa['clientes'] > 0].astype({'clientes': 'int64'})
+    return longa.reset_index(drop=True)
+
+
+def retencao_mensal(esb):
+    # Mesmo formato de analises.retencao_de_coortes, com os intervalos de novos e
+    # retidos (diferenças entre uniões, cujos erros se somam no pior caso)
+    retencao = analises.retencao_de_coortes(coortes(esb))
+    meses, mensais = _mensais(esb)
+    uniao = estimar(np.maximum.accumulate(mensais, axis=0))
+    anteriores = np.r_[0.0, uniao[:-1]]
+    erro = Z * erro_relativo(esb.precisao)
+    erros = pd.DataFrame({
+        'mes': analises.rotulo_mes(meses),
+        'erro_novos': (erro * (uniao + anteriores)).round(),
+        'erro_retidos': (erro * (uniao + anteriores + estimar(mensais))).round(),
+    })
+    return retencao.merge(erros, on='mes', how='left')
+
+
+def classificacao_clientes(esb, segmentacao='legado'):
+    # (clientes por segmento, limites usados com o erro de posto de cada um). Os
+    # clientes são segmentados lote a lote com os quantis dos esboços
+    usados = {}
+
+    def quantis(coluna, niveis):
+        limites = esb.metricas[coluna].quantis(niveis)
+        usados.update({(coluna, nivel): limite for nivel, limite in zip(niveis, limites)})
+        return limites
+    contagem = pd.Series(dtype='int64')
+    for lote in _metricas_clientes(streaming.Fluxo(esb.db_path), esb.dia_final):
+        segmentos = rfm.segmentar(lote, segmentacao, quantis=quantis)['segmento']
+        contagem = contagem.add(pd.Series(segmentos).value_counts(), fill_value=0)
+    contagem = contagem.astype('int64').rename_axis('segmento').reset_index(name='clientes')
+    limites = pd.DataFrame(
+        [(coluna, nivel, limite, esb.metricas[coluna].erro_posto * 100) for (coluna, nivel), limite in usados.items()],
+        columns=['metrica', 'quantil', 'limite', 'erro_posto_pct'],
+    )
+    return (contagem.sort_values('clientes', ascending=False, ignore_index=True),
+            limites.sort_values(['metrica', 'quantil'], ignore_index=True))
+
+
+def _comparar(esb, db_path):
+    # Erro observado de cada estimativa contra a análise exata do modo SQL
+    churn_exato, taxa_exata = analises_sql.churn_clientes(db_path)
+    _, resumo = churn_clientes(esb)
+    ativos = (churn_exato['status'] == 'Ativo').sum()
+    print(f"clientes   {resumo['clientes']:>12,.0f} exato {len(churn_exato):>10,}  ±{resumo['erro_clientes']:,.0f}")
+    print(f"ativos     {resumo['ativos']:>12,.0f} exato {ativos:>10,}  ±{resumo['erro_ativos']:,.0f}")
+    print(f"churn      {resumo['taxa_churn']:>11.2f}% exato {taxa_exata:>9.2f}%  ±{resumo['erro_taxa']:.2f} p.p.")
+
+    retencao = retencao_mensal(esb).merge(analises_sql.retencao_mensal(db_path), on='mes', suffixes=('', '_exato'))
+    for coluna, erro in (('novos_clientes', 'erro_novos'), ('clientes_retidos', 'erro_retidos')):
+        dentro = (retencao[coluna] - retencao[f'{coluna}_exato']).abs() <= retencao[erro]
+        print(f"{coluna:<16} {dentro.mean():>6.0%} dos meses dentro do intervalo declarado")
+
+    metricas = analises_sql.classificacao_clientes(db_path, 'legado')
+    _, limites = classificacao_clientes(esb, 'legado')
+    for linha in limites.itertuples():
+        # Com empates o limite cobre um intervalo de postos; o erro é a distância até ele
+        valores = metricas[linha.metrica]
+        erro = max(0, (valores < linha.limite).mean() - linha.quantil, linha.quantil - (valores <= linha.limite).mean())
+        print(f"{linha.metrica:<12} q{linha.quantil:.2f}: limite {linha.limite:>12,.2f} "
+              f"exato {valores.quantile(linha.quantil):>12,.2f} erro de posto {erro:.2%} "
+              f"(declarado {linha.erro_posto_pct:.2f}%)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monta os esboços de clientes e mede o erro contra as análises exatas")
+    parser.add_argument('banco', nargs='?', default='vendas_marketing.db')
+    parser.add_argument('--comparar', action='store_true', help="compara com as análises exatas do modo SQL")
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    esb = construir(args.banco)
+    print(f"Esboços montados em {time.perf_counter() - inicio:.1f} s "
+          f"({esb.diarios.nbytes / 2**20:.1f} MB, {len(esb.diarios)} dias)", file=sys.stderr)
+    inicio = time.perf_counter()
+    estimativa, erro = clientes_ativos(esb)
+    print(f"Clientes distintos: {estimativa:,.0f} ± {erro:,.0f} ({(time.perf_counter() - inicio) * 1000:.0f} ms)",
+          file=sys.stderr)
+    if args.comparar:
+        _comparar(esb, args.banco)
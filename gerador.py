@@ -0,0 +1,284 @@
+import argparse
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+# Gerador de bancos sintéticos com o mesmo esquema de cinco tabelas do
+# vendas_marketing.db, em qualquer escala (de milhares a dezenas de milhões de
+# vendas). As distribuições imitam as de produção: poucos clientes, produtos e
+# campanhas concentram a maior parte do volume (cauda longa), as vendas têm
+# sazonalidade mensal e semanal, cada cliente compra apenas dentro da sua janela
+# de atividade (o que dá coortes e churn realistas) e as vendas ligadas a uma
+# campanha caem dentro do período dela. A mesma semente gera o mesmo banco.
+
+ESQUEMA = """
+    CREATE TABLE Clientes (
+        id_cliente INTEGER PRIMARY KEY,
+        nome TEXT,
+        cidade TEXT,
+        segmento TEXT
+    );
+    CREATE TABLE Produtos (
+        id_produto INTEGER PRIMARY KEY,
+        nome_produto TEXT,
+        categoria TEXT,
+        preco_unitario REAL,
+        custo_unitario REAL
+    );
+    CREATE TABLE Campanhas_Marketing (
+        id_campanha INTEGER PRIMARY KEY,
+        nome_campanha TEXT,
+        canal_marketing TEXT,
+        data_inicio DATE,
+        data_fim DATE,
+        orcamento REAL,
+        custo REAL
+    );
+    CREATE TABLE Interacoes_Marketing (
+        id_interacao INTEGER PRIMARY KEY,
+        id_cliente INTEGER,
+        id_campanha INTEGER,
+        data_interacao DATE,
+        tipo_interacao TEXT,
+        FOREIGN KEY (id_cliente) REFERENCES Clientes(id_cliente),
+        FOREIGN KEY (id_campanha) REFERENCES Campanhas_Marketing(id_campanha)
+    );
+    CREATE TABLE Vendas (
+        id_venda INTEGER PRIMARY KEY,
+        id_cliente INTEGER,
+        id_produto INTEGER,
+        id_campanha INTEGER,
+        data_venda DATE,
+        quantidade INTEGER,
+        valor_total REAL,
+        canal_aquisicao TEXT,
+        FOREIGN KEY (id_cliente) REFERENCES Clientes(id_cliente),
+        FOREIGN KEY (id_produto) REFERENCES Produtos(id_produto)
+    );
+"""
+
+SEGMENTOS = ['B2B', 'B2C']
+CATEGORIAS = ['Consultoria', 'SaaS', 'Treinamento']
+LINHAS_PRODUTO = ['Growth Way', 'High Growth', 'Station AI', 'GS Engage']
+CANAIS_MARKETING = ['Email', 'Google Ads', 'Meta Ads']
+CANAIS_AQUISICAO = ['Inbound', 'Outbound']
+TIPOS_INTERACAO = ['Visualização', 'Clique', 'Conversão']
+PROPORCAO_TIPOS = [0.70, 0.20, 0.10]
+
+# Peso relativo de cada mês (Jan..Dez) e de cada dia da semana (Seg..Dom)
+SAZONALIDADE_MES = np.array([0.80, 0.85, 1.00, 1.00, 1.05, 1.00, 0.95, 1.00, 1.05, 1.10, 1.30, 1.40])
+SAZONALIDADE_SEMANA = np.array([1.05, 1.10, 1.10, 1.05, 1.00, 0.55, 0.45])
+
+# Fração das vendas sem campanha associada (id_campanha nulo)
+VENDAS_SEM_CAMPANHA = 1 / 3
+
+LOTE = 500_000
+
+
+def escala_padrao(vendas):
+    # Proporções usadas quando só o número de vendas é informado
+    return {
+        'clientes': max(1_000, vendas // 5),
+        'produtos': max(25, int(np.sqrt(vendas) / 10)),
+        'campanhas': max(20, int(vendas ** (1 / 3))),
+        'cidades': max(50, int(np.sqrt(vendas) / 2)),
+        'interacoes': 2 * vendas,
+    }
+
+
+def _pesos_cauda_longa(rng, n, alfa):
+    # Pareto: a maior parte do volume fica com poucos itens
+    pesos = rng.pareto(alfa, n) + 1
+    return pesos / pesos.sum()
+
+
+def _sortear(rng, pesos, tamanho):
+    # Equivalente a rng.choice(len(pesos), p=pesos), sem revalidar os pesos a cada lote
+    return np.searchsorted(np.cumsum(pesos), rng.random(tamanho) * pesos.sum(), side='right').clip(0, len(pesos) - 1)
+
+
+def _gerar_clientes(rng, n, n_cidades, dias):
+    pesos_cidades = _pesos_cauda_longa(rng, n_cidades, 1.5)
+    # Janela de atividade: entrada ao longo do período e vida útil exponencial
+    entrada = rng.integers(0, max(1, int(dias * 0.85)), n)
+    vida = np.ceil(rng.exponential(dias * 0.35, n)).astype(np.int64) + 1
+    df = pd.DataFrame({
+        'id_cliente': np.arange(1, n + 1),
+        'nome': [f'Cliente {i}' for i in range(1, n + 1)],
+        'cidade': [f'Cidade {i:04d}' for i in _sortear(rng, pesos_cidades, n) + 1],
+        'segmento': np.array(SEGMENTOS)[rng.integers(0, 2, n)],
+    })
+    return df, entrada, np.minimum(entrada + vida, dias)
+
+
+def _gerar_produtos(rng, n):
+    preco = np.round(rng.lognormal(np.log(450), 0.6, n), 2)
+    return pd.DataFrame({
+        'id_produto': np.arange(1, n + 1),
+        'nome_produto': [f'{LINHAS_PRODUTO[i % len(LINHAS_PRODUTO)]} - Item {i + 1}' for i in range(n)],
+        'categoria': np.array(CATEGORIAS)[rng.integers(0, len(CATEGORIAS), n)],
+        'preco_unitario': preco,
+        'custo_unitario': np.round(preco * rng.uniform(0.55, 0.95, n), 2),
+    })
+
+
+def _gerar_campanhas(rng, n, inicio, dias):
+    comeco = rng.integers(0, max(1, dias - 7), n)
+    fim = np.minimum(comeco + rng.integers(7, 46, n), dias - 1)
+    orcamento = np.round(rng.uniform(5_000, 50_000, n), 2)
+    return pd.DataFrame({
+        'id_campanha': np.arange(1, n + 1),
+        'nome_campanha': [f'Campanha {i}' for i in range(1, n + 1)],
+        'canal_marketing': np.array(CANAIS_MARKETING)[rng.integers(0, len(CANAIS_MARKETING), n)],
+        'data_inicio': (inicio + pd.to_timedelta(comeco, unit='D')).strftime('%Y-%m-%d'),
+        'data_fim': (inicio + pd.to_timedelta(fim, unit='D')).strftime('%Y-%m-%d'),
+        'orcamento': orcamento,
+        'custo': np.round(orcamento * rng.uniform(0.6, 1.3, n), 2),
+    }), comeco, fim
+
+
+def _peso_dias(inicio, dias):
+    datas = inicio + pd.to_timedelta(np.arange(dias), unit='D')
+    peso = SAZONALIDADE_MES[datas.month - 1] * SAZONALIDADE_SEMANA[datas.dayofweek]
+    return peso / peso.max()
+
+
+def _dias_no_periodo(rng, inicio_janela, fim_janela, aceitacao):
+    # Dia uniforme dentro da janela de cada linha, com rejeição pela sazonalidade
+    dias = np.empty(len(inicio_janela), dtype=np.int64)
+    pendentes = np.arange(len(inicio_janela))
+    while len(pendentes):
+        a, b = inicio_janela[pendentes], fim_janela[pendentes]
+        sorteio = a + (rng.random(len(pendentes)) * (b - a + 1)).astype(np.int64)
+        aceito = rng.random(len(pendentes)) < aceitacao[sorteio]
+        dias[pendentes[aceito]] = sorteio[aceito]
+        pendentes = pendentes[~aceito]
+    return dias
+
+
+def _lote_vendas(rng, n, primeiro_id, ctx):
+    com_campanha = rng.random(n) >= VENDAS_SEM_CAMPANHA
+    campanha = _sortear(rng, ctx['pesos_campanhas'], n)
+    cliente = _sortear(rng, ctx['pesos_clientes'], n)
+    # Sem campanha: dentro da janela de atividade do cliente; com campanha: no período dela
+    inicio_janela = np.where(com_campanha, ctx['comeco_campanha'][campanha], ctx['entrada'][cliente])
+    fim_janela = np.where(com_campanha, ctx['fim_campanha'][campanha], ctx['saida'][cliente] - 1)
+    dia = _dias_no_periodo(rng, inicio_janela, np.maximum(fim_janela, inicio_janela), ctx['aceitacao'])
+    produto = _sortear(rng, ctx['pesos_produtos'], n)
+    quantidade = np.minimum(rng.geometric(0.35, n), 10)
+    valor = np.round(quantidade * ctx['precos'][produto], 2)
+    id_campanha = np.where(com_campanha, campanha + 1, 0).astype(object)
+    id_campanha[~com_campanha] = None
+    return zip(
+        range(primeiro_id, primeiro_id + n),
+        (cliente + 1).tolist(),
+        (produto + 1).tolist(),
+        id_campanha.tolist(),
+        ctx['datas'][dia].tolist(),
+        quantidade.tolist(),
+        valor.tolist(),
+        np.array(CANAIS_AQUISICAO)[(rng.random(n) < 0.45).astype(int)].tolist(),
+    )
+
+
+def _lote_interacoes(rng, n, primeiro_id, ctx):
+    campanha = _sortear(rng, ctx['pesos_campanhas'], n)
+    cliente = _sortear(rng, ctx['pesos_clientes'], n)
+    dia = _dias_no_periodo(rng, ctx['comeco_campanha'][campanha], ctx['fim_campanha'][campanha], ctx['aceitacao'])
+    tipo = _sortear(rng, np.array(PROPORCAO_TIPOS), n)
+    return zip(
+        range(primeiro_id, primeiro_id + n),
+        (cliente + 1).tolist(),
+        (campanha + 1).tolist(),
+        ctx['datas'][dia].tolist(),
+        np.array(TIPOS_INTERACAO)[tipo].tolist(),
+    )
+
+
+def gerar(destino, vendas=10_000, clientes=None, produtos=None, campanhas=None, interacoes=None,
+          cidades=None, inicio='2025-01-01', anos=1, semente=42, progresso=None):
+    padrao = escala_padrao(vendas)
+    clientes = clientes or padrao['clientes']
+    produtos = produtos or padrao['produtos']
+    campanhas = campanhas or padrao['campanhas']
+    cidades = cidades or padrao['cidades']
+    interacoes = padrao['interacoes'] if interacoes is None else interacoes
+
+    rng = np.random.default_rng(semente)
+    inicio = pd.Timestamp(inicio)
+    dias = (inicio + pd.DateOffset(years=anos) - inicio).days
+
+    df_clientes, entrada, saida = _gerar_clientes(rng, clientes, cidades, dias)
+    df_produtos = _gerar_produtos(rng, produtos)
+    df_campanhas, comeco, fim = _gerar_campanhas(rng, campanhas, inicio, dias)
+    ctx = {
+        'datas': np.array((inicio + pd.to_timedelta(np.arange(dias), unit='D')).strftime('%Y-%m-%d'), dtype=object),
+        'aceitacao': _peso_dias(inicio, dias),
+        'entrada': entrada,
+        'saida': saida,
+        'comeco_campanha': comeco,
+        'fim_campanha': fim,
+        'pesos_clientes': _pesos_cauda_longa(rng, clientes, 2.0),
+        'pesos_produtos': _pesos_cauda_longa(rng, produtos, 1.2),
+        'pesos_campanhas': df_campanhas['orcamento'].to_numpy() / df_campanhas['orcamento'].sum(),
+        'precos': df_produtos['preco_unitario'].to_numpy(),
+    }
+
+    # Gera em um arquivo temporário: um banco pela metade nunca fica no destino
+    temporario = destino + '.parcial'
+    if os.path.exists(temporario):
+        os.remove(temporario)
+    with closing(sqlite3.connect(temporario)) as conn:
+        conn.execute("PRAGMA journal_mode = OFF")
+        conn.execute("PRAGMA synchronous = OFF")
+        conn.executescript(ESQUEMA)
+        for tabela, df in (('Clientes', df_clientes), ('Produtos', df_produtos), ('Campanhas_Marketing', df_campanhas)):
+            marcadores = ', '.join('?' * len(df.columns))
+            conn.executemany(f"INSERT INTO {tabela} VALUES ({marcadores})", df.itertuples(index=False, name=None))
+        for tabela, total, lote, marcadores in (
+            ('Vendas', vendas, _lote_vendas, '?, ?, ?, ?, ?, ?, ?, ?'),
+            ('Interacoes_Marketing', interacoes, _lote_interacoes, '?, ?, ?, ?, ?'),
+        ):
+            for primeiro in range(0, total, LOTE):
+                n = min(LOTE, total - primeiro)
+                conn.executemany(f"INSERT INTO {tabela} VALUES ({marcadores})", lote(rng, n, primeiro + 1, ctx))
+                if progresso:
+                    progresso(tabela, primeiro + n, total)
+        conn.commit()
+    os.replace(temporario, destino)
+    return {
+        'Clientes': clientes,
+        'Produtos': produtos,
+        'Campanhas_Marketing': campanhas,
+        'Interacoes_Marketing': interacoes,
+        'Vendas': vendas,
+    }
+
+
+if __name__ == "__main__":
+    # Uso: python gerador.py vendas_1m.db --vendas 1000000 [--anos 2] [--semente 7]
+    parser = argparse.ArgumentParser(description="Gera um banco sintético com o esquema de vendas e marketing")
+    parser.add_argument('destino')
+    parser.add_argument('--vendas', type=int, default=10_000)
+    parser.add_argument('--clientes', type=int)
+    parser.add_argument('--produtos', type=int)
+    parser.add_argument('--campanhas', type=int)
+    parser.add_argument('--interacoes', type=int)
+    parser.add_argument('--cidades', type=int)
+    parser.add_argument('--inicio', default='2025-01-01')
+    parser.add_argument('--anos', type=int, default=1)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+    if os.path.exists(args.destino):
+        parser.error(f"{args.destino} já existe")
+    contagens = gerar(
+        args.destino, args.vendas, args.clientes, args.produtos, args.campanhas, args.interacoes,
+        args.cidades, args.inicio, args.anos, args.semente,
+        progresso=lambda tabela, feitas, total: print(f"\r{tabela}: {feitas:,}/{total:,}", end='', flush=True),
+    )
+    print()
+    for tabela, n in contagens.items():
+        print(f"{tabela}: {n:,}")
@@ -0,0 +1,180 @@
+import os
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+# Gráficos com redução feita no servidor, para que o navegador receba um volume
+# de pontos que independe do tamanho da base. Histogramas são agrupados em
+# faixas com numpy e enviados como barras. Dispersões e linhas acima de
+# LIMITE_PONTOS passam a usar WebGL (scattergl) com amostragem estratificada
+# (dispersão) ou LTTB (linhas), e barras são agregadas pelo eixo x. Sempre que
+# pontos são descartados, o gráfico ganha uma anotação com quantos foram exibidos.
+
+LIMITE_PONTOS = int(os.environ.get('GRAFICOS_LIMITE_PONTOS', 5_000))
+MAX_FAIXAS = 200
+SEMENTE = 0
+
+
+def indicar_reducao(fig, original, exibidos, metodo):
+    fig.add_annotation(
+        text=f"Dados reduzidos no servidor: {exibidos:,} de {original:,} pontos ({metodo})",
+        xref='paper', yref='paper', x=1, y=1.02, xanchor='right', yanchor='bottom',
+        showarrow=False, font=dict(size=11, color='#7f8c8d'),
+    )
+    fig.update_layout(meta={'pontos_originais': original, 'pontos_exibidos': exibidos})
+    return fig
+
+
+def _numerico(serie):
+    # Eixo contínuo como float (datas em nanossegundos) ou None se for categórico
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return serie.to_numpy(dtype='datetime64[ns]').astype('int64').astype(float)
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return serie.to_numpy(dtype=float)
+    return None
+
+
+def faixas(valores, nbins=None):
+    valores = valores[np.isfinite(valores)]
+    if len(valores) == 0:
+        return np.array([0.0, 1.0])
+    bordas = np.histogram_bin_edges(valores, bins=nbins or 'auto')
+    if len(bordas) - 1 > MAX_FAIXAS:
+        bordas = np.linspace(bordas[0], bordas[-1], MAX_FAIXAS + 1)
+    if np.all(np.mod(valores, 1) == 0):
+        # Valores inteiros (ex.: dias): faixas de largura inteira, alinhadas aos inteiros
+        largura = max(1.0, np.ceil(bordas[1] - bordas[0]))
+        bordas = np.arange(np.floor(bordas[0]), bordas[-1] + largura, largura)
+    return bordas
+
+
+def formato_faixas(bordas):
+    # Casas decimais suficientes para que bordas vizinhas não tenham o mesmo rótulo
+    largura = bordas[1] - bordas[0]
+    casas = max(0, int(-np.floor(np.log10(largura)))) if largura > 0 else 0
+    return f",.{casas}f"
+
+
+def histograma(df, x, color=None, nbins=None, labels=None, formato=None, **kwargs):
+    # Equivalente ao px.histogram, com a contagem por faixa feita aqui.
+    # formato: especificação dos rótulos das faixas (ex.: '.0%'); por padrão,
+    # com a precisão dada pela largura das faixas
+    valores = df[x].to_numpy(dtype=float)
+    bordas = faixas(valores, nbins)
+    formato = formato or formato_faixas(bordas)
+    grupos = df[color] if color else pd.Series('', index=df.index)
+    partes = []
+    for grupo, indices in grupos.groupby(grupos, observed=True).indices.items():
+        contagem, _ = np.histogram(valores[indices], bordas)
+        partes.append(pd.DataFrame({
+            x: (bordas[:-1] + bordas[1:]) / 2,
+            'contagem': contagem,
+            'faixa': [f"{a:{formato}} – {b:{formato}}" for a, b in zip(bordas[:-1], bordas[1:])],
+            **({color: grupo} if color else {}),
+        }))
+    agrupado = pd.concat(partes, ignore_index=True) if partes else pd.DataFrame({x: [], 'contagem': [], 'faixa': []})
+    fig = px.bar(agrupado, x=x, y='contagem', color=color, hover_data={'faixa': True, x: False},
+                 labels={'contagem': 'count', **(labels or {})}, **kwargs)
+    fig.update_traces(width=bordas[1] - bordas[0])
+    fig.update_layout(bargap=0, barmode='relative')
+    return fig
+
+
+def amostra_estratificada(df, estrato, n, colunas=()):
+    # Cota proporcional por estrato (ao menos 1 ponto cada), sempre mantendo os
+    # extremos de cada coluna numérica para que os outliers continuem visíveis
+    codigos = df[estrato].astype('category').cat.codes.to_numpy() if estrato else np.zeros(len(df), dtype=np.int64)
+    codigos = codigos.astype(np.int64) + 1
+    tamanhos = np.bincount(codigos)
+    cotas = np.maximum(1, np.floor(tamanhos * n / len(df))).astype(np.int64)
+    rng = np.random.default_rng(SEMENTE)
+    ordem = np.lexsort((rng.random(len(df)), codigos))
+    inicio_estrato = np.concatenate(([0], np.cumsum(tamanhos)[:-1]))
+    posicao = np.arange(len(df)) - inicio_estrato[codigos[ordem]]
+    manter = np.zeros(len(df), dtype=bool)
+    manter[ordem[posicao < cotas[codigos[ordem]]]] = True
+    for coluna in colunas:
+        valores = pd.Series(df[coluna].to_numpy(), index=np.arange(len(df)))
+        if pd.api.types.is_numeric_dtype(valores):
+            por_estrato = valores.groupby(codigos)
+            manter[por_estrato.idxmin().dropna().astype(np.int64)] = True
+            manter[por_estrato.idxmax().dropna().astype(np.int64)] = True
+    return df.iloc[np.flatnonzero(manter)]
+
+
+def dispersao(df, x, y, color=None, limite=LIMITE_PONTOS, **kwargs):
+    if len(df) <= limite:
+        return px.scatter(df, x=x, y=y, color=color, **kwargs)
+    amostra = amostra_estratificada(df, color, limite, [x, y])
+    fig = px.scatter(amostra, x=x, y=y, color=color, render_mode='webgl', **kwargs)
+    return indicar_reducao(fig, len(df), len(amostra), 'amostra estratificada')
+
+
+def lttb(x, y, n):
+    # Largest-Triangle-Three-Buckets: índices de n pontos que preservam a forma da
+    # série (x ordenado). Primeiro e último pontos sempre ficam
+    total = len(x)
+    if n >= total or n < 3:
+        return np.arange(total)
+    indices = np.empty(n, dtype=np.int64)
+    indices[0], indices[-1] = 0, total - 1
+    limites = np.linspace(1, total - 1, n - 1).astype(np.int64)
+    anterior = 0
+    for i in range(n - 2):
+        inicio, fim = limites[i], limites[i + 1]
+        proximo_fim = limites[i + 2] if i + 2 < n - 1 else total
+        media_x, media_y = x[fim:proximo_fim].mean(), y[fim:proximo_fim].mean()
+        xs, ys = x[inicio:fim], y[inicio:fim]
+        areas = np.abs((x[anterior] - media_x) * (ys - y[anterior]) - (x[anterior] - xs) * (media_y - y[anterior]))
+        anterior = inicio + int(np.argmax(areas))
+        indices[i + 1] = anterior
+    return indices
+
+
+def linhas(df, x, y, color=None, limite=LIMITE_PONTOS, **kwargs):
+    if len(df) <= limite:
+        return px.line(df, x=x, y=y, color=color, **kwargs)
+    series = df.groupby(color, observed=True, sort=False) if color else [(None, df)]
+    por_serie = max(3, limite // (df[color].nunique() if color else 1))
+    partes = []
+    for _, serie in series:
+        serie = serie.dropna(subset=[y])
+        eixo = _numerico(serie[x])
+        if eixo is not None:
+            ordem = np.argsort(eixo, kind='stable')
+            serie, eixo = serie.iloc[ordem], eixo[ordem]
+        else:
+            eixo = np.arange(len(serie), dtype=float)
+        partes.append(serie.iloc[lttb(eixo, serie[y].to_numpy(dtype=float), por_serie)])
+    reduzido = pd.concat(partes)
+    fig = px.line(reduzido, x=x, y=y, color=color, render_mode='webgl', **kwargs)
+    return indicar_reducao(fig, len(df), len(reduzido), 'LTTB')
+
+
+def barras(df, x, y, limite=LIMITE_PONTOS, **kwargs):
+    if len(df) <= limite:
+        return px.bar(df, x=x, y=y, **kwargs)
+    agregado = df.groupby(x, observed=True, sort=False)[y].sum().reset_index()
+    metodo = f'soma de {y} por {x}'
+    if len(agregado) > limite:
+        eixo = _numerico(agregado[x])
+        if eixo is not None:
+            bordas = np.linspace(eixo.min(), eixo.max(), limite + 1)
+            soma, _ = np.histogram(eixo, bordas, weights=agregado[y].to_numpy(dtype=float))
+            centros = (bordas[:-1] + bordas[1:]) / 2
+            if pd.api.types.is_datetime64_any_dtype(agregado[x]):
+                centros = pd.to_datetime(centros.astype('int64'))
+            agregado = pd.DataFrame({x: centros, y: soma})
+            metodo = f'soma de {y} em {limite:,} faixas de {x}'
+        else:
+            agregado = agregado.nlargest(limite, y)
+            metodo = f'as {limite:,} maiores categorias de {x}'
+    fig = px.bar(agregado, x=x, y=y, **kwargs)
+    return indicar_reducao(fig, len(df), len(agregado), metodo)
+
+
+def pizza(df, names, **kwargs):
+    # Uma fatia por categoria já contada, em vez de uma linha por registro
+    contagem = df.groupby(names, observed=True).size().reset_index(name='quantidade')
+    return px.pie(contagem, names=names, values='quantidade', **kwargs)
@@ -0,0 +1,320 @@
+import os
+import shutil
+import sqlite3
+from contextlib import closing
+from dataclasses import dataclass
+
+import pandas as pd
+
+import analises
+import analises_sql
+import atribuicao
+import instrumentacao
+import rfm
+
+# Modo incremental: os agregados derivados (última compra, frequência e valor
+# por cliente, contagens de coorte e conversões por campanha) ficam persistidos
+# em um SQLite ao lado do banco de origem, junto com a marca d'água do último
+# id_venda/id_interacao já processado. Cada atualização lê apenas as linhas
+# acima da marca (busca pela chave primária) e as incorpora aos agregados, de
+# modo que o custo acompanha o tamanho do delta e não o histórico inteiro.
+
+ESQUEMA = """
+    CREATE TABLE IF NOT EXISTS estado (
+        tabela TEXT PRIMARY KEY,
+        ultimo_id INTEGER NOT NULL,
+        assinatura TEXT
+    );
+    CREATE TABLE IF NOT EXISTS clientes (
+        id_cliente INTEGER PRIMARY KEY,
+        primeira_compra TEXT,
+        ultima_compra TEXT,
+        frequencia INTEGER,
+        valor_total REAL
+    );
+    CREATE TABLE IF NOT EXISTS atividade (
+        id_cliente INTEGER,
+        mes INTEGER,
+        PRIMARY KEY (id_cliente, mes)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS coortes (
+        coorte INTEGER,
+        periodo INTEGER,
+        clientes INTEGER,
+        PRIMARY KEY (coorte, periodo)
+    ) WITHOUT ROWID;
+    CREATE TABLE IF NOT EXISTS campanhas (
+        id_campanha INTEGER PRIMARY KEY,
+        interacoes INTEGER,
+        conversoes INTEGER
+    );
+"""
+
+# Tabela de origem -> (chave primária, colunas que compõem a assinatura da
+# linha da marca d'água, usada para detectar que o banco foi trocado)
+MARCAS = {
+    'Vendas': ('id_venda', 'id_cliente, data_venda, valor_total'),
+    'Interacoes_Marketing': ('id_interacao', 'id_cliente, id_campanha, data_interacao, tipo_interacao'),
+}
+
+MES_SQL = "(CAST(strftime('%Y', {0}) AS INTEGER) * 12 + CAST(strftime('%m', {0}) AS INTEGER) - 1)"
+
+
+@dataclass(frozen=True)
+class Agregados:
+    db_path: str
+
+    @property
+    def caminho(self):
+        return caminho_agregados(self.db_path)
+
+
+def caminho_agregados(db_path):
+    return f"{db_path}.agregados"
+
+
+def herdar(db_path, origem):
+    # Um novo envio do mesmo banco começa dos agregados do envio anterior; se ele
+    # não for continuação do anterior, a assinatura da marca d'água não confere
+    # e atualizar() refaz tudo do zero
+    destino = caminho_agregados(db_path)
+    if origem and not os.path.exists(destino) and os.path.exists(caminho_agregados(origem)):
+        shutil.copyfile(caminho_agregados(origem), destino)
+
+
+def _conectar(db_path):
+    conn = sqlite3.connect(caminho_agregados(db_path), uri=True)
+    conn.executescript(ESQUEMA)
+    conn.execute("ATTACH DATABASE ? AS src", (f"file:{db_path}?mode=ro",))
+    return conn
+
+
+def _assinatura(conn, tabela, ultimo_id):
+    chave, colunas = MARCAS[tabela]
+    linha = conn.execute(f"SELECT {colunas} FROM src.{tabela} WHERE {chave} = ?", (ultimo_id,)).fetchone()
+    return repr(linha)
+
+
+def _marca(conn, tabela):
+    # Devolve a marca d'água válida; se a linha da marca mudou, o banco de
+    # origem não é o mesmo e os agregados precisam ser refeitos do zero
+    linha = conn.execute("SELECT ultimo_id, assinatura FROM estado WHERE tabela = ?", (tabela,)).fetchone()
+    if linha is None:
+        return 0
+    ultimo_id, assinatura = linha
+    return ultimo_id if _assinatura(conn, tabela, ultimo_id) == assinatura else None
+
+
+def _registrar_marca(conn, tabela, antigo):
+    chave, _ = MARCAS[tabela]
+    ultimo_id = conn.execute(f"SELECT COALESCE(MAX({chave}), ?) FROM src.{tabela}", (antigo,)).fetchone()[0]
+    conn.execute(
+        "INSERT OR REPLACE INTO estado (tabela, ultimo_id, assinatura) VALUES (?, ?, ?)",
+        (tabela, ultimo_id, _assinatura(conn, tabela, ultimo_id)),
+    )
+    return ultimo_id
+
+
+def _incorporar_vendas(conn, marca):
+    conn.execute(f"""
+        CREATE TEMP TABLE delta AS
+        SELECT id_cliente, data_venda, valor_total, {MES_SQL.format('data_venda')} AS mes
+        FROM src.Vendas
+        WHERE id_venda > ? AND id_cliente IS NOT NULL
+    """, (marca,))
+
+    # Coorte anterior dos clientes afetados, antes de atualizar a primeira compra
+    conn.execute(f"""
+        CREATE TEMP TABLE afetados AS
+        SELECT d.id_cliente,
+               MIN(d.data_venda) AS primeira_compra,
+               MAX(d.data_venda) AS ultima_compra,
+               COUNT(*) AS frequencia,
+               SUM(d.valor_total) AS valor_total,
+               {MES_SQL.format('c.primeira_compra')} AS coorte_anterior
+        FROM delta d
+        LEFT JOIN clientes c ON c.id_cliente = d.id_cliente
+        GROUP BY d.id_cliente
+    """)
+    conn.execute("""
+        INSERT INTO clientes (id_cliente, primeira_compra, ultima_compra, frequencia, valor_total)
+        SELECT id_cliente, primeira_compra, ultima_compra, frequencia, valor_total FROM afetados WHERE true
+        ON CONFLICT (id_cliente) DO UPDATE SET
+            primeira_compra = MIN(primeira_compra, excluded.primeira_compra),
+            ultima_compra = MAX(ultima_compra, excluded.ultima_compra),
+            frequencia = frequencia + excluded.frequencia,
+            valor_total = valor_total + excluded.valor_total
+    """)
+
+    # Clientes cuja coorte recuou (venda retroativa): toda a atividade deles muda de coorte
+    conn.execute(f"""
+        CREATE TEMP TABLE mudaram AS
+        SELECT a.id_cliente, a.coorte_anterior, {MES_SQL.format('c.primeira_compra')} AS coorte
+        FROM afetados a
+        JOIN clientes c ON c.id_cliente = a.id_cliente
+        WHERE a.coorte_anterior IS NOT NULL AND {MES_SQL.format('c.primeira_compra')} < a.coorte_anterior
+    """)
+    conn.execute("""
+        INSERT INTO coortes (coorte, periodo, clientes)
+        SELECT m.coorte_anterior, a.mes - m.coorte_anterior, -COUNT(*)
+        FROM atividade a
+        JOIN mudaram m ON m.id_cliente = a.id_cliente
+        GROUP BY 1, 2
+        ON CONFLICT (coorte, periodo) DO UPDATE SET clientes = clientes + excluded.clientes
+    """)
+
+    conn.execute("""
+        CREATE TEMP TABLE novos_pares AS
+        SELECT DISTINCT d.id_cliente, d.mes
+        FROM delta d
+        WHERE NOT EXISTS (SELECT 1 FROM atividade a WHERE a.id_cliente = d.id_cliente AND a.mes = d.mes)
+    """)
+    conn.execute("INSERT INTO atividade (id_cliente, mes) SELECT id_cliente, mes FROM novos_pares")
+
+    conn.execute(f"""
+        INSERT INTO coortes (coorte, periodo, clientes)
+        SELECT coorte, mes - coorte, COUNT(*)
+        FROM (
+            SELECT a.mes, m.coorte
+            FROM atividade a
+            JOIN mudaram m ON m.id_cliente = a.id_cliente
+            UNION ALL
+            SELECT n.mes, {MES_SQL.format('c.primeira_compra')}
+            FROM novos_pares n
+            JOIN clientes c ON c.id_cliente = n.id_cliente
+            WHERE n.id_cliente NOT IN (SELECT id_cliente FROM mudaram)
+        )
+        GROUP BY 1, 2
+        ON CONFLICT (coorte, periodo) DO UPDATE SET clientes = clientes + excluded.clientes
+    """)
+    conn.execute("DELETE FROM coortes WHERE clientes = 0")
+
+    for temporaria in ('delta', 'afetados', 'mudaram', 'novos_pares'):
+        conn.execute(f"DROP TABLE temp.{temporaria}")
+
+
+def _incorporar_interacoes(conn, marca):
+    conn.execute("""
+        INSERT INTO campanhas (id_campanha, interacoes, conversoes)
+        SELECT id_campanha, COUNT(*), SUM(tipo_interacao = 'Conversão')
+        FROM src.Interacoes_Marketing
+        WHERE id_interacao > ? AND id_campanha IS NOT NULL
+        GROUP BY id_campanha
+        ON CONFLICT (id_campanha) DO UPDATE SET
+            interacoes = interacoes + excluded.interacoes,
+            conversoes = conversoes + excluded.conversoes
+    """, (marca,))
+
+
+def _reiniciar(conn, tabela):
+    limpar = {
+        'Vendas': ['clientes', 'atividade', 'coortes'],
+        'Interacoes_Marketing': ['campanhas'],
+    }
+    for agregado in limpar[tabela]:
+        conn.execute(f"DELETE FROM {agregado}")
+    conn.execute("DELETE FROM estado WHERE tabela = ?", (tabela,))
+
+
+@instrumentacao.medir()
+def atualizar(db_path):
+    # Incorpora as linhas novas e devolve quantas foram processadas por tabela
+    processadas = {}
+    with closing(_conectar(db_path)) as conn:
+        with conn:
+            for tabela, incorporar in (('Vendas', _incorporar_vendas),
+                                       ('Interacoes_Marketing', _incorporar_interacoes)):
+                marca = _marca(conn, tabela)
+                if marca is None:
+                    _reiniciar(conn, tabela)
+                    marca = 0
+                incorporar(conn, marca)
+                novo = _registrar_marca(conn, tabela, marca)
+                processadas[tabela] = novo - marca
+    return processadas
+
+
+def _consultar(agregados, sql, params=()):
+    with closing(_conectar(agregados.db_path)) as conn:
+        return pd.read_sql_query(sql, conn, params=params)
+
+
+def contagens(agregados):
+    return analises_sql.contagens(agregados.db_path)
+
+
+def amostra(agregados, tabela, n=5):
+    return analises_sql.amostra(agregados.db_path, tabela, n)
+
+
+def receita_total(agregados):
+    return analises_sql.receita_total(agregados.db_path)
+
+
+def churn_clientes(agregados, dias_inatividade=90):
+    ultima_compra = _consultar(agregados, """
+        SELECT id_cliente,
+               ultima_compra,
+               CAST(julianday((SELECT MAX(ultima_compra) FROM clientes)) - julianday(ultima_compra) AS INTEGER) AS dias_sem_comprar
+        FROM clientes
+        ORDER BY id_cliente
+    """)
+    ultima_compra['ultima_compra'] = pd.to_datetime(ultima_compra['ultima_compra'])
+    return analises._status_churn(ultima_compra, dias_inatividade)
+
+
+def coortes(agregados):
+    return _consultar(agregados, "SELECT coorte, periodo, clientes FROM coortes ORDER BY coorte, periodo")
+
+
+def retencao_mensal(agregados):
+    return analises.retencao_de_coortes(coortes(agregados))
+
+
+def classificacao_clientes(agregados, segmentacao='legado'):
+    metricas_clientes = _consultar(agregados, """
+        SELECT id_cliente,
+               valor_total,
+               valor_total / frequencia AS ticket_medio,
+               frequencia,
+               primeira_compra,
+               ultima_compra,
+               CAST(julianday((SELECT MAX(ultima_compra) FROM clientes)) - julianday(ultima_compra) AS INTEGER) AS recencia
+        FROM clientes
+        ORDER BY id_cliente
+    """)
+    metricas_clientes['primeira_compra'] = pd.to_datetime(metricas_clientes['primeira_compra'])
+    metricas_clientes['ultima_compra'] = pd.to_datetime(metricas_clientes['ultima_compra'])
+    return rfm.segmentar(metricas_clientes, segmentacao)
+
+
+def atribuicao_campanhas(agregados, modelo='ultimo_toque', janela_dias=atribuicao.JANELA_DIAS,
+                         meia_vida_dias=atribuicao.MEIA_VIDA_DIAS):
+    # Depende da ordem das interações de cada cliente, não de um agregado somável
+    return analises_sql.atribuicao_campanhas(agregados.db_path, modelo, janela_dias, meia_vida_dias)
+
+
+def eficiencia_campanhas(agregados):
+    eficiencia = _consultar(agregados, """
+        SELECT a.id_campanha,
+               a.conversoes,
+               a.interacoes AS total_interacoes,
+               a.conversoes * 100.0 / a.interacoes AS taxa_conversao,
+               c.nome_campanha, c.canal_marketing, c.data_inicio, c.data_fim,
+               c.orcamento, c.custo
+        FROM campanhas a
+        JOIN src.Campanhas_Marketing c ON c.id_campanha = a.id_campanha
+        WHERE a.conversoes > 0
+        ORDER BY a.id_campanha
+    """)
+    eficiencia['data_inicio'] = pd.to_datetime(eficiencia['data_inicio'])
+    eficiencia['data_fim'] = pd.to_datetime(eficiencia['data_fim'])
+    return eficiencia
+
+
+if __name__ == "__main__":
+    import sys
+
+    # Uso: python incremental.py vendas_marketing.db (ex.: agendado a cada hora)
+    for banco in sys.argv[1:]:
+        print(banco, atualizar(banco))
@@ -0,0 +1,231 @@
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+from contextlib import closing
+from dataclasses import dataclass
+
+# Preparação de um banco enviado, feita uma vez por arquivo antes da primeira
+# carga: confere as cinco tabelas e colunas do esquema documentado e as datas,
+# acrescenta colunas com o dia em inteiro (dias desde 1970-01-01) ao lado das
+# datas em texto, mantidas por gatilhos nas inserções e atualizações feitas
+# depois (ex.: cargas horárias de vendas), cria índices de cobertura para as consultas das análises e do
+# console SQL, roda ANALYZE para o planejador escolher esses índices e passa o
+# arquivo para o modo WAL. Tudo roda numa única transação: se algo falhar, o
+# arquivo fica como estava. A versão da preparação fica em PRAGMA user_version,
+# então um banco já preparado é reconhecido sem reprocessar nada.
+#
+# As conexões de leitura (configurar_leitura) mapeiam o arquivo em memória
+# (SQLITE_MMAP_MB) e mantêm as tabelas temporárias dos GROUP BY em memória.
+#
+# Uso fora do dashboard:
+#   python ingestao.py vendas_marketing.db
+
+VERSAO = 2
+MMAP_BYTES = int(os.environ.get('SQLITE_MMAP_MB', 256)) * 1024 * 1024
+
+# Esquema documentado: tabela -> colunas obrigatórias
+ESQUEMA = {
+    'Clientes': ['id_cliente', 'nome', 'cidade', 'segmento'],
+    'Produtos': ['id_produto', 'nome_produto', 'categoria', 'preco_unitario', 'custo_unitario'],
+    'Campanhas_Marketing': ['id_campanha', 'nome_campanha', 'canal_marketing', 'data_inicio', 'data_fim',
+                            'orcamento', 'custo'],
+    'Interacoes_Marketing': ['id_interacao', 'id_cliente', 'id_campanha', 'data_interacao', 'tipo_interacao'],
+    'Vendas': ['id_venda', 'id_cliente', 'id_produto', 'id_campanha', 'data_venda', 'quantidade',
+               'valor_total', 'canal_aquisicao'],
+}
+
+DATAS = {
+    'Campanhas_Marketing': ['data_inicio', 'data_fim'],
+    'Interacoes_Marketing': ['data_interacao'],
+    'Vendas': ['data_venda'],
+}
+
+_DIA_JULIANO_1970 = 2440587.5
+DIA_SQL = "CAST(julianday({0}) - " + str(_DIA_JULIANO_1970) + " AS INTEGER)"
+
+# Colunas de dia acrescentadas: tabela -> (coluna nova, data de origem)
+DIAS = {
+    'Vendas': ('dia_venda', 'data_venda'),
+    'Interacoes_Marketing': ('dia_interacao', 'data_interacao'),
+}
+DERIVADAS = {coluna for coluna, _ in DIAS.values()}
+
+# Gatilhos que preenchem a coluna de dia de linhas inseridas ou com a data
+# alterada depois da preparação: evento -> quando o gatilho dispara
+GATILHOS = {
+    'insert': "AFTER INSERT ON {tabela}",
+    'update': "AFTER UPDATE OF {origem} ON {tabela}",
+}
+
+# Índices de cobertura: cada um contém todas as colunas lidas pelas consultas
+# que o usam, que então não precisam visitar a tabela
+INDICES = {
+    # churn, RFM, coortes e as faixas de clientes da atribuição
+    'idx_vendas_cliente_data': ('Vendas', ['id_cliente', 'data_venda', 'valor_total']),
+    # MAX(data_venda), vendas por canal no período e vendas mensais
+    'idx_vendas_data_canal': ('Vendas', ['data_venda', 'canal_aquisicao', 'valor_total']),
+    # top produtos e top produtos por mês
+    'idx_vendas_produto_data': ('Vendas', ['id_produto', 'data_venda', 'quantidade', 'valor_total']),
+    # eficiência de campanhas e engajamento por canal
+    'idx_interacoes_campanha_tipo': ('Interacoes_Marketing', ['id_campanha', 'tipo_interacao']),
+    # desempenho regional e as faixas de clientes da atribuição
+    'idx_interacoes_cliente_data': ('Interacoes_Marketing', ['id_cliente', 'data_interacao', 'id_campanha']),
+}
+
+
+class EsquemaInvalido(Exception):
+    def __init__(self, problemas):
+        super().__init__('; '.join(problemas))
+        self.problemas = problemas
+
+
+def configurar_leitura(conn):
+    conn.execute(f"PRAGMA mmap_size = {MMAP_BYTES}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    return conn
+
+
+def preparado(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0] >= VERSAO
+
+
+def dia(conn, tabela):
+    # Expressão SQL do dia em inteiro: a coluna já calculada, se o banco foi preparado
+    coluna, origem = DIAS[tabela]
+    return coluna if preparado(conn) else DIA_SQL.format(origem)
+
+
+def _colunas(conn, tabela):
+    return {linha[1].lower() for linha in conn.execute(f'PRAGMA table_info("{tabela}")')}
+
+
+def validar(conn):
+    # Lista de problemas encontrados (vazia se o banco segue o esquema)
+    try:
+        existentes = {nome.lower() for (nome,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    except sqlite3.DatabaseError:
+        return ["O arquivo não é um banco SQLite válido."]
+    problemas = []
+    for tabela, colunas in ESQUEMA.items():
+        if tabela.lower() not in existentes:
+            problemas.append(f"Tabela ausente: {tabela}")
+            continue
+        faltando = [c for c in colunas if c.lower() not in _colunas(conn, tabela)]
+        if faltando:
+            problemas.append(f"Colunas ausentes em {tabela}: {', '.join(faltando)}")
+    if problemas or preparado(conn):
+        return problemas
+    for tabela, datas in DATAS.items():
+        for coluna in datas:
+            invalidas = conn.execute(
+                f"SELECT COUNT(*) FROM {tabela} WHERE {coluna} IS NOT NULL AND julianday({coluna}) IS NULL"
+            ).fetchone()[0]
+            if invalidas:
+                problemas.append(f"{invalidas} valor(es) de {tabela}.{coluna} não são datas (use AAAA-MM-DD)")
+    return problemas
+
+
+def _etapas(conn):
+    # (descrição, SQL) de cada passo ainda não aplicado ao banco
+    etapas = []
+    for tabela, (coluna, origem) in DIAS.items():
+        if coluna not in _colunas(conn, tabela):
+            etapas.append((f"Adicionando {tabela}.{coluna}", f"ALTER TABLE {tabela} ADD COLUMN {coluna} INTEGER"))
+        etapas.append((f"Calculando {tabela}.{coluna}", f"UPDATE {tabela} SET {coluna} = {DIA_SQL.format(origem)}"))
+        for evento, quando in GATILHOS.items():
+            etapas.append((f"Criando gatilho de {tabela}.{coluna} ({evento})", f"""
+                CREATE TRIGGER IF NOT EXISTS {coluna}_{evento} {quando.format(tabela=tabela, origem=origem)}
+                BEGIN
+                    UPDATE {tabela} SET {coluna} = {DIA_SQL.format('NEW.' + origem)} WHERE rowid = NEW.rowid;
+                END"""))
+    for nome, (tabela, colunas) in INDICES.items():
+        etapas.append((f"Criando índice {nome}", f"CREATE INDEX IF NOT EXISTS {nome} ON {tabela} ({', '.join(colunas)})"))
+    etapas.append(("Atualizando estatísticas (ANALYZE)", "ANALYZE"))
+    etapas.append(("Registrando a versão", f"PRAGMA user_version = {VERSAO}"))
+    return etapas
+
+
+def preparar(db_path, progresso=None):
+    # progresso(fração, etapa) é chamado antes de cada passo
+    progresso = progresso or (lambda fracao, etapa: None)
+    with closing(sqlite3.connect(db_path, isolation_level=None)) as conn:
+        progresso(0.0, "Validando o esquema")
+        problemas = validar(conn)
+        if problemas:
+            raise EsquemaInvalido(problemas)
+        if preparado(conn):
+            return False
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Com a trava de escrita: outro processo pode ter preparado o banco
+            # (ou parte dele) enquanto esperávamos por ela
+            etapas = [] if preparado(conn) else _etapas(conn)
+            for i, (etapa, sql) in enumerate(etapas):
+                progresso((i + 1) / (len(etapas) + 2), etapa)
+                conn.execute(sql)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if not etapas:
+            return False
+        # WAL: leituras não bloqueiam nem são bloqueadas por escritas (ex.: agregados incrementais)
+        progresso((len(etapas) + 1) / (len(etapas) + 2), "Ativando o modo WAL")
+        conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    progresso(1.0, "Banco preparado")
+    return True
+
+
+@dataclass
+class Estado:
+    fracao: float = 0.0
+    etapa: str = "Na fila"
+    concluida: bool = False
+    erro: Exception = None
+
+
+_estados = {}
+_trava = threading.Lock()
+
+
+def _executar(db_path, estado):
+    def progresso(fracao, etapa):
+        estado.fracao, estado.etapa = fracao, etapa
+    try:
+        preparar(db_path, progresso)
+    except Exception as e:
+        estado.erro = e
+    finally:
+        estado.concluida = True
+
+
+def iniciar(db_path):
+    # Prepara o banco em segundo plano, uma vez por arquivo; sessões que enviarem
+    # o mesmo arquivo acompanham o mesmo Estado. Uma preparação que falhou é
+    # refeita na próxima chamada (a sessão que a acompanhava já recebeu o erro)
+    with _trava:
+        estado = _estados.get(db_path)
+        if estado is None or estado.erro is not None:
+            estado = _estados[db_path] = Estado()
+            threading.Thread(target=_executar, args=(db_path, estado), daemon=True,
+                             name=f'ingestao-{os.path.basename(db_path)}').start()
+        return estado
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Valida o banco e cria índices, colunas de dia e estatísticas")
+    parser.add_argument('banco')
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    try:
+        alterado = preparar(args.banco, lambda fracao, etapa: print(f"{fracao:>4.0%} {etapa}", file=sys.stderr))
+    except EsquemaInvalido as e:
+        print("Esquema inválido:\n" + "\n".join(f"  - {p}" for p in e.problemas), file=sys.stderr)
+        sys.exit(1)
+    situacao = "preparado" if alterado else "já estava preparado"
+    print(f"Banco {situacao} em {time.perf_counter() - inicio:.1f} s", file=sys.stderr)
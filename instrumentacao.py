@@ -0,0 +1,195 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections.abc import Mapping
+from contextlib import contextmanager
+from dataclasses import fields, is_dataclass
+
+# Instrumentação das etapas de uma renderização (carga, normalização, análises,
+# construção de figuras, serialização de tabelas e gráficos). Fica desligada por
+# padrão: sem uma medição em andamento, as funções instrumentadas só consultam
+# uma ContextVar e chamam a original. Cada rerun do Streamlit roda na própria
+# thread, então as medições de sessões simultâneas não se misturam. Ao encerrar,
+# as etapas vão para o painel "Performance" e para o logger 'desempenho', uma
+# linha JSON por etapa.
+#
+# A memória (tracemalloc) é a exceção: o rastreamento e o pico são do processo.
+# As sessões que medem memória são contadas, e o rastreamento só para quando a
+# última termina. Como o pico é um só, uma etapa que correu junto com a medição
+# de outra sessão fica sem memoria_mb em vez de mostrar o pico alheio.
+
+PADRAO = os.environ.get('INSTRUMENTACAO', '0') == '1'
+MEMORIA = os.environ.get('INSTRUMENTACAO_MEMORIA', '0') == '1'
+ARQUIVO_LOG = os.environ.get('INSTRUMENTACAO_LOG')
+
+logger = logging.getLogger('desempenho')
+if ARQUIVO_LOG:
+    _saida = logging.StreamHandler(sys.stderr) if ARQUIVO_LOG == '-' else logging.FileHandler(ARQUIVO_LOG)
+    _saida.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(_saida)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+_MB = 1024 * 1024
+
+_medicao = contextvars.ContextVar('medicao', default=None)
+
+_trava_memoria = threading.Lock()
+_medindo_memoria = 0
+_iniciou_tracemalloc = False
+# Quantas medições de memória já começaram com outra em andamento; uma etapa
+# que vê este número mudar (ou começa sem estar sozinha) não tem pico próprio
+_sobreposicoes = 0
+
+
+class _Medicao:
+    def __init__(self, sessao, memoria):
+        self.sessao = sessao
+        self.memoria = memoria
+        self.inicio = time.perf_counter()
+        self.etapas = []
+        self.pilha = []
+
+
+def _entrar_memoria():
+    global _medindo_memoria, _iniciou_tracemalloc, _sobreposicoes
+    with _trava_memoria:
+        if _medindo_memoria == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _iniciou_tracemalloc = True
+        _medindo_memoria += 1
+        if _medindo_memoria > 1:
+            _sobreposicoes += 1
+
+
+def _sair_memoria():
+    global _medindo_memoria, _iniciou_tracemalloc
+    with _trava_memoria:
+        _medindo_memoria -= 1
+        if _medindo_memoria == 0 and _iniciou_tracemalloc:
+            tracemalloc.stop()
+            _iniciou_tracemalloc = False
+
+
+def iniciar(sessao=None, memoria=MEMORIA):
+    medicao = _Medicao(sessao, memoria)
+    if memoria:
+        _entrar_memoria()
+    _medicao.set(medicao)
+    return medicao
+
+
+def encerrar():
+    # Devolve as etapas medidas no rerun atual (ou None se a medição estava desligada)
+    medicao = _medicao.get()
+    if medicao is None:
+        return None
+    _medicao.set(None)
+    if medicao.memoria:
+        _sair_memoria()
+    total_ms = (time.perf_counter() - medicao.inicio) * 1000
+    if logger.isEnabledFor(logging.INFO):
+        momento = time.time()
+        for registro in medicao.etapas:
+            logger.info(json.dumps({'ts': momento, 'sessao': medicao.sessao, 'total_ms': round(total_ms, 2), **registro},
+                                   ensure_ascii=False))
+    return medicao.etapas
+
+
+def ativa():
+    return _medicao.get() is not None
+
+
+def contar_linhas(valor):
+    # Linhas do resultado de uma etapa: DataFrame/Series/array, a primeira tabela
+    # de uma tupla (figura, tabela, ...) ou a soma das tabelas de um dicionário/dataclass
+    forma = getattr(valor, 'shape', None)
+    if isinstance(forma, tuple) and forma:
+        return int(forma[0])
+    if isinstance(valor, tuple):
+        for item in valor:
+            linhas = contar_linhas(item)
+            if linhas is not None:
+                return linhas
+        return None
+    if isinstance(valor, Mapping) or is_dataclass(valor):
+        itens = valor.values() if isinstance(valor, Mapping) else [getattr(valor, c.name) for c in fields(valor)]
+        contagens = [c for c in (contar_linhas(v) for v in itens) if c is not None]
+        return sum(contagens) if contagens else None
+    return None
+
+
+@contextmanager
+def etapa(nome, linhas=None):
+    medicao = _medicao.get()
+    if medicao is None:
+        yield {}
+        return
+    registro = {'etapa': nome, 'nivel': len(medicao.pilha), 'linhas': linhas}
+    medicao.etapas.append(registro)
+    quadro = {'pico': 0}
+    if medicao.memoria:
+        with _trava_memoria:
+            sozinha = _medindo_memoria == 1
+            quadro['sobreposicoes'] = _sobreposicoes if sozinha else None
+            atual, pico = tracemalloc.get_traced_memory()
+            if sozinha:
+                tracemalloc.reset_peak()
+        if medicao.pilha:
+            medicao.pilha[-1]['pico'] = max(medicao.pilha[-1]['pico'], pico)
+        quadro['base'] = atual
+    medicao.pilha.append(quadro)
+    inicio = time.perf_counter()
+    registro['inicio_ms'] = round((inicio - medicao.inicio) * 1000, 2)
+    try:
+        yield registro
+    finally:
+        registro['duracao_ms'] = round((time.perf_counter() - inicio) * 1000, 2)
+        medicao.pilha.pop()
+        if medicao.memoria:
+            # O pico de cada etapa inclui o das etapas internas (reset_peak é global)
+            with _trava_memoria:
+                pico = max(quadro['pico'], tracemalloc.get_traced_memory()[1])
+                propria = quadro['sobreposicoes'] == _sobreposicoes and _medindo_memoria == 1
+            registro['memoria_mb'] = round((pico - quadro['base']) / _MB, 2) if propria else None
+            if medicao.pilha:
+                medicao.pilha[-1]['pico'] = max(medicao.pilha[-1]['pico'], pico)
+
+
+def medir(nome=None):
+    def decorar(funcao):
+        modulo = 'app' if funcao.__module__ == '__main__' else funcao.__module__
+        rotulo = nome or f"{modulo}.{funcao.__qualname__}"
+
+        @functools.wraps(funcao)
+        def medida(*args, **kwargs):
+            if _medicao.get() is None:
+                return funcao(*args, **kwargs)
+            with etapa(rotulo) as registro:
+                resultado = funcao(*args, **kwargs)
+                registro['linhas'] = contar_linhas(resultado)
+                return resultado
+        return medida
+    return decorar
+
+
+class _ModuloMedido:
+    def __init__(self, modulo):
+        self._modulo = modulo
+
+    def __getattr__(self, nome):
+        valor = getattr(self._modulo, nome)
+        if callable(valor):
+            return medir(f"{self._modulo.__name__}.{nome}")(valor)
+        return valor
+
+
+def modulo(mod):
+    # Motor de análises com cada função medida, só enquanto houver medição em andamento
+    return mod if _medicao.get() is None else _ModuloMedido(mod)
@@ -0,0 +1,179 @@
+import os
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # sem pyarrow o download fica só em CSV
+    pa = pq = None
+
+# Tabelas paginadas: o DataFrame fica no servidor e só a página visível vai
+# para o navegador. Ordenação e filtro também rodam aqui, sobre índices
+# guardados por coluna: a ordem de cada coluna (argsort estável, nulos no fim)
+# é calculada uma vez por resultado e reaproveitada nos reruns, filtros de
+# intervalo são buscas binárias nessa ordem e filtros de texto comparam só os
+# valores distintos (pd.factorize). O download do resultado completo é gravado
+# em lotes num arquivo temporário, sem montar o CSV/Parquet inteiro em memória.
+#
+# Filtro: "texto" mantém as linhas cujo valor contém o texto (sem diferenciar
+# maiúsculas); "min:max" mantém um intervalo fechado (um dos lados pode ficar
+# vazio), comparando números, datas ou texto conforme o tipo da coluna.
+
+TAMANHO_PAGINA = int(os.environ.get('TABELA_TAMANHO_PAGINA', 50))
+TAMANHO_LOTE = int(os.environ.get('TABELA_TAMANHO_LOTE', 50_000))
+SELECOES_EM_CACHE = 8
+
+
+def parquet_disponivel():
+    return pq is not None
+
+
+def intervalo(texto):
+    # "min:max" -> (min, max) com None nos lados vazios; outro texto -> None
+    if ':' not in texto:
+        return None
+    minimo, maximo = (parte.strip() or None for parte in texto.split(':', 1))
+    return minimo, maximo
+
+
+def _converter(valor, serie):
+    if valor is None:
+        return None
+    if pd.api.types.is_datetime64_any_dtype(serie):
+        return pd.Timestamp(valor).to_datetime64()
+    if pd.api.types.is_numeric_dtype(serie) and not pd.api.types.is_bool_dtype(serie):
+        return float(valor)
+    return valor
+
+
+class Visao:
+    def __init__(self, df):
+        # Referência fraca: a Visao fica no registro do módulo e não pode manter
+        # vivo o resultado que o cache já descartou
+        self._df = weakref.ref(df)
+        self._ordens = {}
+        self._distintos = {}
+        self._selecoes = OrderedDict()
+        self._trava = threading.Lock()
+
+    @property
+    def df(self):
+        return self._df()
+
+    def _chave(self, coluna):
+        # Categorias ordenam pelo texto, como no filtro de intervalo
+        serie = self.df[coluna].reset_index(drop=True)
+        return serie.astype(object) if isinstance(serie.dtype, pd.CategoricalDtype) else serie
+
+    def ordem(self, coluna):
+        # (posições em ordem crescente, quantas têm valor); os nulos vêm depois
+        if coluna not in self._ordens:
+            serie = self._chave(coluna)
+            try:
+                ordem = serie.sort_values(kind='stable', na_position='last').index.to_numpy()
+            except TypeError:
+                ordem = serie.astype(str).where(serie.notna()).sort_values(kind='stable', na_position='last').index.to_numpy()
+            self._ordens[coluna] = (ordem, int(serie.notna().sum()))
+        return self._ordens[coluna]
+
+    def _filtrar(self, coluna, texto):
+        # Máscara booleana das linhas que passam no filtro
+        manter = np.zeros(len(self.df), dtype=bool)
+        limites = intervalo(texto)
+        if limites is not None:
+            ordem, validos = self.ordem(coluna)
+            serie = self._chave(coluna)
+            ordenados = serie.to_numpy()[ordem[:validos]]
+            minimo, maximo = (_converter(v, serie) for v in limites)
+            inicio = 0 if minimo is None else np.searchsorted(ordenados, minimo, side='left')
+            fim = validos if maximo is None else np.searchsorted(ordenados, maximo, side='right')
+            manter[ordem[inicio:fim]] = True
+            return manter
+        if coluna not in self._distintos:
+            self._distintos[coluna] = pd.factorize(self.df[coluna], use_na_sentinel=True)
+        codigos, distintos = self._distintos[coluna]
+        casam = pd.Index(distintos).astype(str).str.contains(texto, case=False, regex=False)
+        casam = np.append(np.asarray(casam, dtype=bool), False)
+        return casam[codigos]
+
+    def selecao(self, ordenar=None, decrescente=False, coluna_filtro=None, texto=''):
+        # Posições das linhas selecionadas, já na ordem pedida
+        chave = (ordenar, decrescente, coluna_filtro if texto else None, texto)
+        with self._trava:
+            if chave in self._selecoes:
+                self._selecoes.move_to_end(chave)
+                return self._selecoes[chave]
+            if ordenar is None:
+                posicoes = np.arange(len(self.df))
+            else:
+                ordem, validos = self.ordem(ordenar)
+                posicoes = np.concatenate((ordem[:validos][::-1], ordem[validos:])) if decrescente else ordem
+            if coluna_filtro and texto:
+                posicoes = posicoes[self._filtrar(coluna_filtro, texto)[posicoes]]
+            self._selecoes[chave] = posicoes
+            while len(self._selecoes) > SELECOES_EM_CACHE:
+                self._selecoes.popitem(last=False)
+            return posicoes
+
+    def total(self, *selecao):
+        return len(self.selecao(*selecao))
+
+    def pagina(self, numero, tamanho=TAMANHO_PAGINA, *selecao):
+        posicoes = self.selecao(*selecao)
+        return self.df.iloc[posicoes[numero * tamanho:(numero + 1) * tamanho]]
+
+    def lotes(self, *selecao, tamanho=TAMANHO_LOTE):
+        posicoes = self.selecao(*selecao)
+        for inicio in range(0, max(len(posicoes), 1), tamanho):
+            yield self.df.iloc[posicoes[inicio:inicio + tamanho]]
+
+
+_visoes = {}
+_trava_visoes = threading.Lock()
+
+
+def visao(df):
+    # Uma Visao por DataFrame (os resultados vêm do cache e são os mesmos objetos
+    # entre reruns); ela some junto com o DataFrame
+    with _trava_visoes:
+        registro = _visoes.get(id(df))
+        if registro is not None and registro[0]() is df:
+            return registro[1]
+        nova = Visao(df)
+        _visoes[id(df)] = (weakref.ref(df), nova)
+        weakref.finalize(df, _visoes.pop, id(df), None)
+        return nova
+
+
+def gravar_csv(lotes, destino):
+    for i, lote in enumerate(lotes):
+        lote.to_csv(destino, index=False, header=i == 0, mode='wb', encoding='utf-8')
+
+
+def gravar_parquet(lotes, destino):
+    # O esquema vem do primeiro lote; colunas ainda sem valores viram texto
+    escritor = None
+    try:
+        for lote in lotes:
+            if escritor is None:
+                esquema = pa.Schema.from_pandas(lote, preserve_index=False)
+                esquema = pa.schema([c.with_type(pa.string()) if pa.types.is_null(c.type) else c for c in esquema])
+                escritor = pq.ParquetWriter(destino, esquema)
+            escritor.write_table(pa.Table.from_pandas(lote, schema=esquema, preserve_index=False))
+    finally:
+        if escritor is not None:
+            escritor.close()
+
+
+def arquivo(lotes, formato):
+    # Arquivo temporário (apagado ao ser fechado) pronto para o st.download_button
+    destino = tempfile.TemporaryFile()
+    (gravar_parquet if formato == 'parquet' else gravar_csv)(lotes, destino)
+    destino.seek(0)
+    return destino
@@ -0,0 +1,134 @@
+import argparse
+import sys
+import warnings
+
+import numpy as np
+import pandas as pd
+
+import analises
+import analises_polars
+import analises_sql
+import cubo
+import incremental
+import streaming
+import tabelas
+
+# Paridade dos motores: roda cada análise em cada motor e compara com o motor
+# de referência (analises.py, pandas em memória) sobre as mesmas tabelas.
+# Resultados são comparados coluna a coluna e linha a linha, na ordem de saída;
+# categorias são comparadas pelo texto e números com tolerância relativa de
+# 1e-9 (somas em paralelo acumulam em outra ordem). Análises que um motor não
+# implementa (ex.: coortes no cubo) ficam de fora. Termina com código de
+# saída 1 se algum motor divergir.
+#
+# Uso:
+#   python paridade.py vendas_marketing.db
+#   python paridade.py benchmarks/dados/vendas_100000_s42.db --motores polars sql
+
+TOLERANCIA = 1e-9
+
+# (função dos motores, argumentos)
+ANALISES = [
+    ('contagens', ()),
+    ('receita_total', ()),
+    ('vendas_por_canal', ()),
+    ('top_produtos', ()),
+    ('ticket_medio_segmento', ()),
+    ('vendas_mensais', ()),
+    ('eficiencia_campanhas', ()),
+    ('engajamento_canais', ()),
+    ('vendas_top_produtos_mensais', ()),
+    ('desempenho_regional', ()),
+    ('churn_clientes', ()),
+    ('coortes', ()),
+    ('retencao_mensal', ()),
+    ('classificacao_clientes', ('legado',)),
+    ('classificacao_clientes', ('rfm',)),
+] + [('atribuicao_campanhas', (modelo,)) for modelo in ('ultimo_toque', 'primeiro_toque', 'linear', 'decaimento')]
+
+
+def _agregados(db_path):
+    incremental.atualizar(db_path)
+    return incremental.Agregados(db_path)
+
+
+# Motor -> (módulo, fonte a partir do banco e das tabelas de referência)
+MOTORES = {
+    'polars': (analises_polars, lambda db_path, tables: analises_polars.de_tabelas(tables)),
+    'sql': (analises_sql, lambda db_path, tables: db_path),
+    'cubo': (cubo, lambda db_path, tables: cubo.construir(tables)),
+    'incremental': (incremental, lambda db_path, tables: _agregados(db_path)),
+    'streaming': (streaming, lambda db_path, tables: streaming.Fluxo(db_path)),
+}
+
+
+# O cubo só guarda os fatos agregados: as contagens dele não são das tabelas de origem
+IGNORADAS = {'cubo': {'contagens'}}
+
+
+def disponiveis():
+    return [nome for nome in MOTORES if nome != 'polars' or analises_polars.disponivel()]
+
+
+def _normalizar(df):
+    df = df.reset_index(drop=True)
+    for coluna in df.columns:
+        serie = df[coluna]
+        if isinstance(serie.dtype, pd.CategoricalDtype) or pd.api.types.is_string_dtype(serie):
+            df[coluna] = serie.astype(object).where(serie.notna(), None).astype(str)
+        elif pd.api.types.is_datetime64_any_dtype(serie):
+            df[coluna] = serie.astype('datetime64[ns]')
+    return df
+
+
+def diferenca(obtido, esperado):
+    # Descrição da primeira divergência, ou None se os resultados batem
+    if isinstance(esperado, tuple):
+        for parte_obtida, parte_esperada in zip(obtido, esperado):
+            if (erro := diferenca(parte_obtida, parte_esperada)) is not None:
+                return erro
+        return None
+    if isinstance(esperado, dict):
+        return None if obtido == esperado else f"{obtido} != {esperado}"
+    if not isinstance(esperado, pd.DataFrame):
+        return None if np.isclose(obtido, esperado, rtol=TOLERANCIA, atol=0) else f"{obtido} != {esperado}"
+    faltando = [c for c in esperado.columns if c not in obtido.columns]
+    if faltando:
+        return f"colunas ausentes: {faltando}"
+    try:
+        pd.testing.assert_frame_equal(_normalizar(obtido[esperado.columns]), _normalizar(esperado),
+                                      check_dtype=False, check_exact=False, rtol=TOLERANCIA)
+    except AssertionError as e:
+        return ' '.join(str(e).split())[:300]
+    return None
+
+
+def verificar(db_path, motores):
+    tables = tabelas.carregar_tabelas(db_path, usar_snapshot=False)
+    esperados = {(nome, args): getattr(analises, nome)(tables, *args) for nome, args in ANALISES}
+    divergencias = 0
+    for motor in motores:
+        modulo, preparar = MOTORES[motor]
+        fonte = preparar(db_path, tables)
+        for nome, args in ANALISES:
+            if not hasattr(modulo, nome) or nome in IGNORADAS.get(motor, ()):
+                continue
+            erro = diferenca(getattr(modulo, nome)(fonte, *args), esperados[(nome, args)])
+            rotulo = f"{nome}({', '.join(map(repr, args))})"
+            print(f"{motor:<12} {rotulo:<42} {'ok' if erro is None else 'DIVERGE: ' + erro}")
+            divergencias += erro is not None
+    return divergencias
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Confere se os motores de análise dão os mesmos resultados do pandas")
+    parser.add_argument('banco', nargs='?', default='vendas_marketing.db')
+    parser.add_argument('--motores', nargs='+', choices=list(MOTORES), default=disponiveis())
+    args = parser.parse_args()
+
+    warnings.filterwarnings('ignore', category=UserWarning)
+    divergencias = verificar(args.banco, args.motores)
+    if divergencias:
+        print(f"\n{divergencias} análise(s) divergente(s) do motor de referência.")
+        sys.exit(1)
+    print("\nTodos os motores conferem com o motor de referência.")
@@ -0,0 +1,266 @@
+import argparse
+import multiprocessing
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+
+import analises_sql
+import ingestao
+
+# Probabilidade de churn de cada cliente pelo modelo BG/NBD (Fader, Hardie e
+# Lee, 2005): enquanto ativo, o cliente compra num processo de Poisson de taxa
+# própria (gama(r, alfa) entre clientes) e, após cada compra, abandona com
+# probabilidade própria (beta(a, b)). Com x compras repetidas (dias distintos
+# com compra, menos o primeiro), t_x dias entre a primeira e a última e T dias
+# entre a primeira e a última venda do banco, a probabilidade de o cliente
+# ainda estar ativo é
+#   P(ativo) = 1 / (1 + [x > 0] * a / (b + x - 1) * ((alfa + T) / (alfa + t_x))^(r + x))
+#
+# As estatísticas por cliente saem de GROUP BY no SQLite por faixas de
+# id_cliente, em paralelo num pool de processos (CHURN_PROCESSOS). Os quatro
+# parâmetros são ajustados por máxima verossimilhança (Nelder-Mead sobre o log
+# dos parâmetros) agrupando clientes com o mesmo (x, t_x, T), e a pontuação é
+# vetorizada e gravada em lotes. Clientes de Clientes sem nenhuma compra entram
+# com 0 compras e sem probabilidade, já que o modelo parte da primeira compra.
+#
+# O resultado vai para duas tabelas no próprio banco: Pontuacao_Churn (uma
+# linha por cliente) e Modelo_Churn (parâmetros e a marca da última venda
+# considerada). O dashboard e os relatórios leem as pontuações prontas e só as
+# consideram enquanto nenhuma venda nova tiver entrado no banco.
+#
+# Uso (ex.: depois de cada carga noturna):
+#   python pontuacao_churn.py vendas_marketing.db --processos 4
+
+PROCESSOS = int(os.environ.get('CHURN_PROCESSOS', os.cpu_count() or 1))
+CLIENTES_POR_PARTE = int(os.environ.get('CHURN_CLIENTES_POR_PARTE', 50_000))
+LOTE_GRAVACAO = 100_000
+
+TABELA = 'Pontuacao_Churn'
+TABELA_MODELO = 'Modelo_Churn'
+PARAMETROS = ('r', 'alfa', 'a', 'b')
+
+_MEIO_LOG_2PI = 0.5 * np.log(2 * np.pi)
+
+
+def _lgamma(z):
+    # ln Γ(z) vetorizado para z > 0: recorrência até z >= 8 e série de Stirling
+    z = np.asarray(z, dtype=np.float64)
+    deslocamento = np.zeros_like(z)
+    for i in range(8):
+        deslocamento += np.log(z + i)
+    w = z + 8
+    inverso = 1 / (w * w)
+    serie = (1 / 12 - inverso * (1 / 360 - inverso * (1 / 1260 - inverso / 1680))) / w
+    return (w - 0.5) * np.log(w) - w + _MEIO_LOG_2PI + serie - deslocamento
+
+
+def log_verossimilhanca(parametros, x, t_x, T, pesos, distintos=None):
+    # distintos: (valores distintos de x, índice de cada x neles), se já calculados.
+    # Os termos com Γ só dependem de x, que tem poucos valores distintos
+    r, alfa, a, b = parametros
+    valores_x, indice_x = distintos if distintos is not None else np.unique(x, return_inverse=True)
+    termos_x = (_lgamma(r + valores_x) - _lgamma(r) + r * np.log(alfa)
+                + _lgamma(a + b) + _lgamma(b + valores_x) - _lgamma(b) - _lgamma(a + b + valores_x))
+    parte_3 = -(r + x) * np.log(alfa + T)
+    repetiu = x > 0
+    parte_4 = np.full(len(x), -np.inf)
+    parte_4[repetiu] = (np.log(a) - np.log(b + x[repetiu] - 1)
+                        - (r + x[repetiu]) * np.log(alfa + t_x[repetiu]))
+    return np.sum(pesos * (termos_x[indice_x] + np.logaddexp(parte_3, parte_4)))
+
+
+def _nelder_mead(f, inicio, passo=0.5, tolerancia=1e-10, iteracoes=5000):
+    simplex = np.vstack([inicio, inicio + passo * np.eye(len(inicio))])
+    valores = np.array([f(p) for p in simplex])
+    for _ in range(iteracoes):
+        ordem = np.argsort(valores)
+        simplex, valores = simplex[ordem], valores[ordem]
+        if valores[-1] - valores[0] <= tolerancia * (1 + abs(valores[0])) and np.ptp(simplex, axis=0).max() <= 1e-8:
+            break
+        centro = simplex[:-1].mean(axis=0)
+        refletido = 2 * centro - simplex[-1]
+        f_refletido = f(refletido)
+        if f_refletido < valores[0]:
+            expandido = 3 * centro - 2 * simplex[-1]
+            f_expandido = f(expandido)
+            simplex[-1], valores[-1] = (expandido, f_expandido) if f_expandido < f_refletido else (refletido, f_refletido)
+        elif f_refletido < valores[-2]:
+            simplex[-1], valores[-1] = refletido, f_refletido
+        else:
+            contraido = (centro + simplex[-1]) / 2
+            f_contraido = f(contraido)
+            if f_contraido < valores[-1]:
+                simplex[-1], valores[-1] = contraido, f_contraido
+            else:
+                simplex[1:] = (simplex[0] + simplex[1:]) / 2
+                valores[1:] = [f(p) for p in simplex[1:]]
+    melhor = np.argmin(valores)
+    return simplex[melhor], valores[melhor]
+
+
+def ajustar(x, t_x, T):
+    # Parâmetros de máxima verossimilhança; clientes com o mesmo (x, t_x, T) contam uma vez, com peso
+    unicos, pesos = np.unique(np.column_stack([x, t_x, T]).astype(np.float64), axis=0, return_counts=True)
+    x, t_x, T = unicos.T
+    distintos = np.unique(x, return_inverse=True)
+
+    def custo(log_parametros):
+        valor = -log_verossimilhanca(np.exp(log_parametros), x, t_x, T, pesos, distintos)
+        return valor if np.isfinite(valor) else np.inf
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        log_parametros, custo_final = _nelder_mead(custo, np.zeros(4))
+    return {**dict(zip(PARAMETROS, np.exp(log_parametros))), 'log_verossimilhanca': -custo_final}
+
+
+def probabilidade_ativo(modelo, x, t_x, T):
+    r, alfa, a, b = (modelo[p] for p in PARAMETROS)
+    x, t_x, T = (np.asarray(v, dtype=np.float64) for v in (x, t_x, T))
+    repetiu = x > 0
+    log_razao = np.full(len(x), -np.inf)
+    log_razao[repetiu] = (np.log(a) - np.log(b + x[repetiu] - 1)
+                          + (r + x[repetiu]) * (np.log(alfa + T[repetiu]) - np.log(alfa + t_x[repetiu])))
+    with np.errstate(over='ignore'):
+        return 1 / (1 + np.exp(log_razao))
+
+
+def _estatisticas(db_path, de, ate):
+    # (id_cliente, dias com compra, primeiro dia, último dia) dos clientes com id em [de, ate].
+    # O dia sai de data_venda, que está no índice de cobertura por cliente
+    dia = ingestao.DIA_SQL.format('data_venda')
+    with closing(analises_sql.conectar(db_path)) as conn:
+        linhas = conn.execute(f"""
+            SELECT id_cliente, COUNT(DISTINCT {dia}), MIN({dia}), MAX({dia})
+            FROM Vendas WHERE id_cliente BETWEEN ? AND ? AND data_venda IS NOT NULL
+            GROUP BY id_cliente
+        """, (de, ate)).fetchall()
+    return np.array(linhas, dtype=np.int64).reshape(-1, 4)
+
+
+def estatisticas(db_path, processos=PROCESSOS):
+    with closing(analises_sql.conectar(db_path)) as conn:
+        menor, maior = conn.execute("SELECT MIN(id_cliente), MAX(id_cliente) FROM Vendas").fetchone()
+        preparado = ingestao.preparado(conn)
+    if menor is None:
+        return np.empty((0, 4), dtype=np.int64)
+    faixas = [(de, min(de + CLIENTES_POR_PARTE - 1, maior)) for de in range(menor, maior + 1, CLIENTES_POR_PARTE)]
+    if not preparado:
+        # Sem o índice por cliente cada faixa leria a tabela inteira
+        faixas = [(menor, maior)]
+    if processos <= 1 or len(faixas) == 1:
+        partes = [_estatisticas(db_path, de, ate) for de, ate in faixas]
+    else:
+        contexto = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=min(processos, len(faixas)), mp_context=contexto) as pool:
+            partes = list(pool.map(_estatisticas, *zip(*[(db_path, de, ate) for de, ate in faixas])))
+    return np.concatenate(partes)
+
+
+def _marca(conn):
+    # Última venda considerada: se mudar, as pontuações gravadas estão desatualizadas
+    return tuple(conn.execute("SELECT COUNT(*), MAX(id_venda) FROM Vendas").fetchone())
+
+
+def _datas(dias):
+    return pd.to_datetime(dias, unit='D').strftime('%Y-%m-%d')
+
+
+def pontuar_banco(db_path, processos=PROCESSOS, progresso=None):
+    # Ajusta o modelo, pontua todos os clientes e grava as duas tabelas; devolve o modelo
+    progresso = progresso or (lambda fracao, etapa: None)
+    progresso(0.0, "Estatísticas de compra por cliente")
+    compras = estatisticas(db_path, processos)
+    with closing(analises_sql.conectar(db_path)) as conn:
+        clientes = np.array([c for (c,) in conn.execute("SELECT id_cliente FROM Clientes")], dtype=np.int64)
+        vendas, ultimo_id = _marca(conn)
+    referencia = int(compras[:, 3].max()) if len(compras) else 0
+    ids, dias_com_compra, primeiro, ultimo = compras.T
+    x, t_x, T = dias_com_compra - 1, ultimo - primeiro, referencia - primeiro
+
+    progresso(0.4, "Ajustando o modelo BG/NBD")
+    modelo = ajustar(x, t_x, T) if len(compras) else dict.fromkeys(PARAMETROS + ('log_verossimilhanca',), np.nan)
+    modelo.update(clientes=len(compras), data_referencia=_datas([referencia])[0], vendas=vendas,
+                  ultimo_id_venda=ultimo_id, calculado_em=pd.Timestamp.now().isoformat(timespec='seconds'))
+
+    progresso(0.6, "Gravando as pontuações")
+    sem_compra = np.setdiff1d(clientes, ids)
+    with closing(sqlite3.connect(db_path, isolation_level=None)) as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(f"DROP TABLE IF EXISTS {TABELA}")
+            conn.execute(f"""
+                CREATE TABLE {TABELA} (
+                    id_cliente INTEGER PRIMARY KEY,
+                    compras INTEGER,
+                    primeira_compra TEXT,
+                    ultima_compra TEXT,
+                    dias_sem_comprar INTEGER,
+                    prob_ativo REAL,
+                    prob_churn REAL
+                )""")
+            for inicio in range(0, len(ids), LOTE_GRAVACAO):
+                parte = slice(inicio, inicio + LOTE_GRAVACAO)
+                ativo = probabilidade_ativo(modelo, x[parte], t_x[parte], T[parte])
+                conn.executemany(f"INSERT INTO {TABELA} VALUES (?, ?, ?, ?, ?, ?, ?)", zip(
+                    ids[parte].tolist(), dias_com_compra[parte].tolist(), _datas(primeiro[parte]), _datas(ultimo[parte]),
+                    (referencia - ultimo[parte]).tolist(), ativo.tolist(), (1 - ativo).tolist()))
+            conn.executemany(f"INSERT INTO {TABELA} (id_cliente, compras) VALUES (?, 0)",
+                             ((c,) for c in sem_compra.tolist()))
+            conn.execute(f"DROP TABLE IF EXISTS {TABELA_MODELO}")
+            conn.execute(f"CREATE TABLE {TABELA_MODELO} ({', '.join(modelo)})")
+            conn.execute(f"INSERT INTO {TABELA_MODELO} VALUES ({', '.join('?' * len(modelo))})",
+                         [float(v) if isinstance(v, np.floating) else v for v in modelo.values()])
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    progresso(1.0, "Pontuações gravadas")
+    return modelo
+
+
+def modelo(db_path):
+    # Parâmetros do modelo gravado, ou None se não há pontuação ou ela não cobre as vendas atuais
+    with closing(analises_sql.conectar(db_path)) as conn:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (TABELA_MODELO,)).fetchone():
+            return None
+        cursor = conn.execute(f"SELECT * FROM {TABELA_MODELO}")
+        linha = cursor.fetchone()
+        colunas = [c[0] for c in cursor.description]
+        marca = _marca(conn)
+    if linha is None:
+        return None
+    gravado = dict(zip(colunas, linha))
+    return gravado if (gravado['vendas'], gravado['ultimo_id_venda']) == marca else None
+
+
+def resumo(db_path):
+    # Totais da pontuação gravada: clientes, ativos esperados, churn médio e clientes sem compra
+    with closing(analises_sql.conectar(db_path)) as conn:
+        clientes, ativos, churn_medio, sem_compra = conn.execute(
+            f"SELECT COUNT(*), TOTAL(prob_ativo), AVG(prob_churn), TOTAL(compras = 0) FROM {TABELA}").fetchone()
+    return {'clientes': clientes, 'ativos_esperados': ativos, 'churn_medio': (churn_medio or 0.0) * 100,
+            'sem_compra': int(sem_compra)}
+
+
+def pontuacoes(db_path):
+    with closing(analises_sql.conectar(db_path)) as conn:
+        return pd.read_sql_query(f"SELECT * FROM {TABELA}", conn)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajusta o BG/NBD e grava a probabilidade de churn de cada cliente")
+    parser.add_argument('banco')
+    parser.add_argument('--processos', type=int, default=PROCESSOS)
+    args = parser.parse_args()
+
+    inicio = time.perf_counter()
+    ajustado = pontuar_banco(args.banco, args.processos,
+                             lambda fracao, etapa: print(f"{fracao:>4.0%} {etapa}", file=sys.stderr))
+    print(", ".join(f"{p} = {ajustado[p]:.4g}" for p in PARAMETROS))
+    print(f"{ajustado['clientes']:,} clientes com compra pontuados em {time.perf_counter() - inicio:.1f} s",
+          file=sys.stderr)
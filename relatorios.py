@@ -0,0 +1,389 @@
+import argparse
+import importlib.util
+import multiprocessing
+import os
+import re
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from datetime import date, timedelta
+
+import pandas as pd
+from reportlab.graphics.charts.barcharts import VerticalBarChart
+from reportlab.graphics.charts.legends import Legend
+from reportlab.graphics.charts.linecharts import HorizontalLineChart
+from reportlab.graphics.shapes import Drawing
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.units import inch
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+import analises
+import cubo
+import pontuacao_churn
+import tabelas
+
+# Relatórios em lote (PDF e XLSX), sem Streamlit: um trabalho por (banco,
+# período, região), distribuído em um pool de processos. Cada banco é carregado
+# e agregado uma única vez por processo (tabelas pelo snapshot colunar, cubo
+# diário e indicadores da base inteira) e todos os relatórios dele só fatiam o
+# cubo. O processo principal prepara os bancos antes de abrir o pool, então com
+# fork os trabalhadores já nascem com os agregados prontos.
+# Os gráficos são desenhados com o reportlab (vetoriais, sem navegador).
+#
+# Uso:
+#   python relatorios.py vendas_marketing.db --semanas 4 --top-regioes 20 --saida relatorios
+#   python relatorios.py vendas_marketing.db --periodos 2025-01-01:2025-03-31 --regioes "São Paulo"
+
+PROCESSOS = int(os.environ.get('RELATORIOS_PROCESSOS', os.cpu_count() or 1))
+
+# Linhas de cada tabela no PDF (o XLSX leva as tabelas completas)
+LINHAS_PDF = 20
+
+CORES = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b']
+
+
+@dataclass(frozen=True)
+class Trabalho:
+    db_path: str
+    inicio: date = None
+    fim: date = None
+    regiao: str = None
+
+
+@dataclass(frozen=True)
+class Bloco:
+    titulo: str
+    tabela: pd.DataFrame
+    # ('barras', coluna x, coluna y) | ('linhas', coluna x, coluna y, coluna da série)
+    grafico: tuple = None
+
+
+def excel_disponivel():
+    return any(importlib.util.find_spec(m) is not None for m in ('xlsxwriter', 'openpyxl'))
+
+
+_bancos = {}
+
+
+def dados_do_banco(db_path):
+    # Agregados reaproveitados por todos os relatórios do banco neste processo
+    if db_path not in _bancos:
+        tables = tabelas.carregar_tabelas(db_path)
+        base = indicadores_da_base(tables)
+        # Probabilidades BG/NBD gravadas por pontuacao_churn.py, se cobrem as vendas atuais
+        base['churn_bgnbd'] = pontuacao_churn.resumo(db_path) if pontuacao_churn.modelo(db_path) else None
+        _bancos[db_path] = (cubo.construir(tables), base)
+    return _bancos[db_path]
+
+
+def indicadores_da_base(tables):
+    # Seção D do dashboard, calculada sobre a base inteira (sem período nem região)
+    ultima_compra, taxa_churn = analises.churn_clientes(tables)
+    metricas = analises.classificacao_clientes(tables, 'rfm')
+    segmentos = (metricas.groupby('segmento')
+                 .agg(clientes=('id_cliente', 'size'), valor_total=('valor_total', 'sum'))
+                 .sort_values('valor_total', ascending=False).reset_index())
+    return {
+        'clientes': len(ultima_compra),
+        'taxa_churn': taxa_churn,
+        'retencao': analises.retencao_mensal(tables)[['mes', 'taxa_retencao', 'novos_clientes', 'clientes_retidos']],
+        'segmentos': segmentos,
+    }
+
+
+def blocos(trabalho):
+    cubo_completo, base = dados_do_banco(trabalho.db_path)
+    dados = cubo.filtrar(cubo_completo, trabalho.inicio, trabalho.fim,
+                         cidades=[trabalho.regiao] if trabalho.regiao else None)
+    receita = cubo.receita_total(dados)
+    totais = cubo.contagens(dados)
+    conversoes = int(dados.interacoes['conversoes'].sum())
+    indicadores = pd.DataFrame([
+        ('Receita', f"R$ {receita:,.2f}"),
+        ('Vendas', f"{totais['vendas']:,}"),
+        ('Ticket médio', f"R$ {receita / totais['vendas']:,.2f}" if totais['vendas'] else '-'),
+        ('Interações', f"{totais['interacoes']:,}"),
+        ('Conversões', f"{conversoes:,}"),
+        ('Taxa de churn (base)', f"{base['taxa_churn']:.1f}%"),
+        ('Clientes com compra (base)', f"{base['clientes']:,}"),
+    ], columns=['indicador', 'valor'])
+    if base['churn_bgnbd']:
+        indicadores = pd.concat([indicadores, pd.DataFrame([
+            ('Clientes ativos esperados (BG/NBD)', f"{base['churn_bgnbd']['ativos_esperados']:,.0f}"),
+            ('Probabilidade média de churn (BG/NBD)', f"{base['churn_bgnbd']['churn_medio']:.1f}%"),
+        ], columns=indicadores.columns)], ignore_index=True)
+    resultado = [Bloco('Indicadores', indicadores)]
+    sem_dados = dados.vendas.empty and dados.interacoes.empty
+
+    if not dados.vendas.empty:
+        resultado += [
+            Bloco('Vendas por canal (últimos 90 dias)', cubo.vendas_por_canal(dados),
+                  ('barras', 'canal_aquisicao', 'valor_total')),
+            Bloco('Top 5 produtos', cubo.top_produtos(dados), ('barras', 'nome_produto', 'quantidade')),
+            Bloco('Ticket médio por segmento', cubo.ticket_medio_segmento(dados), ('barras', 'segmento', 'valor_total')),
+            Bloco('Vendas por mês', cubo.vendas_mensais(dados)[['nome_mes', 'valor_total']],
+                  ('barras', 'nome_mes', 'valor_total')),
+            Bloco('Top produtos por mês', cubo.vendas_top_produtos_mensais(dados),
+                  ('linhas', 'mes_ano', 'quantidade', 'nome_produto')),
+        ]
+    if not dados.interacoes.empty:
+        eficiencia = cubo.eficiencia_campanhas(dados)
+        resultado += [
+            Bloco('Eficiência das campanhas',
+                  eficiencia.sort_values('conversoes', ascending=False)[
+                      ['nome_campanha', 'canal_marketing', 'orcamento', 'conversoes', 'taxa_conversao']]),
+            Bloco('Interações por canal de marketing', cubo.engajamento_canais(dados),
+                  ('barras', 'canal_marketing', 'total_interacoes')),
+        ]
+    if not dados.vendas.empty and not dados.interacoes.empty and trabalho.regiao is None:
+        resultado.append(Bloco('Desempenho regional',
+                               cubo.desempenho_regional(dados).sort_values('valor_total', ascending=False)))
+    resultado += [
+        Bloco('Retenção mensal (base)', base['retencao'], ('linhas', 'mes', 'taxa_retencao', None)),
+        Bloco('Segmentos RFM (base)', base['segmentos'], ('barras', 'segmento', 'clientes')),
+    ]
+    return resultado, sem_dados
+
+
+def _formatar(valor):
+    if isinstance(valor, float):
+        return f"{valor:,.2f}"
+    if isinstance(valor, pd.Timestamp):
+        return valor.strftime('%Y-%m-%d')
+    return str(valor)
+
+
+def _curto(texto, limite=18):
+    texto = str(texto)
+    return texto if len(texto) <= limite else texto[:limite - 1] + '…'
+
+
+def _eixo_valores(grafico):
+    grafico.valueAxis.valueMin = 0
+    grafico.valueAxis.labels.fontSize = 7
+    grafico.valueAxis.labelTextFormat = lambda v: f"{v:,.0f}"
+    grafico.categoryAxis.labels.fontSize = 7
+    grafico.categoryAxis.labels.angle = 30
+    grafico.categoryAxis.labels.boxAnchor = 'ne'
+
+
+def desenhar(bloco, largura=6.2 * inch, altura=2.6 * inch):
+    # Gráfico estático do bloco (None quando não há o que desenhar)
+    if bloco.grafico is None or bloco.tabela.empty:
+        return None
+    tipo, x, y, *serie = bloco.grafico
+    df = bloco.tabela
+    if df[y].max() <= 0:
+        return None
+    desenho = Drawing(largura, altura)
+    if tipo == 'barras':
+        grafico = VerticalBarChart()
+        grafico.data = [df[y].astype(float).tolist()]
+        grafico.categoryAxis.categoryNames = [_curto(v) for v in df[x]]
+        grafico.bars[0].fillColor = colors.HexColor(CORES[0])
+        series = []
+    else:
+        coluna_serie = serie[0]
+        if coluna_serie:
+            tabela = df.pivot_table(index=x, columns=coluna_serie, values=y, aggfunc='sum', observed=True).fillna(0)
+        else:
+            tabela = df.set_index(x)[[y]]
+        grafico = HorizontalLineChart()
+        grafico.data = [tabela[c].astype(float).tolist() for c in tabela.columns]
+        grafico.categoryAxis.categoryNames = [str(v) for v in tabela.index]
+        series = list(tabela.columns) if coluna_serie else []
+        for i in range(len(grafico.data)):
+            grafico.lines[i].strokeColor = colors.HexColor(CORES[i % len(CORES)])
+            grafico.lines[i].strokeWidth = 1.5
+    grafico.x, grafico.y = 45, 45
+    grafico.width = largura - (180 if series else 60)
+    grafico.height = altura - 60
+    _eixo_valores(grafico)
+    desenho.add(grafico)
+    if series:
+        legenda = Legend()
+        legenda.x, legenda.y = largura - 125, altura - 20
+        legenda.fontSize = 7
+        legenda.colorNamePairs = [(colors.HexColor(CORES[i % len(CORES)]), _curto(s, 22)) for i, s in enumerate(series)]
+        desenho.add(legenda)
+    return desenho
+
+
+def titulo(trabalho):
+    regiao = trabalho.regiao or 'Todas as regiões'
+    inicio = trabalho.inicio.isoformat() if trabalho.inicio else 'início'
+    fim = trabalho.fim.isoformat() if trabalho.fim else 'fim'
+    return f"{regiao} — {inicio} a {fim}"
+
+
+def gravar_pdf(caminho, trabalho, lista, sem_dados=False):
+    estilos = getSampleStyleSheet()
+    elementos = [
+        Paragraph("Relatório de Vendas e Marketing", estilos['Title']),
+        Paragraph(titulo(trabalho), estilos['Heading2']),
+        Paragraph(f"Banco: {os.path.basename(trabalho.db_path)}", estilos['Normal']),
+        Spacer(1, 12),
+    ]
+    if sem_dados:
+        elementos.append(Paragraph("Nenhum registro encontrado para o período e a região selecionados.", estilos['Normal']))
+    for bloco in lista:
+        elementos.append(Paragraph(bloco.titulo, estilos['Heading3']))
+        desenho = desenhar(bloco)
+        if desenho is not None:
+            elementos.append(desenho)
+        parte = bloco.tabela.head(LINHAS_PDF)
+        linhas = [[str(c) for c in parte.columns]] + [[_curto(_formatar(v), 40) for v in linha] for linha in parte.itertuples(index=False)]
+        tabela = Table(linhas, repeatRows=1)
+        tabela.setStyle(TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#2c3e50')),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+            ('FONTSIZE', (0, 0), (-1, -1), 7),
+            ('GRID', (0, 0), (-1, -1), 0.25, colors.grey),
+            ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f8f9fa')]),
+        ]))
+        elementos += [tabela, Spacer(1, 6)]
+        if len(bloco.tabela) > LINHAS_PDF:
+            elementos.append(Paragraph(f"Primeiras {LINHAS_PDF} de {len(bloco.tabela):,} linhas.", estilos['Italic']))
+        elementos.append(Spacer(1, 12))
+    SimpleDocTemplate(caminho, pagesize=A4, title=titulo(trabalho)).build(elementos)
+
+
+def gravar_xlsx(caminho, lista):
+    with pd.ExcelWriter(caminho) as escritor:
+        for bloco in lista:
+            aba = re.sub(r'[\[\]:*?/\\]', '', bloco.titulo)[:31]
+            bloco.tabela.to_excel(escritor, sheet_name=aba, index=False)
+
+
+def _slug(texto):
+    texto = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '-', texto.lower()).strip('-') or 'regiao'
+
+
+def nome_arquivo(trabalho):
+    partes = [_slug(trabalho.regiao) if trabalho.regiao else 'todas',
+              trabalho.inicio.isoformat() if trabalho.inicio else 'inicio',
+              trabalho.fim.isoformat() if trabalho.fim else 'fim']
+    return '_'.join(partes)
+
+
+def gerar(trabalho, saida, formatos):
+    inicio = time.perf_counter()
+    lista, sem_dados = blocos(trabalho)
+    pasta = os.path.join(saida, os.path.splitext(os.path.basename(trabalho.db_path))[0])
+    os.makedirs(pasta, exist_ok=True)
+    base = os.path.join(pasta, nome_arquivo(trabalho))
+    arquivos = []
+    if 'pdf' in formatos:
+        gravar_pdf(base + '.pdf', trabalho, lista, sem_dados)
+        arquivos.append(base + '.pdf')
+    if 'xlsx' in formatos:
+        gravar_xlsx(base + '.xlsx', lista)
+        arquivos.append(base + '.xlsx')
+    return arquivos, time.perf_counter() - inicio
+
+
+def semanas(db_path, n):
+    # As últimas n semanas (segunda a domingo) até a última data com movimento
+    fim = cubo.dominio(dados_do_banco(db_path)[0])['fim'].date()
+    ultimo_domingo = fim - timedelta(days=(fim.weekday() + 1) % 7)
+    return [(ultimo_domingo - timedelta(days=7 * i + 6), ultimo_domingo - timedelta(days=7 * i)) for i in range(n)][::-1]
+
+
+def top_regioes(db_path, n):
+    vendas = dados_do_banco(db_path)[0].vendas
+    return vendas.groupby('cidade', observed=True)['receita'].sum().nlargest(n).index.tolist()
+
+
+def planejar(bancos, periodos=(), n_semanas=None, regioes=(), n_top_regioes=None, todas_regioes=False, incluir_total=False):
+    trabalhos = []
+    for db_path in bancos:
+        periodos_banco = list(periodos) + (semanas(db_path, n_semanas) if n_semanas else [])
+        regioes_banco = list(regioes)
+        if n_top_regioes:
+            regioes_banco += [r for r in top_regioes(db_path, n_top_regioes) if r not in regioes_banco]
+        if todas_regioes:
+            regioes_banco = cubo.dominio(dados_do_banco(db_path)[0])['cidade']
+        if not regioes_banco or incluir_total:
+            regioes_banco = [None] + regioes_banco
+        for inicio, fim in periodos_banco or [(None, None)]:
+            trabalhos += [Trabalho(db_path, inicio, fim, regiao) for regiao in regioes_banco]
+    return trabalhos
+
+
+def executar(trabalhos, saida, formatos, processos=PROCESSOS, progresso=None):
+    # Prepara cada banco aqui antes de abrir o pool: com fork os trabalhadores herdam os agregados
+    for db_path in dict.fromkeys(t.db_path for t in trabalhos):
+        dados_do_banco(db_path)
+    falhas = []
+    if processos <= 1:
+        for i, trabalho in enumerate(trabalhos, 1):
+            try:
+                resultado = gerar(trabalho, saida, formatos)
+            except Exception as e:
+                falhas.append((trabalho, e))
+                resultado = e
+            if progresso:
+                progresso(i, len(trabalhos), trabalho, resultado)
+        return falhas
+    contexto = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as pool:
+        futuros = {pool.submit(gerar, t, saida, formatos): t for t in trabalhos}
+        for i, futuro in enumerate(as_completed(futuros), 1):
+            trabalho = futuros[futuro]
+            try:
+                resultado = futuro.result()
+            except Exception as e:
+                falhas.append((trabalho, e))
+                resultado = e
+            if progresso:
+                progresso(i, len(trabalhos), trabalho, resultado)
+    return falhas
+
+
+def _periodo(texto):
+    inicio, _, fim = texto.partition(':')
+    try:
+        return date.fromisoformat(inicio), date.fromisoformat(fim)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"período inválido: {texto} (use AAAA-MM-DD:AAAA-MM-DD)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera relatórios PDF/XLSX por banco, período e região")
+    parser.add_argument('bancos', nargs='+')
+    parser.add_argument('--periodos', type=_periodo, nargs='+', default=[], help="AAAA-MM-DD:AAAA-MM-DD")
+    parser.add_argument('--semanas', type=int, help="um relatório por semana, para as últimas N semanas")
+    parser.add_argument('--regioes', nargs='+', default=[], help="cidades, um relatório para cada")
+    parser.add_argument('--top-regioes', type=int, help="as N cidades de maior receita")
+    parser.add_argument('--todas-regioes', action='store_true', help="um relatório para cada cidade")
+    parser.add_argument('--incluir-total', action='store_true', help="também o relatório de todas as regiões")
+    parser.add_argument('--formatos', nargs='+', choices=['pdf', 'xlsx'], default=['pdf'])
+    parser.add_argument('--saida', default='relatorios')
+    parser.add_argument('--processos', type=int, default=PROCESSOS)
+    args = parser.parse_args()
+    if 'xlsx' in args.formatos and not excel_disponivel():
+        parser.error("o formato xlsx requer o pacote openpyxl ou xlsxwriter (pip install openpyxl)")
+    for banco in args.bancos:
+        if not os.path.exists(banco):
+            parser.error(f"{banco} não encontrado")
+
+    inicio = time.perf_counter()
+    trabalhos = planejar(args.bancos, args.periodos, args.semanas, args.regioes, args.top_regioes,
+                         args.todas_regioes, args.incluir_total)
+    print(f"{len(trabalhos)} relatórios em {args.processos} processo(s)")
+
+    def progresso(i, total, trabalho, resultado):
+        if isinstance(resultado, Exception):
+            print(f"[{i}/{total}] ERRO {trabalho.db_path} {titulo(trabalho)}: {resultado}", file=sys.stderr)
+        else:
+            arquivos, segundos = resultado
+            print(f"[{i}/{total}] {', '.join(arquivos)} ({segundos:.1f} s)")
+
+    falhas = executar(trabalhos, args.saida, args.formatos, args.processos, progresso)
+    print(f"Concluído em {time.perf_counter() - inicio:.1f} s; {len(trabalhos) - len(falhas)} gerados, {len(falhas)} com erro")
+    sys.exit(1 if falhas else 0)
@@ -0,0 +1,108 @@
+import numpy as np
+
+# Segmentação RFM vetorizada. Os limites de quantil são calculados uma única vez
+# por coluna e as regras são avaliadas em ordem com np.select: o primeiro
+# segmento cujas condições forem todas verdadeiras é atribuído ao cliente.
+#
+# Cada regra é (segmento, [(coluna, operador, limite), ...]). Em REGRAS_LEGADO o
+# limite é um quantil da própria coluna; em REGRAS_RFM é um valor absoluto de score.
+#
+# Os quantis são exatos (np.quantile) por padrão; quem não tem a coluna inteira
+# em memória passa quantis(coluna, níveis) com os limites de outra fonte (ex.:
+# os esboços KLL de esbocos.py) e segmenta os clientes em partes.
+
+REGRAS_LEGADO = [
+    ('Alto Valor', [('valor_total', '>', 0.75), ('frequencia', '>', 0.75), ('recencia', '<', 0.25)]),
+    ('Valor Médio', [('valor_total', '>', 0.5), ('frequencia', '>', 0.5)]),
+    ('Em Risco', [('recencia', '>', 0.75)]),
+]
+PADRAO_LEGADO = 'Baixo Valor'
+
+REGRAS_RFM = [
+    ('Campeões', [('score_r', '>=', 4), ('score_f', '>=', 4), ('score_m', '>=', 4)]),
+    ('Clientes Fiéis', [('score_r', '>=', 3), ('score_f', '>=', 4)]),
+    ('Novos Clientes', [('score_r', '>=', 4), ('score_f', '<=', 1)]),
+    ('Potenciais Fiéis', [('score_r', '>=', 3), ('score_m', '>=', 3)]),
+    ('Em Risco', [('score_r', '<=', 2), ('score_f', '>=', 3)]),
+    ('Hibernando', [('score_r', '<=', 2)]),
+]
+PADRAO_RFM = 'Precisam de Atenção'
+
+SEGMENTACOES = {
+    'rfm': (REGRAS_RFM, PADRAO_RFM, False),
+    'legado': (REGRAS_LEGADO, PADRAO_LEGADO, True),
+}
+
+OPERADORES = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal,
+}
+
+
+def pontuar(valores, n_faixas=5, inverter=False, limites=None):
+    # Score de 1 a n_faixas por quantis; valores empatados no limite ficam na faixa inferior
+    valores = np.asarray(valores, dtype='float64')
+    if valores.size == 0:
+        return np.empty(0, dtype='int8')
+    if limites is None:
+        limites = np.quantile(valores, np.linspace(0, 1, n_faixas + 1)[1:-1])
+    faixa = np.searchsorted(limites, valores, side='left') + 1
+    if inverter:
+        faixa = n_faixas + 1 - faixa
+    return faixa.astype('int8')
+
+
+def pontuar_rfm(metricas, n_faixas=5, quantis=None):
+    # Recência menor é melhor, por isso o score R é invertido
+    niveis = np.linspace(0, 1, n_faixas + 1)[1:-1]
+
+    def limites(coluna):
+        return None if quantis is None else quantis(coluna, niveis)
+    metricas['score_r'] = pontuar(metricas['recencia'], n_faixas, inverter=True, limites=limites('recencia'))
+    metricas['score_f'] = pontuar(metricas['frequencia'], n_faixas, limites=limites('frequencia'))
+    metricas['score_m'] = pontuar(metricas['valor_total'], n_faixas, limites=limites('valor_total'))
+    return metricas
+
+
+def aplicar_regras(metricas, regras, padrao, limites_em_quantil=False, quantis=None):
+    colunas = {}
+    for _, condicoes in regras:
+        for coluna, _, limite in condicoes:
+            colunas.setdefault(coluna, set()).add(limite)
+
+    valores = {coluna: metricas[coluna].to_numpy(dtype='float64') for coluna in colunas}
+    limites = {}
+    for coluna, niveis in colunas.items():
+        niveis = sorted(niveis)
+        if limites_em_quantil and quantis is not None:
+            calculados = quantis(coluna, niveis)
+        elif limites_em_quantil:
+            calculados = np.quantile(valores[coluna], niveis) if valores[coluna].size else [np.nan] * len(niveis)
+        else:
+            calculados = niveis
+        limites.update({(coluna, nivel): lim for nivel, lim in zip(niveis, calculados)})
+
+    mascaras = [
+        np.logical_and.reduce([
+            OPERADORES[operador](valores[coluna], limites[(coluna, limite)])
+            for coluna, operador, limite in condicoes
+        ])
+        for _, condicoes in regras
+    ]
+    return np.select(mascaras, [segmento for segmento, _ in regras], default=padrao)
+
+
+def segmentar(metricas, segmentacao='rfm', regras=None, padrao=None, n_faixas=5, quantis=None):
+    regras_base, padrao_base, em_quantil = SEGMENTACOES[segmentacao]
+    metricas = pontuar_rfm(metricas, n_faixas, quantis)
+    metricas['segmento'] = aplicar_regras(
+        metricas,
+        regras if regras is not None else regras_base,
+        padrao if padrao is not None else padrao_base,
+        em_quantil,
+        quantis,
+    )
+    return metricas
@@ -0,0 +1,315 @@
+import argparse
+import asyncio
+import hashlib
+import inspect
+import json
+import multiprocessing
+import os
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import asynccontextmanager
+
+import pandas as pd
+
+import analises
+import analises_polars
+import analises_sql
+import bancos
+import snapshot
+import streaming
+import tabelas
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # sem pyarrow só há respostas em JSON
+    pa = None
+
+try:
+    import uvicorn
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, Response
+    from starlette.routing import Route
+except ImportError:  # sem starlette/uvicorn o serviço fica indisponível
+    Starlette = None
+
+# Serviço HTTP das análises, para ferramentas fora do dashboard (exportações de
+# BI, alertas): as mesmas funções dos motores (analises.py, analises_sql.py,
+# ...) expostas como GET /analises/<nome>, com a resposta em JSON ou Arrow IPC.
+#
+# O app ASGI (Starlette) só roteia e responde do cache: cada resposta já
+# serializada fica em um CacheLRU (SERVICO_CACHE_MB) pela assinatura do banco
+# (hash do conteúdo e do WAL), análise, modo, formato e parâmetros, com ETag
+# para respostas 304. Uma falta de cache vai para um pool de processos
+# (SERVICO_PROCESSOS), que carrega a fonte do modo uma vez por processo (as
+# tabelas pelo snapshot mapeado, compartilhado entre os processos), calcula e
+# serializa lá mesmo; pedidos simultâneos da mesma chave esperam o mesmo cálculo.
+# Um processo do pool que morre (ex.: falta de memória) quebra o pool inteiro:
+# ele é refeito e o cálculo tentado mais uma vez antes de responder 503.
+#
+# Uso:
+#   python servico.py vendas_marketing.db --porta 8000
+#   curl 'localhost:8000/analises/top_produtos?n=10'
+#   curl 'localhost:8000/analises/churn_clientes?formato=arrow' -o churn.arrow
+# Teste de carga: python carga_servico.py --url 'http://localhost:8000/analises/vendas_mensais'
+
+PROCESSOS = int(os.environ.get('SERVICO_PROCESSOS', os.cpu_count() or 1))
+LIMITE_CACHE = int(os.environ.get('SERVICO_CACHE_MB', 512)) * 1024 * 1024
+MODO_PADRAO = 'sql'
+
+# Análises expostas (funções com o mesmo nome em todos os motores)
+ANALISES = [
+    'contagens', 'receita_total', 'vendas_por_canal', 'top_produtos', 'ticket_medio_segmento', 'vendas_mensais',
+    'eficiencia_campanhas', 'engajamento_canais', 'vendas_top_produtos_mensais', 'desempenho_regional',
+    'churn_clientes', 'coortes', 'retencao_mensal', 'classificacao_clientes', 'atribuicao_campanhas',
+]
+
+# Nome do valor que acompanha o DataFrame nas análises que devolvem (DataFrame, valor)
+EXTRAS = {'churn_clientes': 'taxa_churn'}
+
+# Modo -> (módulo, fonte a partir do caminho e do hash do conteúdo do banco)
+MOTORES = {
+    'sql': (analises_sql, lambda db_path, chave: db_path),
+    'pandas': (analises, lambda db_path, chave: tabelas.carregar_tabelas(db_path, chave=chave)),
+    'streaming': (streaming, lambda db_path, chave: streaming.Fluxo(db_path)),
+}
+if analises_polars.disponivel():
+    MOTORES['polars'] = (analises_polars, lambda db_path, chave: analises_polars.de_tabelas(
+        tabelas.carregar_tabelas(db_path, chave=chave)))
+
+FORMATOS = {'json': 'application/json'}
+if pa is not None:
+    FORMATOS['arrow'] = 'application/vnd.apache.arrow.stream'
+
+
+class RequisicaoInvalida(ValueError):
+    pass
+
+
+class ServicoIndisponivel(RuntimeError):
+    pass
+
+
+def disponivel():
+    return Starlette is not None
+
+
+def parametros(nome):
+    # Parâmetros de uma análise e seus valores padrão (a assinatura do motor de referência)
+    assinatura = inspect.signature(getattr(analises, nome))
+    return {p.name: p.default for p in list(assinatura.parameters.values())[1:]}
+
+
+def _converter(texto, padrao):
+    if isinstance(padrao, bool):
+        return texto.lower() in ('1', 'true', 'sim')
+    if isinstance(padrao, int):
+        valor = float(texto)
+        if not valor.is_integer():
+            raise ValueError(f"esperado um número inteiro, recebido {texto!r}")
+        return int(valor)
+    if isinstance(padrao, float):
+        return float(texto)
+    return texto
+
+
+def argumentos(nome, consulta):
+    # Parâmetros da query string -> argumentos posicionais da análise, na ordem da assinatura
+    esperados = parametros(nome)
+    desconhecidos = set(consulta) - set(esperados)
+    if desconhecidos:
+        raise RequisicaoInvalida(f"Parâmetros desconhecidos para {nome}: {', '.join(sorted(desconhecidos))}")
+    try:
+        return tuple(_converter(consulta[p], padrao) if p in consulta else padrao for p, padrao in esperados.items())
+    except ValueError as e:
+        raise RequisicaoInvalida(f"Valor inválido: {e}") from e
+
+
+def _json_valor(valor):
+    return valor.item() if hasattr(valor, 'item') else str(valor)
+
+
+def serializar(nome, resultado, formato, meta):
+    # Resultado de um motor -> corpo da resposta. DataFrames vão em "dados" (JSON,
+    # uma lista de registros) ou como a tabela Arrow; valores avulsos vão em
+    # "extras" (no Arrow, nos metadados do esquema)
+    dados, extras = resultado, {}
+    if isinstance(resultado, tuple):
+        dados, extras = resultado[0], {EXTRAS.get(nome, 'valor'): resultado[1]}
+    elif isinstance(resultado, dict):
+        dados, extras = None, resultado
+    elif not hasattr(resultado, 'columns'):
+        dados, extras = None, {'valor': resultado}
+    meta = {**meta, 'extras': extras}
+    if formato == 'arrow':
+        tabela = pa.Table.from_pandas(dados, preserve_index=False) if dados is not None else pa.table({})
+        tabela = tabela.replace_schema_metadata({
+            **(tabela.schema.metadata or {}), b'analise': json.dumps(meta, default=_json_valor).encode()})
+        destino = pa.BufferOutputStream()
+        with ipc.new_stream(destino, tabela.schema) as escritor:
+            escritor.write_table(tabela)
+        return destino.getvalue().to_pybytes()
+    cabecalho = json.dumps(meta, default=_json_valor, ensure_ascii=False)
+    registros = 'null'
+    if dados is not None:
+        registros = dados.to_json(orient='records', date_format='iso', double_precision=15, force_ascii=False)
+    return f'{cabecalho[:-1]}, "dados": {registros}}}'.encode()
+
+
+_fontes = {}
+
+
+def calcular(db_path, assinatura, modo, nome, args, formato):
+    # Roda nos processos do pool: a fonte de cada (banco, versão, modo) é montada
+    # uma vez por processo e descartada quando o banco muda
+    chave = (db_path, modo)
+    if _fontes.get(chave, (None,))[0] != assinatura:
+        modulo, preparar = MOTORES[modo]
+        _fontes[chave] = (assinatura, preparar(db_path, assinatura.split('-')[0]))
+    modulo, _ = MOTORES[modo]
+    try:
+        resultado = getattr(modulo, nome)(_fontes[chave][1], *args)
+    except (KeyError, ValueError, TypeError, OverflowError, sqlite3.Error, pd.errors.DatabaseError) as e:
+        # Erros do cálculo vêm de parâmetros que a conversão aceitou mas o motor
+        # não (segmentação inexistente, valor fora do intervalo do SQLite, ...)
+        raise RequisicaoInvalida(f"Parâmetro inválido para {nome}: {e}") from e
+    meta = {'analise': nome, 'banco': os.path.basename(db_path), 'assinatura': assinatura, 'modo': modo,
+            'parametros': dict(zip(parametros(nome), args))}
+    return serializar(nome, resultado, formato, meta)
+
+
+def assinatura_do_banco(db_path):
+    # Hash do conteúdo; com o banco em WAL, escritas ainda não transferidas ao
+    # arquivo principal entram pelo tamanho e pela data do -wal
+    assinatura = snapshot.hash_arquivo(db_path)
+    wal = f'{db_path}-wal'
+    if os.path.exists(wal) and os.path.getsize(wal):
+        estado = os.stat(wal)
+        assinatura += f'-{estado.st_size:x}{estado.st_mtime_ns:x}'
+    return assinatura
+
+
+class Servico:
+    def __init__(self, caminhos, processos=PROCESSOS, modo=MODO_PADRAO, limite_cache=LIMITE_CACHE):
+        self.bancos = {os.path.splitext(os.path.basename(c))[0]: os.path.abspath(c) for c in caminhos}
+        self.modo = modo
+        self.respostas = bancos.CacheLRU(limite_cache)
+        self._assinaturas = {}
+        self._em_andamento = {}
+        self.processos = processos
+        self.pool = self._novo_pool()
+
+    def _novo_pool(self):
+        # spawn: o processo do servidor já tem threads do laço de eventos
+        return ProcessPoolExecutor(max_workers=self.processos, mp_context=multiprocessing.get_context('spawn'))
+
+    async def _calcular(self, *args):
+        for _ in range(2):
+            pool = self.pool
+            try:
+                return await asyncio.get_running_loop().run_in_executor(pool, calcular, *args)
+            except BrokenProcessPool:
+                # Só o primeiro pedido que encontra o pool quebrado o substitui
+                if self.pool is pool:
+                    self.pool = self._novo_pool()
+                    pool.shutdown(wait=False, cancel_futures=True)
+        raise ServicoIndisponivel("Os processos de cálculo foram encerrados; tente novamente em instantes.")
+
+    async def assinatura(self, db_path):
+        # Recalculada só quando o arquivo (ou o WAL) muda de tamanho ou data
+        marcas = tuple((os.stat(a).st_size, os.stat(a).st_mtime_ns) if os.path.exists(a) else None
+                       for a in (db_path, f'{db_path}-wal'))
+        marcas_anteriores, assinatura = self._assinaturas.get(db_path, (None, None))
+        if marcas != marcas_anteriores:
+            assinatura = await asyncio.to_thread(assinatura_do_banco, db_path)
+            self._assinaturas[db_path] = (marcas, assinatura)
+        return assinatura
+
+    async def resposta(self, db_path, modo, nome, args, formato):
+        # (corpo, ETag, se veio do cache); pedidos iguais em andamento esperam o mesmo cálculo
+        assinatura = await self.assinatura(db_path)
+        chave = (db_path, assinatura, modo, nome, formato) + args
+        guardada = self.respostas.obter(chave, lambda: None)
+        if guardada is not None:
+            return (*guardada, True)
+        tarefa = self._em_andamento.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.ensure_future(self._calcular(db_path, assinatura, modo, nome, args, formato))
+            self._em_andamento[chave] = tarefa
+            tarefa.add_done_callback(lambda _: self._em_andamento.pop(chave, None))
+        corpo = await asyncio.shield(tarefa)
+        resposta = (corpo, '"' + hashlib.blake2b(corpo, digest_size=12).hexdigest() + '"')
+        self.respostas.obter(chave, lambda: resposta)
+        return (*resposta, False)
+
+    def _banco(self, nome):
+        if nome is None and len(self.bancos) == 1:
+            return next(iter(self.bancos.values()))
+        if nome not in self.bancos:
+            raise RequisicaoInvalida(f"Banco desconhecido: {nome} (disponíveis: {', '.join(self.bancos)})")
+        return self.bancos[nome]
+
+    async def rota_analise(self, request):
+        nome = request.path_params['nome']
+        if nome not in ANALISES:
+            return JSONResponse({'erro': f"Análise desconhecida: {nome}"}, status_code=404)
+        consulta = dict(request.query_params)
+        try:
+            db_path = self._banco(consulta.pop('banco', None))
+            modo = consulta.pop('modo', self.modo)
+            formato = consulta.pop('formato', 'json')
+            if modo not in MOTORES:
+                raise RequisicaoInvalida(f"Modo desconhecido: {modo} (disponíveis: {', '.join(MOTORES)})")
+            if formato not in FORMATOS:
+                raise RequisicaoInvalida(f"Formato desconhecido: {formato} (disponíveis: {', '.join(FORMATOS)})")
+            corpo, etag, do_cache = await self.resposta(db_path, modo, nome, argumentos(nome, consulta), formato)
+        except RequisicaoInvalida as e:
+            return JSONResponse({'erro': str(e)}, status_code=400)
+        except ServicoIndisponivel as e:
+            return JSONResponse({'erro': str(e)}, status_code=503, headers={'Retry-After': '1'})
+        cabecalhos = {'ETag': etag, 'X-Cache': 'hit' if do_cache else 'miss'}
+        if request.headers.get('if-none-match') == etag:
+            return Response(status_code=304, headers=cabecalhos)
+        return Response(corpo, media_type=FORMATOS[formato], headers=cabecalhos)
+
+    async def rota_analises(self, request):
+        return JSONResponse({nome: parametros(nome) for nome in ANALISES})
+
+    async def rota_bancos(self, request):
+        return JSONResponse({nome: await self.assinatura(caminho) for nome, caminho in self.bancos.items()})
+
+    async def rota_saude(self, request):
+        return JSONResponse({'status': 'ok', 'respostas_em_cache_mb': round(self.respostas.usado / 2**20, 1)})
+
+
+def criar_app(caminhos, processos=PROCESSOS, modo=MODO_PADRAO):
+    servico = Servico(caminhos, processos, modo)
+
+    @asynccontextmanager
+    async def ciclo_de_vida(app):
+        yield
+        servico.pool.shutdown(cancel_futures=True)
+    app = Starlette(routes=[
+        Route('/saude', servico.rota_saude),
+        Route('/bancos', servico.rota_bancos),
+        Route('/analises', servico.rota_analises),
+        Route('/analises/{nome}', servico.rota_analise),
+    ], lifespan=ciclo_de_vida)
+    app.state.servico = servico
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serviço HTTP/JSON das análises, com cache por banco e parâmetros")
+    parser.add_argument('bancos', nargs='+')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--porta', type=int, default=8000)
+    parser.add_argument('--processos', type=int, default=PROCESSOS)
+    parser.add_argument('--modo', choices=list(MOTORES), default=MODO_PADRAO, help="motor usado quando o pedido não diz")
+    args = parser.parse_args()
+
+    if not disponivel():
+        parser.error("instale starlette e uvicorn: pip install starlette uvicorn")
+    uvicorn.run(criar_app(args.bancos, args.processos, args.modo), host=args.host, port=args.porta,
+                log_level='warning')
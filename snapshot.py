@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import weakref
+from types import MappingProxyType
+
+import instrumentacao
+
+try:
+    import fcntl
+except ImportError:  # sem flock (Windows) o snapshot é removido sem contar quem o usa
+    fcntl = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+except ImportError:  # sem pyarrow a carga segue direto do SQLite
+    pa = None
+
+# Snapshot colunar das tabelas já normalizadas, um arquivo Arrow IPC (sem
+# compressão) por tabela, identificado pelo hash do conteúdo do banco. A releitura
+# mapeia o arquivo em memória e as colunas numéricas apontam direto para o mapa,
+# sem passar de novo pelo SQLite nem pela normalização. O Arrow IPC foi escolhido
+# no lugar do Parquet porque pode ser mapeado sem decodificação.
+#
+# O snapshot também é a cópia compartilhada das tabelas: sessões do mesmo
+# processo recebem o mesmo objeto (cache de bancos.py) e processos diferentes
+# (outros servidores Streamlit, o pool de relatorios.py) mapeiam os mesmos
+# arquivos, cujas páginas ficam uma vez só no cache de páginas do sistema.
+# Apontar SNAPSHOTS_DIR para /dev/shm mantém os arquivos em memória.
+#
+# Cada processo que lê um snapshot segura uma trava compartilhada (flock) no
+# arquivo .uso da pasta até as tabelas serem coletadas, ou seja, até saírem do
+# cache e de todas as sessões. remover() só apaga a pasta quando ninguém a
+# segura; se não puder, deixa a marca .obsoleto e o último processo a soltar a
+# trava apaga. O sistema conta as travas e as solta se um processo morrer.
+
+DIRETORIO = os.environ.get('SNAPSHOTS_DIR')
+
+
+def disponivel():
+    return pa is not None
+
+
+def hash_arquivo(caminho, bloco=1 << 20):
+    h = hashlib.blake2b(digest_size=16)
+    with open(caminho, 'rb') as f:
+        while dados := f.read(bloco):
+            h.update(dados)
+    return h.hexdigest()
+
+
+def raiz(db_path):
+    return DIRETORIO or os.path.join(os.path.dirname(os.path.abspath(db_path)), '.snapshots')
+
+
+def pasta(db_path, chave):
+    return os.path.join(raiz(db_path), chave)
+
+
+class _Tabelas(dict):
+    # dict comum não aceita weakref, necessário para soltar a trava na coleta
+    pass
+
+
+def _anexar(diretorio):
+    if fcntl is None:
+        return None
+    descritor = os.open(os.path.join(diretorio, '.uso'), os.O_RDONLY | os.O_CREAT, 0o644)
+    fcntl.flock(descritor, fcntl.LOCK_SH)
+    return descritor
+
+
+def _soltar(descritor, diretorio):
+    os.close(descritor)
+    if os.path.exists(os.path.join(diretorio, '.obsoleto')):
+        remover(diretorio)
+
+
+def em_uso(diretorio):
+    # Algum processo segura a trava compartilhada do .uso (tabelas ainda mapeadas)
+    if fcntl is None:
+        return False
+    try:
+        descritor = os.open(os.path.join(diretorio, '.uso'), os.O_RDONLY)
+    except FileNotFoundError:
+        return False
+    try:
+        fcntl.flock(descritor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(descritor)
+    return False
+
+
+def remover(diretorio):
+    # Apaga o snapshot se nenhum processo o usa; senão marca para o último que o soltar
+    if fcntl is None or not os.path.isdir(diretorio):
+        shutil.rmtree(diretorio, ignore_errors=True)
+        return True
+    try:
+        descritor = os.open(os.path.join(diretorio, '.uso'), os.O_RDONLY | os.O_CREAT, 0o644)
+    except FileNotFoundError:
+        return True
+    try:
+        fcntl.flock(descritor, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        open(os.path.join(diretorio, '.obsoleto'), 'w').close()
+        os.close(descritor)
+        return False
+    shutil.rmtree(diretorio, ignore_errors=True)
+    os.close(descritor)
+    return True
+
+
+@instrumentacao.medir()
+def ler(db_path, chave):
+    diretorio = pasta(db_path, chave)
+    if not disponivel() or not os.path.isdir(diretorio):
+        return None
+    try:
+        descritor = _anexar(diretorio)
+    except FileNotFoundError:  # removido entre a verificação e a trava
+        return None
+    if not os.path.isdir(diretorio):
+        os.close(descritor)
+        return None
+    tables = _Tabelas()
+    for arquivo in sorted(os.listdir(diretorio)):
+        nome, extensao = os.path.splitext(arquivo)
+        if extensao != '.arrow':
+            continue
+        with pa.memory_map(os.path.join(diretorio, arquivo), 'r') as origem:
+            tabela = ipc.open_file(origem).read_all()
+        # split_blocks evita consolidar colunas e mantém as numéricas sem cópia
+        tables[nome] = tabela.to_pandas(split_blocks=True)
+    if descritor is not None:
+        weakref.finalize(tables, _soltar, descritor, diretorio)
+    return MappingProxyType(tables)
+
+
+@instrumentacao.medir()
+def gravar(db_path, chave, tables):
+    if not disponivel():
+        return
+    diretorio = raiz(db_path)
+    os.makedirs(diretorio, exist_ok=True)
+    temporaria = tempfile.mkdtemp(dir=diretorio, prefix='.gravando-')
+    try:
+        for nome, df in tables.items():
+            tabela = pa.Table.from_pandas(df, preserve_index=False)
+            with pa.OSFile(os.path.join(temporaria, f'{nome}.arrow'), 'wb') as destino:
+                with ipc.new_file(destino, tabela.schema) as escritor:
+                    escritor.write_table(tabela)
+        destino_final = pasta(db_path, chave)
+        if os.path.isdir(destino_final):
+            shutil.rmtree(temporaria)
+        else:
+            os.replace(temporaria, destino_final)
+    except BaseException:
+        shutil.rmtree(temporaria, ignore_errors=True)
+        raise
+    _invalidar_anterior(db_path, chave)
+
+
+def _invalidar_anterior(db_path, chave):
+    # Guarda qual snapshot pertence a este banco e remove o anterior, que ficou obsoleto
+    diretorio = raiz(db_path)
+    marcador = os.path.join(diretorio, os.path.basename(db_path) + '.atual')
+    anterior = None
+    if os.path.exists(marcador):
+        with open(marcador) as f:
+            anterior = f.read().strip()
+    with open(marcador, 'w') as f:
+        f.write(chave)
+    if anterior and anterior != chave:
+        remover(os.path.join(diretorio, anterior))
@@ -0,0 +1,357 @@
+import functools
+import os
+from contextlib import closing
+from dataclasses import astuple, dataclass
+
+import numpy as np
+import pandas as pd
+
+import analises
+import analises_sql
+import atribuicao
+import bancos
+import ingestao
+import instrumentacao
+import rfm
+
+# Modo streaming, para bancos maiores que a memória: Vendas e
+# Interacoes_Marketing são lidas em lotes (read_sql_query com chunksize, que
+# percorre um cursor aberto) e cada lote vira agregados parciais que são
+# mesclados aos anteriores e descartados: somas por (dia, canal), por produto e
+# por (mês, produto), contagens por (campanha, tipo) e vetores por id_cliente
+# (valor, frequência, primeira e última compra, interações). As análises saem
+# desses agregados, com os mesmos nomes e saídas de analises.py.
+#
+# O tamanho do lote vem do orçamento de memória (STREAMING_ORCAMENTO_MB), então
+# o pico de uma passada não depende do número de vendas e interações. O
+# orçamento vale para cada passada: passadas de bancos ou filtros diferentes
+# correm em paralelo, cada uma com o seu. Os agregados crescem com o número de
+# clientes, produtos, campanhas e dias, e as tabelas de dimensão (Clientes,
+# Produtos, Campanhas_Marketing) são lidas inteiras.
+#
+# Os filtros da barra lateral (seções A a C) fazem parte do Fluxo: as leituras
+# em lotes passam pelas mesmas subconsultas filtradas do modo SQL, e cada
+# combinação de filtros tem os próprios resumos no cache compartilhado
+# (bancos.cache), que os descarta junto com os demais resultados do banco.
+
+ORCAMENTO_MB = float(os.environ.get('STREAMING_ORCAMENTO_MB', 256))
+
+# Memória estimada por linha de um lote já no pandas, incluindo os temporários
+# do groupby (medida com tracemalloc nos bancos do gerador)
+BYTES_POR_LINHA = 800
+# Na atribuição cada interação ocupa poucos arrays int64 (chave, ordem, campanha)
+BYTES_POR_TOQUE = 64
+LOTE_MINIMO = 1_000
+
+_MB = 1024 * 1024
+
+
+@dataclass(frozen=True)
+class Fluxo:
+    db_path: str
+    orcamento_mb: float = ORCAMENTO_MB
+    filtros: analises_sql.Filtros = analises_sql.Filtros()
+
+    @property
+    def linhas_por_lote(self):
+        return max(LOTE_MINIMO, int(self.orcamento_mb * _MB / BYTES_POR_LINHA))
+
+
+def lotes(fluxo, sql, params=()):
+    with closing(analises_sql.conectar(fluxo.db_path)) as conn:
+        for numero, lote in enumerate(pd.read_sql_query(sql, conn, params=params, chunksize=fluxo.linhas_por_lote)):
+            with instrumentacao.etapa(f'streaming.lote[{numero}]', linhas=len(lote)):
+                yield lote
+
+
+def _datas(dias):
+    return pd.to_datetime(np.asarray(dias, dtype='int64'), unit='D')
+
+
+class _PorCliente:
+    # Vetores indexados pelo id_cliente, ampliados conforme aparecem ids maiores
+    COLUNAS = {
+        'valor_total': (0.0, np.float64),
+        'frequencia': (0, np.int64),
+        'primeiro': (np.iinfo(np.int64).max, np.int64),
+        'ultimo': (np.iinfo(np.int64).min, np.int64),
+    }
+
+    def __init__(self):
+        self.colunas = {nome: np.full(0, vazio, dtype=dtype) for nome, (vazio, dtype) in self.COLUNAS.items()}
+
+    def _garantir(self, tamanho):
+        if tamanho > len(self.colunas['frequencia']):
+            tamanho = max(tamanho, 2 * len(self.colunas['frequencia']))
+            for nome, (vazio, dtype) in self.COLUNAS.items():
+                novo = np.full(tamanho, vazio, dtype=dtype)
+                novo[:len(self.colunas[nome])] = self.colunas[nome]
+                self.colunas[nome] = novo
+
+    def incorporar(self, ids, valor_total, frequencia, primeiro, ultimo):
+        # ids únicos do lote, com os agregados do lote para cada um
+        self._garantir(int(ids.max()) + 1)
+        self.colunas['valor_total'][ids] += valor_total
+        self.colunas['frequencia'][ids] += frequencia
+        self.colunas['primeiro'][ids] = np.minimum(self.colunas['primeiro'][ids], primeiro)
+        self.colunas['ultimo'][ids] = np.maximum(self.colunas['ultimo'][ids], ultimo)
+
+    def tabela(self):
+        clientes = pd.DataFrame(self.colunas).rename_axis('id_cliente').reset_index()
+        return clientes[clientes['frequencia'] > 0].reset_index(drop=True)
+
+
+@dataclass(frozen=True)
+class _ResumoVendas:
+    diario: pd.DataFrame
+    produtos: pd.DataFrame
+    produtos_mes: pd.DataFrame
+    clientes: pd.DataFrame
+    atividade: np.ndarray
+
+
+@dataclass(frozen=True)
+class _ResumoInteracoes:
+    campanhas: pd.DataFrame
+    clientes: pd.Series
+
+
+def _uma_passada_por_chave(funcao):
+    # Um resumo por banco, orçamento e filtros. Sessões e threads do agendador
+    # que pedirem um resumo em andamento esperam por ele em vez de refazê-lo
+    # (trava por chave do bancos.cache); resumos de outras chaves não esperam
+    @functools.wraps(funcao)
+    def memorizada(fluxo):
+        chave = (fluxo.db_path, 'streaming', funcao.__name__, fluxo.orcamento_mb) + astuple(fluxo.filtros)
+        return bancos.cache.obter(chave, lambda: funcao(fluxo))
+    return memorizada
+
+
+def _vazio(**tipos):
+    # Resumo sem nenhum lote, com as colunas e os tipos de um resumo preenchido
+    return pd.DataFrame({coluna: pd.Series(dtype=tipo) for coluna, tipo in tipos.items()})
+
+
+def _somar(acumulado, parcial):
+    return parcial if acumulado is None else acumulado.add(parcial, fill_value=0)
+
+
+# Meses distintos por cliente, codificados como id_cliente * _MESES + mês absoluto
+_MESES = 1 << 16
+
+
+@_uma_passada_por_chave
+def resumo_vendas(fluxo):
+    diario = produtos = produtos_mes = None
+    por_cliente = _PorCliente()
+    atividade, pendentes = np.empty(0, dtype=np.int64), []
+    with closing(analises_sql.conectar(fluxo.db_path)) as conn:
+        dia = ingestao.dia(conn, 'Vendas')
+    vendas, _, params = analises_sql.tabelas_filtradas(fluxo.filtros)
+    sql = f"""
+        SELECT id_cliente, id_produto, {dia} AS dia,
+               quantidade, valor_total, canal_aquisicao
+        FROM {vendas}
+        WHERE id_cliente IS NOT NULL AND data_venda IS NOT NULL
+    """
+    for lote in lotes(fluxo, sql, params):
+        if lote.empty:
+            # Sem linhas (ex.: filtros que não casam com nenhuma venda) vem um único lote vazio
+            continue
+        lote['canal_aquisicao'] = lote['canal_aquisicao'].astype('category')
+        # Mês absoluto (ano * 12 + mês - 1), como tabelas.indice_mes
+        lote['mes_indice'] = lote['dia'].to_numpy().astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) + 1970 * 12
+        diario = _somar(diario, lote.groupby(['dia', 'canal_aquisicao'], observed=True)['valor_total'].sum())
+        produtos = _somar(produtos, lote.groupby('id_produto')[['quantidade', 'valor_total']].sum())
+        produtos_mes = _somar(produtos_mes, lote.groupby(['mes_indice', 'id_produto'])['quantidade'].sum())
+        por_cliente_lote = lote.groupby('id_cliente').agg(
+            valor_total=('valor_total', 'sum'), frequencia=('valor_total', 'count'),
+            primeiro=('dia', 'min'), ultimo=('dia', 'max'))
+        por_cliente.incorporar(por_cliente_lote.index.to_numpy(dtype=np.int64),
+                               *(por_cliente_lote[c].to_numpy() for c in ('valor_total', 'frequencia', 'primeiro', 'ultimo')))
+        pendentes.append(np.unique(lote['id_cliente'].to_numpy(dtype=np.int64) * _MESES + lote['mes_indice'].to_numpy()))
+        if sum(len(p) for p in pendentes) > max(fluxo.linhas_por_lote, len(atividade)):
+            atividade, pendentes = np.unique(np.concatenate([atividade] + pendentes)), []
+    atividade = np.unique(np.concatenate([atividade] + pendentes))
+    clientes = por_cliente.tabela()
+    return _ResumoVendas(
+        diario=diario.rename('valor_total').reset_index() if diario is not None else _vazio(dia='int64', canal_aquisicao='category', valor_total='float64'),
+        produtos=produtos.reset_index() if produtos is not None else _vazio(id_produto='int64', quantidade='int64', valor_total='float64'),
+        produtos_mes=produtos_mes.rename('quantidade').reset_index() if produtos_mes is not None else _vazio(mes_indice='int64', id_produto='int64', quantidade='int64'),
+        clientes=clientes,
+        atividade=atividade,
+    )
+
+
+@_uma_passada_por_chave
+def resumo_interacoes(fluxo):
+    campanhas = None
+    clientes = np.zeros(0, dtype=np.int64)
+    _, interacoes, params = analises_sql.tabelas_filtradas(fluxo.filtros)
+    sql = f"SELECT id_cliente, id_campanha, tipo_interacao FROM {interacoes} WHERE id_cliente IS NOT NULL"
+    for lote in lotes(fluxo, sql, params):
+        if lote.empty:
+            continue
+        campanhas = _somar(campanhas, lote.groupby(['id_campanha', 'tipo_interacao']).size())
+        contagem = np.bincount(lote['id_cliente'].to_numpy(dtype=np.int64))
+        if len(contagem) > len(clientes):
+            clientes = np.concatenate([clientes, np.zeros(len(contagem) - len(clientes), dtype=np.int64)])
+        clientes[:len(contagem)] += contagem
+    por_cliente = pd.Series(clientes, name='interacoes')
+    return _ResumoInteracoes(
+        campanhas=campanhas.rename('interacoes').reset_index() if campanhas is not None else _vazio(id_campanha='int64', tipo_interacao='object', interacoes='int64'),
+        clientes=por_cliente[por_cliente > 0],
+    )
+
+
+def _tabela(fluxo, nome):
+    # Tabelas de dimensão, lidas inteiras
+    return analises_sql.consultar(fluxo.db_path, f"SELECT * FROM {analises_sql.TABELAS[nome]}")
+
+
+def sem_registros(fluxo):
+    return analises_sql.sem_registros(analises_sql.Recorte(fluxo.db_path, fluxo.filtros))
+
+
+def contagens(fluxo):
+    return analises_sql.contagens(fluxo.db_path)
+
+
+def amostra(fluxo, tabela, n=5):
+    return analises_sql.amostra(fluxo.db_path, tabela, n)
+
+
+def receita_total(fluxo):
+    return analises_sql.receita_total(fluxo.db_path)
+
+
+def vendas_por_canal(fluxo, dias=90):
+    diario = resumo_vendas(fluxo).diario
+    periodo = diario[diario['dia'] >= diario['dia'].max() - dias]
+    return periodo.groupby('canal_aquisicao', observed=True)['valor_total'].sum().reset_index()
+
+
+def top_produtos(fluxo, n=5):
+    vendas_produtos = resumo_vendas(fluxo).produtos.merge(_tabela(fluxo, 'produtos'), on='id_produto')
+    vendas_produtos['margem_lucro'] = ((vendas_produtos['preco_unitario'] - vendas_produtos['custo_unitario']) / vendas_produtos['preco_unitario']) * 100
+    return vendas_produtos.nlargest(n, 'quantidade')[['nome_produto', 'quantidade', 'valor_total', 'margem_lucro']]
+
+
+def ticket_medio_segmento(fluxo):
+    clientes = resumo_vendas(fluxo).clientes.merge(_tabela(fluxo, 'clientes')[['id_cliente', 'segmento']], on='id_cliente')
+    por_segmento = clientes.groupby('segmento')[['valor_total', 'frequencia']].sum()
+    return (por_segmento['valor_total'] / por_segmento['frequencia']).rename('valor_total').reset_index()
+
+
+def vendas_mensais(fluxo):
+    diario = resumo_vendas(fluxo).diario
+    resultado = diario.groupby(_datas(diario['dia']).month.rename('mes'))['valor_total'].sum().reset_index()
+    resultado['nome_mes'] = [analises.MESES[i-1] for i in resultado['mes']]
+    return resultado
+
+
+def eficiencia_campanhas(fluxo):
+    interacoes = resumo_interacoes(fluxo).campanhas
+    total_interacoes = interacoes.groupby('id_campanha')['interacoes'].sum().rename('total_interacoes')
+    conversoes = interacoes[interacoes['tipo_interacao'] == 'Conversão'].groupby('id_campanha')['interacoes'].sum().rename('conversoes')
+    eficiencia = pd.concat([conversoes, total_interacoes], axis=1, join='inner').reset_index()
+    eficiencia['taxa_conversao'] = (eficiencia['conversoes'] / eficiencia['total_interacoes']) * 100
+    campanhas = _tabela(fluxo, 'campanhas')
+    for coluna in ('data_inicio', 'data_fim'):
+        campanhas[coluna] = pd.to_datetime(campanhas[coluna])
+    return eficiencia.merge(campanhas, on='id_campanha')
+
+
+def engajamento_canais(fluxo):
+    interacoes = resumo_interacoes(fluxo).campanhas.merge(_tabela(fluxo, 'campanhas'), on='id_campanha')
+    return interacoes.groupby('canal_marketing')['interacoes'].sum().rename('total_interacoes').reset_index()
+
+
+def vendas_top_produtos_mensais(fluxo, n=3):
+    mensais = resumo_vendas(fluxo).produtos_mes.merge(_tabela(fluxo, 'produtos')[['id_produto', 'nome_produto']], on='id_produto')
+    top = mensais.groupby('nome_produto')['quantidade'].sum().nlargest(n).index
+    mensais = mensais[mensais['nome_produto'].isin(top)].groupby(['mes_indice', 'nome_produto'])['quantidade'].sum().reset_index()
+    mensais.insert(0, 'mes_ano', analises.rotulo_mes(mensais.pop('mes_indice')))
+    return mensais
+
+
+def desempenho_regional(fluxo):
+    clientes = _tabela(fluxo, 'clientes')[['id_cliente', 'cidade']]
+    vendas_cidade = resumo_vendas(fluxo).clientes.merge(clientes, on='id_cliente').groupby('cidade')['valor_total'].sum().reset_index()
+    interacoes = resumo_interacoes(fluxo).clientes.rename('interacoes').rename_axis('id_cliente').reset_index()
+    int_cidade = interacoes.merge(clientes, on='id_cliente').groupby('cidade')['interacoes'].sum().reset_index()
+    regional = vendas_cidade.merge(int_cidade, on='cidade')
+    regional['vendas_por_interacao'] = regional['valor_total'] / regional['interacoes']
+    return regional
+
+
+def churn_clientes(fluxo, dias_inatividade=90):
+    clientes = resumo_vendas(fluxo).clientes
+    ultima_compra = pd.DataFrame({
+        'id_cliente': clientes['id_cliente'],
+        'ultima_compra': _datas(clientes['ultimo']),
+        'dias_sem_comprar': clientes['ultimo'].max() - clientes['ultimo'],
+    })
+    return analises._status_churn(ultima_compra, dias_inatividade)
+
+
+def coortes(fluxo):
+    atividade = resumo_vendas(fluxo).atividade
+    ativos = pd.DataFrame({'id_cliente': atividade // _MESES, 'mes': atividade % _MESES})
+    ativos['coorte'] = ativos.groupby('id_cliente')['mes'].transform('min')
+    ativos['periodo'] = ativos['mes'] - ativos['coorte']
+    return ativos.groupby(['coorte', 'periodo']).size().reset_index(name='clientes')
+
+
+def retencao_mensal(fluxo):
+    return analises.retencao_de_coortes(coortes(fluxo))
+
+
+def classificacao_clientes(fluxo, segmentacao='legado'):
+    clientes = resumo_vendas(fluxo).clientes
+    metricas_clientes = pd.DataFrame({
+        'id_cliente': clientes['id_cliente'],
+        'valor_total': clientes['valor_total'],
+        'ticket_medio': clientes['valor_total'] / clientes['frequencia'],
+        'frequencia': clientes['frequencia'],
+        'primeira_compra': _datas(clientes['primeiro']),
+        'ultima_compra': _datas(clientes['ultimo']),
+        'recencia': clientes['ultimo'].max() - clientes['ultimo'],
+    })
+    return rfm.segmentar(metricas_clientes, segmentacao)
+
+
+def atribuicao_campanhas(fluxo, modelo='ultimo_toque', janela_dias=atribuicao.JANELA_DIAS,
+                         meia_vida_dias=atribuicao.MEIA_VIDA_DIAS):
+    # O as-of join precisa de todas as interações de um cliente juntas: os
+    # clientes são divididos em faixas de id que cabem no orçamento, e cada faixa
+    # lê as próprias vendas e interações (uma leitura das tabelas por faixa)
+    with closing(analises_sql.conectar(fluxo.db_path)) as conn:
+        menor, maior, interacoes = conn.execute(
+            "SELECT MIN(id_cliente), MAX(id_cliente), COUNT(*) FROM Interacoes_Marketing").fetchone()
+        base = conn.execute("""
+            SELECT MIN(t) FROM (SELECT MIN(CAST(strftime('%s', data_venda) AS INTEGER)) AS t FROM Vendas
+                                UNION ALL
+                                SELECT MIN(CAST(strftime('%s', data_interacao) AS INTEGER)) FROM Interacoes_Marketing)
+        """).fetchone()[0] or 0
+    receita = vendas = pd.Series(dtype=float)
+    faixas = max(1, -(-(interacoes or 0) * BYTES_POR_TOQUE // int(fluxo.orcamento_mb * _MB)))
+    limites = np.linspace(menor or 0, (maior or 0) + 1, faixas + 1).astype(np.int64)
+    for inicio, fim in zip(limites[:-1], limites[1:]):
+        with closing(analises_sql.conectar(fluxo.db_path)) as conn:
+            t_cliente, t_tempo, t_campanha = atribuicao._ler_colunas(conn, """
+                SELECT id_cliente, CAST(strftime('%s', data_interacao) AS INTEGER), id_campanha
+                FROM Interacoes_Marketing
+                WHERE id_cliente >= ? AND id_cliente < ? AND id_campanha IS NOT NULL AND data_interacao IS NOT NULL
+                ORDER BY id_interacao
+            """, (int(inicio), int(fim)), (np.int64, np.int64, np.int64))
+            v_cliente, v_tempo, v_valor = atribuicao._ler_colunas(conn, """
+                SELECT id_cliente, CAST(strftime('%s', data_venda) AS INTEGER), valor_total
+                FROM Vendas WHERE id_cliente >= ? AND id_cliente < ? AND data_venda IS NOT NULL
+            """, (int(inicio), int(fim)), (np.int64, np.int64, np.float64))
+        toques = atribuicao.preparar(t_cliente, t_tempo, t_campanha, base)
+        r, v = atribuicao.atribuir(toques, v_cliente, v_tempo, v_valor, modelo, janela_dias, meia_vida_dias)
+        receita = receita.add(pd.Series(r, index=toques.ids_campanha), fill_value=0)
+        vendas = vendas.add(pd.Series(v, index=toques.ids_campanha), fill_value=0)
+    campanhas = _tabela(fluxo, 'campanhas')
+    return atribuicao.resumo(campanhas, receita.index.to_numpy(), receita.to_numpy(), vendas.reindex(receita.index).to_numpy())
@@ -0,0 +1,116 @@
+import sqlite3
+from contextlib import closing
+from types import MappingProxyType
+
+import pandas as pd
+
+import ingestao
+import instrumentacao
+import snapshot
+
+# Carga e normalização das tabelas, feita uma única vez por banco: datas viram
+# datetime64, textos de baixa cardinalidade viram categorias, ids e quantidades
+# são reduzidos ao menor inteiro que os comporta e as chaves de período usadas
+# pelas análises já ficam calculadas. O resultado é compartilhado somente
+# leitura entre reruns e sessões, por isso nenhuma análise deve alterá-lo.
+
+TABELAS = {
+    'clientes': 'Clientes',
+    'campanhas': 'Campanhas_Marketing',
+    'interacoes': 'Interacoes_Marketing',
+    'produtos': 'Produtos',
+    'vendas': 'Vendas',
+}
+
+DATAS = {
+    'campanhas': ['data_inicio', 'data_fim'],
+    'interacoes': ['data_interacao'],
+    'vendas': ['data_venda'],
+}
+
+CATEGORIAS = {
+    'clientes': ['cidade', 'segmento'],
+    'campanhas': ['canal_marketing'],
+    'interacoes': ['tipo_interacao'],
+    'produtos': ['categoria'],
+    'vendas': ['canal_aquisicao'],
+}
+
+INTEIROS = {
+    'clientes': ['id_cliente'],
+    'campanhas': ['id_campanha'],
+    'interacoes': ['id_interacao', 'id_cliente', 'id_campanha'],
+    'produtos': ['id_produto'],
+    'vendas': ['id_venda', 'id_cliente', 'id_produto', 'id_campanha', 'quantidade'],
+}
+
+# Coluna de data de cada tabela que recebe as chaves de período
+PERIODOS = {
+    'interacoes': 'data_interacao',
+    'vendas': 'data_venda',
+}
+
+
+def indice_mes(datas):
+    # Mês absoluto (ano * 12 + mês - 1): ordena e subtrai como inteiro
+    return (datas.dt.year * 12 + datas.dt.month - 1).astype('int32')
+
+
+def normalizar_tabela(nome, df):
+    df = df.copy()
+    for coluna in DATAS.get(nome, []):
+        df[coluna] = pd.to_datetime(df[coluna])
+    for coluna in CATEGORIAS.get(nome, []):
+        df[coluna] = df[coluna].astype('category')
+    for coluna in INTEIROS.get(nome, []):
+        # Colunas com nulos (ex.: Vendas.id_campanha) permanecem como estão
+        if df[coluna].notna().all():
+            df[coluna] = pd.to_numeric(df[coluna], downcast='integer')
+    if nome in PERIODOS:
+        datas = df[PERIODOS[nome]]
+        df['mes_indice'] = indice_mes(datas)
+        df['mes'] = datas.dt.month.astype('int8')
+    return df
+
+
+def normalizar(tables):
+    normalizadas = {}
+    for nome, df in tables.items():
+        with instrumentacao.etapa(f'tabelas.normalizar[{nome}]', linhas=len(df)):
+            normalizadas[nome] = normalizar_tabela(nome, df)
+    return MappingProxyType(normalizadas)
+
+
+def colunas_originais(conn, tabela):
+    # Colunas da tabela sem as de dia acrescentadas pela ingestão (as análises
+    # em memória calculam as próprias chaves de período)
+    colunas = [linha[1] for linha in conn.execute(f'PRAGMA table_info("{tabela}")')]
+    return ', '.join(f'"{c}"' for c in colunas if c not in ingestao.DERIVADAS)
+
+
+def ler_sqlite(db_path):
+    tables = {}
+    with closing(ingestao.configurar_leitura(sqlite3.connect(db_path))) as conn:
+        for nome, tabela in TABELAS.items():
+            with instrumentacao.etapa(f'tabelas.ler_sqlite[{nome}]') as registro:
+                tables[nome] = pd.read_sql_query(f"SELECT {colunas_originais(conn, tabela)} FROM {tabela}", conn)
+                registro['linhas'] = len(tables[nome])
+    return normalizar(tables)
+
+
+@instrumentacao.medir()
+def carregar_tabelas(db_path, usar_snapshot=True, chave=None):
+    # Com snapshot, só a primeira carga de um conteúdo passa pelo SQLite.
+    # chave: hash do conteúdo, quando já conhecido (ex.: bancos enviados)
+    if not usar_snapshot or not snapshot.disponivel():
+        return ler_sqlite(db_path)
+    chave = chave or snapshot.hash_arquivo(db_path)
+    tables = snapshot.ler(db_path, chave)
+    if tables is None:
+        privadas = ler_sqlite(db_path)
+        snapshot.gravar(db_path, chave, privadas)
+        # Quem grava também passa a usar as tabelas mapeadas, compartilhadas entre processos
+        tables = snapshot.ler(db_path, chave)
+        if tables is None:
+            tables = privadas
+    return tables
@@ -0,0 +1,17 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import gerador  # noqa: E402
+
+# Banco sintético pequeno (gerador.py), gerado uma vez por execução dos testes
+
+
+@pytest.fixture(scope='session')
+def banco(tmp_path_factory):
+    caminho = str(tmp_path_factory.mktemp('dados') / 'vendas.db')
+    gerador.gerar(caminho, vendas=3_000, semente=7)
+    return caminho
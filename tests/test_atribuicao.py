@@ -0,0 +1,48 @@
+import shutil
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import atribuicao
+
+# Linhas com cliente, campanha ou data nulos: o caminho em DataFrames deve
+# ignorá-las como ler_banco (WHERE ... IS NOT NULL), sem quebrar nem distorcer
+
+
+@pytest.fixture(scope='module')
+def banco_com_nulos(banco, tmp_path_factory):
+    caminho = str(tmp_path_factory.mktemp('nulos') / 'vendas.db')
+    shutil.copy(banco, caminho)
+    with closing(sqlite3.connect(caminho)) as conn:
+        conn.execute("UPDATE Vendas SET id_cliente = NULL WHERE id_venda % 17 = 0")
+        conn.execute("UPDATE Vendas SET data_venda = NULL WHERE id_venda % 19 = 0")
+        conn.execute("UPDATE Interacoes_Marketing SET id_cliente = NULL WHERE id_interacao % 13 = 0")
+        conn.execute("UPDATE Interacoes_Marketing SET id_campanha = NULL WHERE id_interacao % 11 = 0")
+        conn.execute("UPDATE Interacoes_Marketing SET data_interacao = NULL WHERE id_interacao % 7 = 0")
+        conn.commit()
+    return caminho
+
+
+def _tabela(db_path, tabela, data):
+    with closing(sqlite3.connect(db_path)) as conn:
+        df = pd.read_sql_query(f"SELECT * FROM {tabela}", conn)
+    df[data] = pd.to_datetime(df[data])
+    return df
+
+
+@pytest.mark.parametrize('modelo', list(atribuicao.MODELOS))
+def test_nulos_ignorados_como_no_banco(banco_com_nulos, modelo):
+    vendas = _tabela(banco_com_nulos, 'Vendas', 'data_venda')
+    interacoes = _tabela(banco_com_nulos, 'Interacoes_Marketing', 'data_interacao')
+    campanhas = _tabela(banco_com_nulos, 'Campanhas_Marketing', 'data_inicio')
+    assert vendas['id_cliente'].isna().any() and interacoes['data_interacao'].isna().any()
+
+    esperado = atribuicao.atribuicao_do_banco(banco_com_nulos, modelos=(modelo,))[modelo]
+    resultado = atribuicao.atribuicao_campanhas(vendas, interacoes, campanhas, modelo)
+    assert esperado['receita_atribuida'].sum() > 0
+    por_campanha = resultado.set_index('id_campanha').loc[esperado['id_campanha']]
+    np.testing.assert_allclose(por_campanha['receita_atribuida'], esperado['receita_atribuida'], rtol=1e-9)
+    np.testing.assert_allclose(por_campanha['vendas_atribuidas'], esperado['vendas_atribuidas'], rtol=1e-9)
@@ -0,0 +1,45 @@
+import pytest
+
+import analises
+import analises_polars
+import paridade
+import tabelas
+
+# Cada análise de cada motor contra o motor de referência (analises.py), com as
+# mesmas regras de comparação do paridade.py, em um banco gerado pelo gerador.py
+
+
+@pytest.fixture(scope='module')
+def tables(banco):
+    return tabelas.carregar_tabelas(banco, usar_snapshot=False)
+
+
+@pytest.fixture(scope='module')
+def fontes(banco, tables):
+    # Fonte de cada motor, preparada uma vez por módulo na primeira análise que a usa
+    preparadas = {}
+
+    def fonte(motor):
+        if motor not in preparadas:
+            preparadas[motor] = paridade.MOTORES[motor][1](banco, tables)
+        return preparadas[motor]
+    return fonte
+
+
+def _rotulo(analise):
+    nome, args = analise
+    return f"{nome}({', '.join(args)})" if args else nome
+
+
+@pytest.mark.filterwarnings('ignore::UserWarning')
+@pytest.mark.parametrize('analise', paridade.ANALISES, ids=_rotulo)
+@pytest.mark.parametrize('motor', list(paridade.MOTORES))
+def test_motor_confere_com_referencia(motor, analise, tables, fontes):
+    nome, args = analise
+    modulo = paridade.MOTORES[motor][0]
+    if motor == 'polars' and not analises_polars.disponivel():
+        pytest.skip("polars não instalado")
+    if not hasattr(modulo, nome) or nome in paridade.IGNORADAS.get(motor, ()):
+        pytest.skip(f"{motor} não implementa {nome}")
+    esperado = getattr(analises, nome)(tables, *args)
+    assert paridade.diferenca(getattr(modulo, nome)(fontes(motor), *args), esperado) is None